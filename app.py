@@ -1,6 +1,31 @@
+import io
 import os
+import re
+import sys
+import time
+import math
+import mmap
+import struct
 import csv
+import json
 import uuid
+import zlib
+import hashlib
+import sqlite3
+import tempfile
+import zipfile
+import base64
+import functools
+import asyncio
+import threading
+import socket
+import contextlib
+import contextvars
+import multiprocessing
+from collections import Counter, OrderedDict, namedtuple
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
 
 from flask import (
     Flask,
@@ -8,12 +33,45 @@ from flask import (
     request,
     redirect,
     url_for,
+    Response,
+    stream_with_context,
+    session,
+    g,
+    has_request_context,
+    jsonify,
+    flash,
+    abort,
     send_file,
-    flash
+    before_render_template,
+    template_rendered
 )
+import click
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy import and_, or_, case, exists, event, func, text, table, column, literal_column
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_connection
+from markupsafe import Markup
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 
+try:
+    from PIL import Image as PILImage, ImageOps, features as pil_features
+except ImportError:   # Pillow is optional; without it pages show the original images
+    PILImage = None
+
+try:
+    import aiosqlite   # the driver behind SQLAlchemy's sqlite+aiosqlite dialect
+    from greenlet import getcurrent as current_greenlet   # what async views run in
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+except ImportError:   # aiosqlite is optional; without it the ASGI mode runs every request on threads
+    aiosqlite = None
+    current_greenlet = None
+
 
 # ------------------------------------------------------------------------------
 # Configuration
@@ -23,11 +81,204 @@ app.config['SECRET_KEY'] = 'replace_with_a_secure_random_key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///camping_gear.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Applied to every new SQLite connection.  WAL lets readers run alongside the
+# writer; NORMAL sync is safe under WAL and avoids an fsync per commit.
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,                 # ms to wait on a locked database
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,             # negative means KiB, so 64 MB
+    'temp_store': 'MEMORY',
+}
+# Connections pooled per worker process; size to the worker's thread count
+app.config['DB_POOL_SIZE'] = 5
+app.config['DB_MAX_OVERFLOW'] = 5
+# Serve GET/HEAD requests from a separate read-only connection pool
+app.config['DB_READ_ONLY_ROUTES'] = True
+
+# ASGI mode (uvicorn app:asgi_app; needs aiosqlite): GETs of these read-heavy
+# pages run on the event loop with queries awaiting aiosqlite, so many slow
+# clients don't each tie up a thread.  Other requests run on ASGI_THREADS threads.
+app.config['ASYNC_ENDPOINTS'] = ['home', 'view_packlists', 'show_packlist', 'api_list_items']
+# aiosqlite connections per worker process (each has one background thread)
+app.config['ASYNC_DB_POOL_SIZE'] = 8
+app.config['ASGI_THREADS'] = 8
+
+# Number of items shown per page of the inventory list
+app.config['ITEMS_PER_PAGE'] = 100
+
+# Rows per INSERT/commit when importing a CSV file
+app.config['IMPORT_BATCH_SIZE'] = 1000
+# Row errors kept for the import report (the rest are only counted)
+app.config['IMPORT_MAX_ERRORS'] = 200
+
+# Rows fetched from the database at a time while exporting a CSV file
+app.config['EXPORT_BATCH_SIZE'] = 1000
+# Gzip the CSV export on the fly for clients that accept it
+app.config['EXPORT_GZIP'] = True
+
+# Unit assumed for weights entered as a bare number (e.g. "12")
+app.config['DEFAULT_WEIGHT_UNIT'] = 'oz'
+
 # For image uploads
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
+
+# Thumbnails are written next to the uploads, one file per size (longest edge in px)
+app.config['THUMBNAIL_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbs')
+app.config['THUMBNAIL_SIZES'] = {'sm': 100, 'md': 400}
+
+# Background jobs (CSV imports and exports, thumbnails) wait in the job table
+# for a worker.  Set JOB_WORKER_POOL when a pool of worker processes serves the
+# queue (flask --app app run-jobs --processes N), or JOB_WORKER_THREADS to run
+# that many worker threads inside each web process; `python app.py` runs two
+# alongside the development server.  With neither, a request runs the jobs it
+# queued itself before it answers.
+app.config['JOB_WORKER_POOL'] = False
+app.config['JOB_WORKER_THREADS'] = 0
+# Seconds an idle worker waits before looking at the queue again
+app.config['JOB_POLL_INTERVAL'] = 1.0
+# A running job that reports no progress for this many seconds is assumed
+# crashed and goes back on the queue; after JOB_MAX_ATTEMPTS runs it fails
+app.config['JOB_STALE_AFTER'] = 60
+app.config['JOB_MAX_ATTEMPTS'] = 3
+# Uploaded import files and finished exports; removed with their job after JOB_RETENTION_DAYS
+app.config['JOB_FOLDER'] = os.path.join(app.instance_path, 'jobs')
+app.config['JOB_RETENTION_DAYS'] = 7
+
+# Most entries accepted by one JSON API batch request
+app.config['API_MAX_BATCH'] = 1000
+
+# Packlist generator: keywords whose items go on every generated list, and
+# keywords whose items are packed once per trip day (food, fuel)
+app.config['GENERATOR_ALWAYS_KEYWORDS'] = ['Base Gear']
+app.config['GENERATOR_PER_DAY_KEYWORDS'] = ['Food', 'Per Day']
+
+# Offline climate normals for smart packing: the grid file (built with
+# `flask build-climate-grid`), how many trip lookups to keep cached, and
+# keywords added to generated lists when a trip's predicted conditions cross
+# a threshold, as [field, 'below' or 'above', value, keyword]
+app.config['CLIMATE_NORMALS_PATH'] = os.path.join(app.instance_path, 'climate_normals.bin')
+app.config['CLIMATE_CACHE_SIZE'] = 4096
+app.config['CLIMATE_KEYWORD_RULES'] = [
+    ['low_c', 'below', 0, 'Freezing'],
+    ['high_c', 'above', 30, 'Hot'],
+    ['precip_mm', 'above', 100, 'Rain'],
+]
+
+# Saved locations (campsites, trailheads): the radius (km) a nearest-location
+# search starts from before widening, and the most results per map-box query
+app.config['LOCATION_SEARCH_RADIUS_KM'] = 10
+app.config['LOCATION_MAX_RESULTS'] = 5000
+
+# In-process cache of rendered inventory tables: total size in bytes, plus an
+# optional directory for a second, file-backed tier shared between workers
+app.config['FRAGMENT_CACHE_BYTES'] = 32 * 1024 * 1024
+app.config['FRAGMENT_CACHE_DIR'] = None
+
+# Cache lifetime for content-addressed uploads, which never change once written
+app.config['IMMUTABLE_MAX_AGE'] = 365 * 24 * 60 * 60
+
+# Opt-in instrumentation: time each request's SQL, template rendering and file
+# I/O, report it in a Server-Timing header and as Prometheus metrics at
+# /metrics, and log a warning when one request runs the same SELECT at least
+# INSTRUMENTATION_N_PLUS_ONE times (an N+1 query pattern)
+app.config['INSTRUMENTATION'] = False
+app.config['INSTRUMENTATION_N_PLUS_ONE'] = 10
+# Upper bounds (seconds) of the request duration histogram buckets
+app.config['METRICS_BUCKETS'] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Sampling profiler (needs INSTRUMENTATION): samples request stacks every
+# PROFILER_INTERVAL_MS and keeps the PROFILER_KEEP slowest requests' stacks in
+# PROFILER_DIR as folded-stack files for flamegraph.pl or speedscope
+app.config['PROFILER_ENABLED'] = False
+app.config['PROFILER_INTERVAL_MS'] = 5
+app.config['PROFILER_KEEP'] = 20
+app.config['PROFILER_DIR'] = os.path.join(app.instance_path, 'profiles')
+
+# Any setting above can be overridden from the environment with a FLASK_ prefix,
+# e.g. FLASK_SQLALCHEMY_DATABASE_URI=... or FLASK_DB_POOL_SIZE=8
+app.config.from_prefixed_env()
+
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+
+
+# ------------------------------------------------------------------------------
+# Database Setup
+# ------------------------------------------------------------------------------
+def sqlite_in_memory(uri):
+    """True for an in-memory SQLite database URI."""
+    url = make_url(uri)
+    return (url.drivername.startswith('sqlite')
+            and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'))
+
+
+def sqlite_read_only_uri(uri):
+    """
+    Returns a read-only (mode=ro) version of a SQLite file database URI,
+    or None for in-memory or non-SQLite databases.
+    """
+    url = make_url(uri)
+    if not url.drivername.startswith('sqlite') or sqlite_in_memory(uri):
+        return None
+    database = url.database if url.query.get('uri') else 'file:' + url.database
+    return url.set(database=database).update_query_dict({'mode': 'ro', 'uri': 'true'}).render_as_string()
+
+
+# In-memory databases get a single shared connection (StaticPool), which takes no pool size
+engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+if 'poolclass' not in engine_options and not sqlite_in_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+    engine_options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+    engine_options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+read_only_uri = sqlite_read_only_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+if app.config['DB_READ_ONLY_ROUTES'] and read_only_uri:
+    app.config.setdefault('SQLALCHEMY_BINDS', {})['read_only'] = read_only_uri
+
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tunes each new SQLite connection with SQLITE_PRAGMAS."""
+    if not isinstance(dbapi_connection, (sqlite3.Connection, AsyncAdapt_aiosqlite_connection)):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
 
-db = SQLAlchemy(app)
+# The aiosqlite connection of a GET being served on the event loop; see "Async Serving"
+async_read_connection = contextvars.ContextVar('async_read_connection', default=None)
+
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """
+    Sends queries made while handling a GET/HEAD request to the read-only
+    engine, so page views never queue behind writers for a pooled connection.
+    Everything else (POSTs, CLI commands, background threads) uses the default engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and async_read_connection.get() is not None:
+            return async_read_connection.get()
+        if (bind is None and not self._flushing
+                and has_request_context() and request.method in ('GET', 'HEAD')):
+            read_only_engine = self._db.engines.get('read_only')
+            if read_only_engine is not None:
+                return read_only_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+
+def _dispose_engines_after_fork():
+    # Connections must not be shared with a parent process (e.g. gunicorn --preload)
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines_after_fork)
 
 
 # ------------------------------------------------------------------------------
@@ -37,27 +288,159 @@ class Item(db.Model):
     """Represents a single piece of camping gear."""
     id = db.Column(db.Integer, primary_key=True)
     item_number = db.Column(db.String(50), unique=True, nullable=False)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
     weight = db.Column(db.String(50), nullable=True)
+    # Normalized copy of `weight` in grams, kept up to date by the validator below
+    weight_grams = db.Column(db.Float, nullable=True, index=True)
     season = db.Column(db.String(50), nullable=True)
     keywords = db.Column(db.String(200), nullable=True)
     category = db.Column(db.String(100), nullable=True)
     image_path = db.Column(db.String(200), nullable=True)
     url = db.Column(db.String(200), nullable=True)
-    quantity = db.Column(db.Integer, nullable=False, default=1)
+    quantity = db.Column(db.Integer, nullable=False, default=1, index=True)
+
+    @db.validates('weight')
+    def _parse_weight(self, key, value):
+        self.weight_grams = parse_weight(value)
+        return value
 
     def __repr__(self):
         return f"<Item {self.name}>"
 
 
+class PackListInclude(db.Model):
+    """A packlist including a pack template, whose items then count as its own."""
+    packlist_id = db.Column(db.Integer, db.ForeignKey('pack_list.id'), primary_key=True)
+    # "Which lists use this template?" is answered from this index
+    template_id = db.Column(db.Integer, db.ForeignKey('pack_list.id'), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f"<PackListInclude {self.packlist_id} -> {self.template_id}>"
+
+
+class PackListExclusion(db.Model):
+    """An item a packlist leaves out even though one of its templates has it."""
+    packlist_id = db.Column(db.Integer, db.ForeignKey('pack_list.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+
+    def __repr__(self):
+        return f"<PackListExclusion {self.packlist_id}/{self.item_id}>"
+
+
+class Tag(db.Model):
+    """
+    A keyword or season, normalized: `name` is the lower-cased form used for
+    matching, `label` the spelling it was first entered with.
+    """
+    __table_args__ = (
+        db.Index('uq_tag_kind_name', 'kind', 'name', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)   # 'keyword' or 'season'
+    name = db.Column(db.String(200), nullable=False)
+    label = db.Column(db.String(200), nullable=False)
+
+    def __repr__(self):
+        return f"<Tag {self.kind}:{self.label}>"
+
+
+class ItemTag(db.Model):
+    """
+    The inverted index: one row per (tag, item).  Keyed tag-first without a
+    rowid, so a tag's items are one range scan of the primary key.
+    """
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True, index=True)
+
+
+class Location(db.Model):
+    """
+    A saved spot (campsite, trailhead), usually imported from GPX or KML.
+    Spatial lookups go through the location_rtree index; see "Location Index".
+    """
+    # Re-importing the same bookmarks file doesn't duplicate its spots
+    __table_args__ = (
+        db.Index('uq_location_lat_lon_name', 'lat', 'lon', 'name', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    elevation_m = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<Location {self.name}>"
+
+
+class DataVersion(db.Model):
+    """
+    Change counter for a group of tables ('item' or 'pack_list').
+    Bumped by triggers on every write, and used to build ETags for cached pages.
+    """
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Integer, nullable=False, default=0)   # unix time
+
+    def __repr__(self):
+        return f"<DataVersion {self.table_name}={self.version}>"
+
+
+class PackListSummary(db.Model):
+    """
+    Rollup of one packlist's entries in one category: how many entries, how
+    many pieces (sum of item_quantity) and their weight (grams x quantity).
+    Maintained by triggers; see "Packlist Rollups" below.
+    """
+    packlist_id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)   # '' for uncategorized
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    weight_grams = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<PackListSummary {self.packlist_id}/{self.category!r}>"
+
+
+# Sort keys for the nullable columns of the inventory list.  Items without a
+# value sort first, and the keyset cursor always has a concrete value to resume
+# from.  Each has a matching expression index, and since SQLite appends the
+# rowid (Item.id) to every index entry, ORDER BY key, id LIMIT n is a straight
+# index walk instead of a full scan plus temp B-tree sort.
+weight_sort_key = func.coalesce(Item.weight_grams, -1)
+season_sort_key = func.coalesce(Item.season, '')
+category_sort_key = func.coalesce(Item.category, '')
+db.Index('ix_item_weight_sort', weight_sort_key)
+db.Index('ix_item_season_sort', season_sort_key)
+db.Index('ix_item_category_sort', category_sort_key)
+
+
 class PackList(db.Model):
     """Represents a named packlist, which can hold many items."""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    # Pack templates ("Base Gear", "Survival Kit") are packlists other lists can include
+    is_template = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    # The campsite or trailhead the trip is to, if any
+    location_id = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=True)
+    location = db.relationship('Location')
 
     # Relationship to PackListItem (the join table)
     items = db.relationship('PackListItem', backref='packlist', cascade='all, delete-orphan')
+    # Templates this list includes by reference; see "Pack Templates" below
+    templates = db.relationship(
+        'PackList',
+        secondary='pack_list_include',
+        primaryjoin='PackList.id == PackListInclude.packlist_id',
+        secondaryjoin='PackList.id == PackListInclude.template_id',
+        order_by='PackList.name',
+        viewonly=True,
+    )
 
     def __repr__(self):
         return f"<PackList {self.name}>"
@@ -65,9 +448,15 @@ class PackList(db.Model):
 
 class PackListItem(db.Model):
     """Join table associating PackList and Item, possibly with a quantity."""
+    # An item can only appear once per packlist
+    __table_args__ = (
+        db.Index('uq_pack_list_item_packlist_item', 'packlist_id', 'item_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     packlist_id = db.Column(db.Integer, db.ForeignKey('pack_list.id'), nullable=False)
-    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    # packlist_id lookups use the leading column of the unique index above
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False, index=True)
     
     # Optionally store the quantity of this item specifically in this packlist
     item_quantity = db.Column(db.Integer, default=1)
@@ -79,366 +468,4469 @@ class PackListItem(db.Model):
         return f"<PackListItem packlist={self.packlist_id} item={self.item_id}>"
 
 
+class Job(db.Model):
+    """
+    A background job (CSV import or export, thumbnails) and how far it got.
+    payload and result are JSON; see "Background Jobs" below.
+    """
+    # Workers look for the oldest queued job
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)     # a key of JOB_HANDLERS
+    status = db.Column(db.String(20), nullable=False, default='queued')   # queued, running, done, failed
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)        # None while unknown
+    # Where a resumed run picks up (a CSV line, an image number); None to start over
+    checkpoint = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # Runs so far; a worker's claim is only good while this is unchanged
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100), nullable=True)
+    # Unix times
+    created_at = db.Column(db.Integer, nullable=False)
+    started_at = db.Column(db.Integer, nullable=True)
+    heartbeat_at = db.Column(db.Integer, nullable=True)
+    finished_at = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
+
+
 # ------------------------------------------------------------------------------
-# Helper Functions
+# Full-Text Search
 # ------------------------------------------------------------------------------
-def generate_item_number():
-    """Generates a unique item number."""
-    return str(uuid.uuid4())[:8]
+# FTS5 index shadowing the item table.  It is an "external content" table, so
+# it stores only the index and reads the text back from `item`.  The triggers
+# keep it in sync on every insert/update/delete, whichever route did the write.
+item_fts = table('item_fts', column('rowid'))
+
+SEARCH_INDEX_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+        name, description, category, season, keywords,
+        content='item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_ai AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts(rowid, name, description, category, season, keywords)
+        VALUES (new.id, new.name, new.description, new.category, new.season, new.keywords);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_ad AFTER DELETE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description, category, season, keywords)
+        VALUES ('delete', old.id, old.name, old.description, old.category, old.season, old.keywords);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_au
+    AFTER UPDATE OF name, description, category, season, keywords ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description, category, season, keywords)
+        VALUES ('delete', old.id, old.name, old.description, old.category, old.season, old.keywords);
+        INSERT INTO item_fts(rowid, name, description, category, season, keywords)
+        VALUES (new.id, new.name, new.description, new.category, new.season, new.keywords);
+    END
+    """,
+]
 
 
+def init_search_index():
+    """
+    Creates the FTS5 index and its sync triggers if they don't exist yet.
+    A freshly created index is rebuilt from the items already in the database.
+    """
+    table_exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'item_fts'")
+    ).first()
+    for statement in SEARCH_INDEX_SQL:
+        db.session.execute(text(statement))
+    if not table_exists:
+        db.session.execute(text("INSERT INTO item_fts(item_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
 
+def build_match_query(filter_text):
+    """
+    Turns free text from the search box into an FTS5 MATCH expression.
+    Every word must match, and each one matches as a prefix ("ten" finds "tent").
+    Returns None if there is nothing searchable in the text.
+    """
+    words = re.findall(r'\w+', filter_text)
+    if not words:
+        return None
+    return ' '.join('"{}"*'.format(word) for word in words)
 
 
 # ------------------------------------------------------------------------------
-# Routes for Items
+# Tag Index
 # ------------------------------------------------------------------------------
-@app.route('/')
-def home():
+# Item.keywords and Item.season stay as typed ("Winter, Car Camp, "); triggers
+# split them into `tag` and `item_tag` on every write, whichever route made it
+# (the sqlite3 shell and other SQLite clients included).  The splitting is
+# plain SQL, a recursive CTE, so the triggers need nothing from this app.
+TAG_COLUMNS = {'keyword': 'keywords', 'season': 'season'}   # tag kind -> item column
+
+
+def split_tags_sql(items):
     """
-    Show the list of items with optional sorting and filtering.
-    Also display a dropdown of existing packlists to add items to.
+    A subquery splitting comma-separated keywords/season strings into
+    (item_id, name, label) rows, dropping blanks; `items` is a SELECT of
+    (item id, string).  Labels are trimmed with inner whitespace collapsed,
+    and names are their lower() form: "Winter, car  Camp, " ->
+    ('winter', 'Winter'), ('car camp', 'car Camp').  Rows of an item come in
+    the order written, so the first spelling of a repeated tag wins.
     """
-    # 1. Grab sort parameters from query string
-    sort_col = request.args.get('sort', 'id')   # default to 'id'
-    sort_order = request.args.get('order', 'asc')
+    return f"""(
+        WITH RECURSIVE
+        source(item_id, value) AS ({items}),
+        part(item_id, n, label, rest) AS (
+            SELECT item_id, 0, '',
+                   replace(replace(replace(coalesce(value, ''), char(9), ' '), char(10), ' '), char(13), ' ') || ','
+            FROM source
+            UNION ALL
+            SELECT item_id, n + 1, trim(substr(rest, 1, instr(rest, ',') - 1)), substr(rest, instr(rest, ',') + 1)
+            FROM part WHERE rest <> ''
+        ),
+        squeezed(item_id, n, label) AS (
+            SELECT item_id, n, label FROM part WHERE label <> ''
+            UNION ALL
+            SELECT item_id, n, replace(label, '  ', ' ') FROM squeezed WHERE instr(label, '  ')
+        )
+        SELECT item_id, lower(label) AS name, label FROM squeezed
+        WHERE NOT instr(label, '  ')
+        ORDER BY item_id, n
+    )"""
 
-    # 2. Grab filter parameter
-    filter_text = request.args.get('filter_text', '').strip()
 
-    # 3. Build query
-    query = Item.query
+def tag_rows_sql(kind, row):
+    """
+    Statements adding the tags of one item row ('new' in a trigger) to the
+    index.  They use ON CONFLICT DO NOTHING rather than INSERT OR IGNORE:
+    SQLite replaces a trigger's OR clause with the conflict policy of an
+    outer upsert (the CSV import), which would make existing tags fail.
+    """
+    tags = split_tags_sql(f"SELECT {row}.id, {row}.{TAG_COLUMNS[kind]}")
+    return f"""
+        INSERT INTO tag (kind, name, label)
+        SELECT '{kind}', name, label FROM {tags} WHERE true
+        ON CONFLICT DO NOTHING;
+        INSERT INTO item_tag (tag_id, item_id)
+        SELECT tag.id, tags.item_id
+        FROM {tags} AS tags
+        JOIN tag ON tag.kind = '{kind}' AND tag.name = tags.name WHERE true
+        ON CONFLICT DO NOTHING;
+    """
 
-    # 4. Apply filter if provided
-    if filter_text:
-        query = query.filter(
-            (Item.name.ilike(f'%{filter_text}%')) |
-            (Item.category.ilike(f'%{filter_text}%')) |
-            (Item.season.ilike(f'%{filter_text}%')) |
-            (Item.keywords.ilike(f'%{filter_text}%'))
-        )
 
-    # 5. Validate the column requested for sorting
-    valid_sort_columns = {
-        'id': Item.id,
-        'name': Item.name,
-        'weight': Item.weight,
-        'season': Item.season,
-        'category': Item.category,
-        'quantity': Item.quantity,
-    }
-    sort_column = valid_sort_columns.get(sort_col, Item.id)
+TAG_INDEX_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS item_tags_ai AFTER INSERT ON item BEGIN
+        {tag_rows_sql('keyword', 'new')}
+        {tag_rows_sql('season', 'new')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS item_tags_au AFTER UPDATE OF keywords, season ON item BEGIN
+        DELETE FROM item_tag WHERE item_id = old.id;
+        {tag_rows_sql('keyword', 'new')}
+        {tag_rows_sql('season', 'new')}
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_tags_ad AFTER DELETE ON item BEGIN
+        DELETE FROM item_tag WHERE item_id = old.id;
+    END
+    """,
+]
 
-    # 6. Apply sorting
-    if sort_order == 'desc':
-        query = query.order_by(sort_column.desc())
-    else:
-        query = query.order_by(sort_column.asc())
 
-    # 7. Execute query
-    items = query.all()
+def rebuild_tag_index():
+    """Re-splits every item's keywords and seasons into the tag index."""
+    db.session.execute(text("DELETE FROM item_tag"))
+    for kind, column in TAG_COLUMNS.items():
+        tags = split_tags_sql(f"SELECT id, {column} FROM item")
+        db.session.execute(text(
+            f"INSERT OR IGNORE INTO tag (kind, name, label) SELECT '{kind}', name, label FROM {tags}"
+        ))
+        db.session.execute(text(
+            f"""
+            INSERT OR IGNORE INTO item_tag (tag_id, item_id)
+            SELECT tag.id, tags.item_id
+            FROM {tags} AS tags
+            JOIN tag ON tag.kind = '{kind}' AND tag.name = tags.name
+            """
+        ))
+    db.session.commit()
 
-    # 8. Retrieve existing PackLists for the dropdown
-    packlists = PackList.query.order_by(PackList.name.asc()).all()
 
-    # 9. Render template, passing sorting/filter info for the UI
-    return render_template(
-        'index.html',
-        items=items,
-        packlists=packlists,
-        filter_text=filter_text,
-        sort_col=sort_col,
-        sort_order=sort_order
-    )
+def init_tag_index():
+    """Creates the tag tables and their triggers, then indexes the existing items."""
+    Tag.__table__.create(db.session.connection(), checkfirst=True)
+    ItemTag.__table__.create(db.session.connection(), checkfirst=True)
+    for statement in TAG_INDEX_SQL:
+        db.session.execute(text(statement))
+    rebuild_tag_index()
 
 
-@app.route('/add', methods=['GET', 'POST'])
-def add_item():
-    """
-    Add a new item to the database.
-    """
-    if request.method == 'POST':
-        name = request.form.get('name')
-        description = request.form.get('description')
-        weight = request.form.get('weight')
-        season = request.form.get('season')
-        keywords = request.form.get('keywords')
-        category = request.form.get('category')
-        url = request.form.get('url')
-        quantity = request.form.get('quantity', 1, type=int)
+@app.cli.command('rebuild-tags')
+def rebuild_tags_command():
+    """Re-split every item's keywords and seasons into the tag index."""
+    rebuild_tag_index()
+    print("Rebuilt the tag index.")
 
-        # Handle image upload
-        image = request.files.get('image')
-        image_path = None
-        if image and image.filename != '':
-            filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-        # Generate unique item number
-        item_number = generate_item_number()
+def tags_with_counts(kind):
+    """(Tag, number of items) for every tag of a kind that is in use, by label."""
+    return db.session.execute(
+        db.select(Tag, func.count(ItemTag.item_id))
+        .join(ItemTag, ItemTag.tag_id == Tag.id)
+        .where(Tag.kind == kind)
+        .group_by(Tag.id)
+        .order_by(func.lower(Tag.label))
+    ).all()
 
-        new_item = Item(
-            item_number=item_number,
-            name=name,
-            description=description,
-            weight=weight,
-            season=season,
-            keywords=keywords,
-            category=category,
-            image_path=image_path,
-            url=url,
-            quantity=quantity
-        )
-        db.session.add(new_item)
-        db.session.commit()
-        flash('Item added successfully!', 'success')
-        return redirect(url_for('home'))
 
-    return render_template('add_item.html')
+def tag_ids(kind, labels):
+    """Ids of the tags of a kind matching the labels (any case); unknown labels are skipped."""
+    # Split by the same SQL as the index, so names are lower-cased the same way
+    tags = split_tags_sql("SELECT 0, :labels")
+    return list(db.session.execute(
+        text(f"SELECT DISTINCT tag.id FROM {tags} AS tags JOIN tag ON tag.kind = :kind AND tag.name = tags.name"),
+        {'labels': ','.join(labels), 'kind': kind}
+    ).scalars())
 
 
-@app.route('/edit/<int:item_id>', methods=['GET', 'POST'])
-def edit_item(item_id):
+# ------------------------------------------------------------------------------
+# Packlist Rollups
+# ------------------------------------------------------------------------------
+# pack_list_summary holds each packlist's totals per category.  Triggers apply
+# the change from every write as a delta -- adding an entry adds its item's
+# weight x quantity to one row, re-weighing an item adjusts the rows of the
+# lists it is on -- so pages read totals without touching pack_list_item.
+def rollup_delta_sql(sign, source, packlist_id, category, quantity, weight_grams):
     """
-    Edit an existing item.
+    An upsert adding (sign 1) or taking away (sign -1) one entry per row of
+    `source` to the matching summary rows.  `source` must end in a WHERE
+    clause, which keeps SQLite from reading ON CONFLICT as a join constraint.
+    """
+    return f"""
+        INSERT INTO pack_list_summary (packlist_id, category, item_count, quantity, weight_grams)
+        SELECT {packlist_id}, COALESCE({category}, ''), {sign},
+               {sign} * COALESCE({quantity}, 1),
+               {sign} * COALESCE({weight_grams}, 0) * COALESCE({quantity}, 1)
+        {source}
+        ON CONFLICT (packlist_id, category) DO UPDATE SET
+            item_count = item_count + excluded.item_count,
+            quantity = quantity + excluded.quantity,
+            weight_grams = weight_grams + excluded.weight_grams;
     """
-    item = Item.query.get_or_404(item_id)
-    if request.method == 'POST':
-        item.name = request.form.get('name')
-        item.description = request.form.get('description')
-        item.weight = request.form.get('weight')
-        item.season = request.form.get('season')
-        item.keywords = request.form.get('keywords')
-        item.category = request.form.get('category')
-        item.url = request.form.get('url')
-        item.quantity = request.form.get('quantity', 1, type=int)
 
-        image = request.files.get('image')
-        if image and image.filename != '':
-            filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            item.image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-        db.session.commit()
-        flash('Item updated successfully!', 'success')
-        return redirect(url_for('home'))
+def prune_rollups_sql(packlist_filter):
+    """Drops summary rows left with no entries."""
+    return f"DELETE FROM pack_list_summary WHERE item_count <= 0 AND packlist_id {packlist_filter};"
 
-    return render_template('edit_item.html', item=item)
 
+ENTRY_ADDED = rollup_delta_sql(
+    1, "FROM item WHERE item.id = new.item_id",
+    'new.packlist_id', 'item.category', 'new.item_quantity', 'item.weight_grams')
+ENTRY_REMOVED = rollup_delta_sql(
+    -1, "FROM item WHERE item.id = old.item_id",
+    'old.packlist_id', 'item.category', 'old.item_quantity', 'item.weight_grams')
+ITEM_REMOVED = rollup_delta_sql(
+    -1, "FROM pack_list_item AS pli WHERE pli.item_id = old.id",
+    'pli.packlist_id', 'old.category', 'pli.item_quantity', 'old.weight_grams')
+ITEM_ADDED = rollup_delta_sql(
+    1, "FROM pack_list_item AS pli WHERE pli.item_id = new.id",
+    'pli.packlist_id', 'new.category', 'pli.item_quantity', 'new.weight_grams')
+ITEM_LISTS = "IN (SELECT packlist_id FROM pack_list_item WHERE item_id = old.id)"
 
-@app.route('/delete/<int:item_id>', methods=['POST'])
-def delete_item(item_id):
-    """
-    Delete an item.
+ROLLUP_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_entry_ai
+    AFTER INSERT ON pack_list_item BEGIN
+        {ENTRY_ADDED}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_entry_ad
+    AFTER DELETE ON pack_list_item BEGIN
+        {ENTRY_REMOVED}
+        {prune_rollups_sql('= old.packlist_id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_entry_au
+    AFTER UPDATE OF packlist_id, item_id, item_quantity ON pack_list_item BEGIN
+        {ENTRY_REMOVED}
+        {ENTRY_ADDED}
+        {prune_rollups_sql('= old.packlist_id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_item_au
+    AFTER UPDATE OF category, weight_grams ON item BEGIN
+        {ITEM_REMOVED}
+        {ITEM_ADDED}
+        {prune_rollups_sql(ITEM_LISTS)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_item_ad
+    AFTER DELETE ON item BEGIN
+        {ITEM_REMOVED}
+        {prune_rollups_sql(ITEM_LISTS)}
+    END
+    """,
     """
-    item = Item.query.get_or_404(item_id)
-    db.session.delete(item)
+    CREATE TRIGGER IF NOT EXISTS pack_list_summary_packlist_ad
+    AFTER DELETE ON pack_list BEGIN
+        DELETE FROM pack_list_summary WHERE packlist_id = old.id;
+    END
+    """,
+]
+
+
+def rebuild_packlist_rollups():
+    """Recomputes every packlist's summary rows from scratch in one grouped query."""
+    db.session.execute(text("DELETE FROM pack_list_summary"))
+    db.session.execute(text(
+        """
+        INSERT INTO pack_list_summary (packlist_id, category, item_count, quantity, weight_grams)
+        SELECT pli.packlist_id, COALESCE(item.category, ''), COUNT(*),
+               SUM(COALESCE(pli.item_quantity, 1)),
+               SUM(COALESCE(item.weight_grams, 0) * COALESCE(pli.item_quantity, 1))
+        FROM pack_list_item AS pli
+        JOIN item ON item.id = pli.item_id
+        JOIN pack_list ON pack_list.id = pli.packlist_id
+        GROUP BY pli.packlist_id, COALESCE(item.category, '')
+        """
+    ))
     db.session.commit()
-    flash('Item deleted successfully!', 'success')
-    return redirect(url_for('home'))
 
 
-# ------------------------------------------------------------------------------
-# CSV Import/Export (unchanged from your previous logic, except minor detail)
-# ------------------------------------------------------------------------------
-@app.route('/export_csv')
-def export_csv():
-    items = Item.query.all()
-    csv_filename = 'camping_items.csv'
-    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow([
-            'item_number', 'name', 'description', 'weight',
-            'season', 'keywords', 'category', 'image_path',
-            'url', 'quantity'
-        ])
-        for item in items:
-            writer.writerow([
-                item.item_number,
-                item.name,
-                item.description,
-                item.weight,
-                item.season,
-                item.keywords,
-                item.category,
-                item.image_path if item.image_path else '',
-                item.url if item.url else '',
-                item.quantity
-            ])
+def init_packlist_rollups():
+    """Creates the summary table and its triggers, then fills it from the existing packlists."""
+    PackListSummary.__table__.create(db.session.connection(), checkfirst=True)
+    for statement in ROLLUP_SQL:
+        db.session.execute(text(statement))
+    rebuild_packlist_rollups()
 
-    return send_file(
-        csv_filename,
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=csv_filename
-    )
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the packlist weight and quantity rollups."""
+    rebuild_packlist_rollups()
+    print("Rebuilt packlist rollups.")
 
-@app.route('/import_csv', methods=['GET', 'POST'])
-def import_csv():
-    if request.method == 'POST':
-        file = request.files.get('file')
-        if not file or file.filename == '':
-            flash('No file selected!', 'danger')
-            return redirect(url_for('import_csv'))
 
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        with open(filepath, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                existing_item = Item.query.filter_by(item_number=row['item_number']).first()
-                if existing_item:
-                    existing_item.name = row['name']
-                    existing_item.description = row['description']
-                    existing_item.weight = row['weight']
-                    existing_item.season = row['season']
-                    existing_item.keywords = row['keywords']
-                    existing_item.category = row['category']
-                    existing_item.image_path = row['image_path']
-                    existing_item.url = row['url']
-                    existing_item.quantity = int(row['quantity'])
-                else:
-                    new_item = Item(
-                        item_number=row['item_number'],
-                        name=row['name'],
-                        description=row['description'],
-                        weight=row['weight'],
-                        season=row['season'],
-                        keywords=row['keywords'],
-                        category=row['category'],
-                        image_path=row['image_path'],
-                        url=row['url'],
-                        quantity=int(row['quantity'])
-                    )
-                    db.session.add(new_item)
-        db.session.commit()
+def packlist_rollups(packlist_ids):
+    """
+    Per-category rollups for the given packlists: {packlist_id: [PackListSummary, ...]}
+    with categories in name order.  Lists that include pack templates are
+    summed over their expanded contents in one grouped query instead (those
+    rows are built on the fly and never saved).
+    """
+    rollups = {packlist_id: [] for packlist_id in packlist_ids}
+    if not packlist_ids:
+        return rollups
+    with_templates = set(db.session.execute(
+        db.select(PackListInclude.packlist_id).distinct()
+        .where(PackListInclude.packlist_id.in_(packlist_ids))
+    ).scalars())
+    plain_ids = [packlist_id for packlist_id in packlist_ids if packlist_id not in with_templates]
+    if plain_ids:
+        rows = db.session.execute(
+            db.select(PackListSummary)
+            .where(PackListSummary.packlist_id.in_(plain_ids))
+            .order_by(PackListSummary.packlist_id, PackListSummary.category)
+        ).scalars()
+        for row in rows:
+            rollups[row.packlist_id].append(row)
+    if with_templates:
+        entries = effective_entries_query(with_templates)
+        category = func.coalesce(Item.category, '')
+        rows = db.session.execute(
+            db.select(
+                entries.c.root, category, func.count(),
+                func.sum(entries.c.item_quantity),
+                func.sum(func.coalesce(Item.weight_grams, 0) * entries.c.item_quantity),
+            )
+            .join(Item, Item.id == entries.c.item_id)
+            .group_by(entries.c.root, category)
+            .order_by(entries.c.root, category)
+        )
+        for packlist_id, category_name, item_count, quantity, weight_grams in rows:
+            rollups[packlist_id].append(PackListSummary(
+                packlist_id=packlist_id, category=category_name,
+                item_count=item_count, quantity=quantity, weight_grams=weight_grams,
+            ))
+    return rollups
 
-        os.remove(filepath)
-        flash('Items imported successfully!', 'success')
-        return redirect(url_for('home'))
 
-    return render_template('import_csv.html')
+def packlist_totals(packlist_id):
+    """(entries, pieces, grams) for one packlist, summed over its rollup rows."""
+    rows = packlist_rollups([packlist_id])[packlist_id]
+    return (sum(row.item_count for row in rows),
+            sum(row.quantity for row in rows),
+            sum(row.weight_grams for row in rows))
 
 
 # ------------------------------------------------------------------------------
-# Routes for PackLists
+# Pack Templates
 # ------------------------------------------------------------------------------
-@app.route('/packlists')
-def view_packlists():
-    """
-    Show a list of all packlists.
+# A packlist can include pack templates, which are packlists themselves and
+# can include other templates.  Template items are never copied into the lists
+# that include them; a list's contents are worked out on read by one recursive
+# query.  Rows are only written for the list when the user overrides what it
+# inherits: its own PackListItem replaces the template's quantity, and a
+# PackListExclusion leaves the item out.
+TEMPLATE_SQL = [
     """
-    packlists = PackList.query.order_by(PackList.name.asc()).all()
-    return render_template('packlists.html', packlists=packlists)
+    CREATE TRIGGER IF NOT EXISTS pack_list_templates_ad
+    AFTER DELETE ON pack_list BEGIN
+        DELETE FROM pack_list_include WHERE packlist_id = old.id OR template_id = old.id;
+        DELETE FROM pack_list_exclusion WHERE packlist_id = old.id;
+    END
+    """,
+]
 
+# One line of a packlist's contents.  entry_id is the list's own PackListItem
+# (None for inherited items); template is the PackList it came from otherwise.
+PackEntry = namedtuple('PackEntry', 'item item_quantity entry_id template')
 
-@app.route('/packlist/create', methods=['GET', 'POST'])
-def create_packlist():
+
+def init_pack_templates():
+    """Adds the template flag, include and exclusion tables, and their triggers."""
+    columns = [row[1] for row in db.session.execute(text("PRAGMA table_info(pack_list)"))]
+    if 'is_template' not in columns:
+        db.session.execute(text("ALTER TABLE pack_list ADD COLUMN is_template BOOLEAN NOT NULL DEFAULT 0"))
+    PackListInclude.__table__.create(db.session.connection(), checkfirst=True)
+    PackListExclusion.__table__.create(db.session.connection(), checkfirst=True)
+    for statement in TEMPLATE_SQL:
+        db.session.execute(text(statement))
+    # Version counter triggers for the new tables
+    init_data_versions()
+
+
+def included_lists(packlist_ids):
     """
-    Create a new, named packlist.
+    Recursive CTE pairing each packlist (root) with itself and every template
+    it includes, directly or through other templates.  UNION drops pairs
+    already seen, so it ends even if templates include each other.
     """
-    if request.method == 'POST':
-        name = request.form.get('name')
-        if not name:
-            flash('Packlist name is required.', 'danger')
-            return redirect(url_for('create_packlist'))
-        
-        packlist = PackList(name=name)
-        db.session.add(packlist)
-        db.session.commit()
-        flash('Packlist created!', 'success')
-        return redirect(url_for('view_packlists'))
-    
-    return render_template('create_packlist.html')
+    lists = (
+        db.select(PackList.id.label('root'), PackList.id.label('id'))
+        .where(PackList.id.in_(packlist_ids))
+        .cte('included_lists', recursive=True)
+    )
+    return lists.union(
+        db.select(lists.c.root, PackListInclude.template_id)
+        .join(lists, PackListInclude.packlist_id == lists.c.id)
+    )
 
 
-@app.route('/packlist/<int:packlist_id>')
-def show_packlist(packlist_id):
+def effective_entries_query(packlist_ids, item_ids=None):
     """
-    Show a 2-column layout of the items in this packlist.  
+    Subquery of what each packlist (root) holds once its templates are
+    expanded: root, item_id, item_quantity, entry_id, template_id.  The list's
+    own entry for an item wins; an item several templates have is listed
+    once, with the largest of their quantities; excluded items are left out.
+    """
+    lists = included_lists(packlist_ids)
+    own = PackListItem.packlist_id == lists.c.root
+    quantity = func.coalesce(PackListItem.item_quantity, 1)
+    has_own = func.max(case((own, 1), else_=0))
+    query = (
+        db.select(
+            lists.c.root,
+            PackListItem.item_id,
+            case((has_own == 1, func.max(case((own, quantity)))),
+                 else_=func.max(quantity)).label('item_quantity'),
+            func.max(case((own, PackListItem.id))).label('entry_id'),
+            func.min(case((~own, PackListItem.packlist_id))).label('template_id'),
+        )
+        .join(lists, PackListItem.packlist_id == lists.c.id)
+        .group_by(lists.c.root, PackListItem.item_id)
+        .having(or_(has_own == 1, ~exists().where(
+            PackListExclusion.packlist_id == lists.c.root,
+            PackListExclusion.item_id == PackListItem.item_id,
+        )))
+    )
+    if item_ids is not None:
+        query = query.where(PackListItem.item_id.in_(item_ids))
+    return query.subquery('effective_entries')
+
+
+def effective_entries(packlist_id, item_ids=None):
+    """A packlist's expanded contents as PackEntry rows, in item name order, from one query."""
+    entries = effective_entries_query([packlist_id], item_ids)
+    template = db.aliased(PackList)
+    rows = db.session.execute(
+        db.select(Item, entries.c.item_quantity, entries.c.entry_id, template)
+        .join(entries, entries.c.item_id == Item.id)
+        .outerjoin(template, template.id == entries.c.template_id)
+        .order_by(Item.name, Item.id)
+    ).all()
+    return [PackEntry(*row) for row in rows]
+
+
+def inherited_items(packlist_id):
+    """SELECT of the ids of items a packlist gets from its templates, ignoring exclusions."""
+    lists = included_lists([packlist_id])
+    return (
+        db.select(PackListItem.item_id)
+        .join(lists, PackListItem.packlist_id == lists.c.id)
+        .where(lists.c.id != packlist_id)
+    )
+
+
+def include_template(packlist_id, template_id):
+    """
+    Makes a packlist include a template.  Raises ValueError if it isn't a
+    template or already includes the packlist (which would be a cycle).
+    """
+    template = db.session.get(PackList, template_id)
+    if template is None or not template.is_template:
+        raise ValueError('That is not a pack template.')
+    lists = included_lists([template_id])
+    if db.session.execute(db.select(lists.c.id).where(lists.c.id == packlist_id)).first():
+        raise ValueError(f'{template.name} already includes this packlist.')
+    db.session.execute(
+        sqlite_insert(PackListInclude)
+        .values(packlist_id=packlist_id, template_id=template_id)
+        .on_conflict_do_nothing()
+    )
+
+
+def remove_template(packlist_id, template_id):
+    """Stops including a template, dropping exclusions that no longer hide anything."""
+    db.session.execute(
+        db.delete(PackListInclude)
+        .where(PackListInclude.packlist_id == packlist_id, PackListInclude.template_id == template_id)
+    )
+    db.session.execute(
+        db.delete(PackListExclusion)
+        .where(PackListExclusion.packlist_id == packlist_id,
+               PackListExclusion.item_id.not_in(inherited_items(packlist_id)))
+    )
+
+
+def leave_out_items(packlist_id, item_ids):
+    """
+    Takes items off a packlist: deletes its own entries for them, and records
+    an exclusion for those a template would still supply.
+    """
+    db.session.execute(
+        db.delete(PackListItem)
+        .where(PackListItem.packlist_id == packlist_id, PackListItem.item_id.in_(item_ids))
+    )
+    inherited = set(db.session.execute(
+        inherited_items(packlist_id).where(PackListItem.item_id.in_(item_ids))
+    ).scalars())
+    if inherited:
+        db.session.execute(
+            sqlite_insert(PackListExclusion)
+            .values([{'packlist_id': packlist_id, 'item_id': item_id} for item_id in sorted(inherited)])
+            .on_conflict_do_nothing()
+        )
+
+
+def restore_items(packlist_id, item_ids):
+    """
+    Undoes exclusions for items being put back on a packlist.  Returns the ids
+    of the selected items its templates supply, which need no entry of their own.
+    """
+    db.session.execute(
+        db.delete(PackListExclusion)
+        .where(PackListExclusion.packlist_id == packlist_id, PackListExclusion.item_id.in_(item_ids))
+    )
+    return set(db.session.execute(
+        inherited_items(packlist_id).where(PackListItem.item_id.in_(item_ids))
+    ).scalars())
+
+
+# ------------------------------------------------------------------------------
+# Packlist Generator
+# ------------------------------------------------------------------------------
+def generate_packlist(name, season=None, styles=(), days=1):
+    """
+    Builds a packlist for a trip from the tag index.  The items are those
+    tagged with any of the trip styles (keywords like "Backpacking") or with a
+    GENERATOR_ALWAYS_KEYWORDS keyword, intersected with those tagged with the
+    season (items with no season at all count as all-season).  Items tagged
+    with a GENERATOR_PER_DAY_KEYWORDS keyword get one per day.  The selection
+    and the insert are one INSERT ... SELECT.
+    Returns (packlist, number of items); raises ValueError for a bad request.
+    """
+    if not name or not name.strip():
+        raise ValueError('A name is required.')
+    if not isinstance(days, int) or days < 1:
+        raise ValueError('The trip must be at least one day long.')
+    wanted_tags = tag_ids('keyword', list(styles) + app.config['GENERATOR_ALWAYS_KEYWORDS'])
+    if not wanted_tags:
+        raise ValueError('None of the trip styles match a keyword on any item.')
+
+    selected = db.select(ItemTag.item_id).where(ItemTag.tag_id.in_(wanted_tags))
+    if season:
+        season_tags = tag_ids('season', [season])
+        season_kind = db.select(ItemTag.item_id).join(Tag, Tag.id == ItemTag.tag_id).where(Tag.kind == 'season')
+        in_season = db.union(
+            db.select(ItemTag.item_id).where(ItemTag.tag_id.in_(season_tags)),
+            db.select(Item.id).where(Item.id.not_in(season_kind)),
+        ).subquery()
+        selected = db.intersect(selected, db.select(in_season.c.item_id))
+    else:
+        selected = selected.distinct()
+    selected = selected.subquery()
+
+    per_day = db.select(ItemTag.item_id).where(
+        ItemTag.tag_id.in_(tag_ids('keyword', app.config['GENERATOR_PER_DAY_KEYWORDS']))
+    )
+    packlist = PackList(name=name.strip())
+    db.session.add(packlist)
+    db.session.flush()
+    item_count = db.session.execute(
+        db.insert(PackListItem).from_select(
+            ['packlist_id', 'item_id', 'item_quantity'],
+            db.select(
+                db.literal(packlist.id),
+                selected.c.item_id,
+                case((selected.c.item_id.in_(per_day), days), else_=1),
+            )
+        )
+    ).rowcount
+    return packlist, item_count
+
+
+# ------------------------------------------------------------------------------
+# Climate Normals
+# ------------------------------------------------------------------------------
+# Monthly climate normals on a regular latitude/longitude grid, so trip
+# conditions can be predicted without a network connection.  The grid file is
+# memory-mapped: a lookup reads one cell's bytes straight from the OS page
+# cache, which every worker process shares.
+#
+# File layout (little-endian): the magic below; lat0, lon0, lat_step and
+# lon_step as doubles; n_lat and n_lon as uint32; then, for each cell (rows
+# south to north, columns west to east), 12 months of (low C, high C,
+# precipitation mm) float32s.  NaN marks cells without data (e.g. the sea).
+CLIMATE_MAGIC = b'CLIMATE1'
+CLIMATE_HEADER = struct.Struct('<8sddddII')
+CLIMATE_MONTH = struct.Struct('<3f')
+CLIMATE_CELL_SIZE = 12 * CLIMATE_MONTH.size
+
+# Average daily low and high (C) and total precipitation (mm) for a month, or
+# for a trip: its coldest low, warmest high and wettest month
+ClimateNormals = namedtuple('ClimateNormals', 'low_c high_c precip_mm')
+
+
+class ClimateGrid:
+    """A climate normals grid file, memory-mapped and read one cell at a time."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < CLIMATE_HEADER.size:
+            self._map.close()
+            raise ValueError(f'{path} is not a climate normals grid')
+        (magic, self.lat0, self.lon0, self.lat_step, self.lon_step,
+         self.n_lat, self.n_lon) = CLIMATE_HEADER.unpack_from(self._map)
+        expected = CLIMATE_HEADER.size + self.n_lat * self.n_lon * CLIMATE_CELL_SIZE
+        if magic != CLIMATE_MAGIC or len(self._map) < expected:
+            self._map.close()
+            raise ValueError(f'{path} is not a climate normals grid')
+        # A grid spanning the whole globe wraps around at the date line
+        self.wraps = self.n_lon * self.lon_step >= 360
+
+    def cell(self, lat, lon):
+        """(row, column) of the grid cell nearest a point, or None if it is off the grid."""
+        row = round((lat - self.lat0) / self.lat_step)
+        offset = (lon - self.lon0) % 360
+        if not self.wraps and offset >= 360 - self.lon_step / 2:
+            offset -= 360   # within half a step west of the first column, which is nearest
+        col = round(offset / self.lon_step)
+        if self.wraps:
+            col %= self.n_lon
+        if 0 <= row < self.n_lat and 0 <= col < self.n_lon:
+            return row, col
+        return None
+
+    def normals(self, row, col, month):
+        """ClimateNormals for one cell and month (1-12), or None where there is no data."""
+        offset = (CLIMATE_HEADER.size + (row * self.n_lon + col) * CLIMATE_CELL_SIZE
+                  + (month - 1) * CLIMATE_MONTH.size)
+        low_c, high_c, precip_mm = CLIMATE_MONTH.unpack_from(self._map, offset)
+        if math.isnan(low_c):
+            return None
+        # float32 on disk; round off the noise (-0.8333333134 -> -0.83)
+        return ClimateNormals(round(low_c, 2), round(high_c, 2), round(precip_mm, 2))
+
+
+_climate_grid = None
+_climate_grid_lock = threading.Lock()
+
+
+def climate_grid():
+    """The CLIMATE_NORMALS_PATH grid, opened on first use; None if there isn't one."""
+    global _climate_grid
+    if _climate_grid is None:
+        with _climate_grid_lock:
+            path = app.config['CLIMATE_NORMALS_PATH']
+            if _climate_grid is None and path and os.path.exists(path):
+                _climate_grid = ClimateGrid(path)
+    return _climate_grid
+
+
+def trip_months(start, days):
+    """The months (1-12) a trip of `days` days starting on `start` touches, in order."""
+    months = []
+    day = start
+    last = start + timedelta(days=max(days, 1) - 1)
+    while day <= last:
+        if day.month not in months:
+            months.append(day.month)
+        day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return tuple(months)
+
+
+@functools.lru_cache(maxsize=app.config['CLIMATE_CACHE_SIZE'])
+def cell_conditions(row, col, months):
+    """
+    ClimateNormals for a trip to one grid cell over some months (coldest low,
+    warmest high, wettest month), or None without data.  Cached per cell and
+    month set, so every trip to the same area and time of year shares it.
+    """
+    normals = [n for n in (climate_grid().normals(row, col, month) for month in months) if n]
+    if not normals:
+        return None
+    return ClimateNormals(
+        min(n.low_c for n in normals),
+        max(n.high_c for n in normals),
+        max(n.precip_mm for n in normals),
+    )
+
+
+def coordinate_error(lat, lon):
+    """Why a (lat, lon) pair from a request can't be used, or None; either may be missing."""
+    if any(value is not None and not math.isfinite(value) for value in (lat, lon)):
+        return 'lat and lon must be finite numbers'
+    if lat is not None and not -90 <= lat <= 90:
+        return 'lat must be between -90 and 90'
+    return None
+
+
+def trip_conditions(lat, lon, start, days=1):
+    """Predicted ClimateNormals for a trip, or None without a grid or data for the spot."""
+    grid = climate_grid()
+    if grid is None:
+        return None
+    cell = grid.cell(lat, lon)
+    if cell is None:
+        return None
+    return cell_conditions(*cell, trip_months(start, days))
+
+
+# Calendar seasons for the northern hemisphere; flipped south of the equator
+NORTHERN_SEASONS = {
+    12: 'Winter', 1: 'Winter', 2: 'Winter',
+    3: 'Spring', 4: 'Spring', 5: 'Spring',
+    6: 'Summer', 7: 'Summer', 8: 'Summer',
+    9: 'Fall', 10: 'Fall', 11: 'Fall',
+}
+
+
+def climate_season(conditions, lat, month):
+    """
+    The item season that suits a trip: Winter if it freezes hard or stays
+    cold, Summer if it gets warm, otherwise the calendar season.
+    """
+    if conditions.low_c <= -2 or conditions.high_c < 8:
+        return 'Winter'
+    if conditions.high_c >= 24:
+        return 'Summer'
+    return NORTHERN_SEASONS[month if lat >= 0 else (month + 5) % 12 + 1]
+
+
+def climate_keywords(conditions):
+    """Keywords from CLIMATE_KEYWORD_RULES that the trip's conditions call for."""
+    keywords = []
+    for field, direction, threshold, keyword in app.config['CLIMATE_KEYWORD_RULES']:
+        value = getattr(conditions, field)
+        if (value < threshold) if direction == 'below' else (value > threshold):
+            keywords.append(keyword)
+    return keywords
+
+
+def plan_trip(season, styles, lat=None, lon=None, start=None, days=1):
+    """
+    Fills in a trip from the climate normals when it has a location: the
+    season (unless one was picked) and extra keywords such as "Rain".
+    Returns (season, styles, conditions); conditions is None without a forecast.
+    """
+    if lat is None or lon is None:
+        return season, list(styles), None
+    start = start or date.today()
+    conditions = trip_conditions(lat, lon, start, days)
+    if conditions is None:
+        return season, list(styles), None
+    season = season or climate_season(conditions, lat, start.month)
+    return season, list(styles) + climate_keywords(conditions), conditions
+
+
+def read_climate_csv(path):
+    """Streams (lat, lon, month, low_c, high_c, precip_mm) rows from a climate normals CSV."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield (float(row['lat']), float(row['lon']), int(row['month']),
+                   float(row['low_c']), float(row['high_c']), float(row['precip_mm']))
+
+
+@app.cli.command('build-climate-grid')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--step', default=0.5, show_default=True, help='Grid spacing in degrees.')
+def build_climate_grid_command(source, step):
+    """
+    Build the climate normals grid from a CSV with columns
+    lat, lon, month, low_c, high_c, precip_mm (one row per cell and month).
+    """
+    # First pass: the grid's extent
+    lat0 = lon0 = lat1 = lon1 = None
+    for lat, lon, *_ in read_climate_csv(source):
+        lat0 = lat if lat0 is None else min(lat0, lat)
+        lat1 = lat if lat1 is None else max(lat1, lat)
+        lon0 = lon if lon0 is None else min(lon0, lon)
+        lon1 = lon if lon1 is None else max(lon1, lon)
+    if lat0 is None:
+        raise click.ClickException('The CSV file has no rows.')
+    n_lat = round((lat1 - lat0) / step) + 1
+    n_lon = round((lon1 - lon0) / step) + 1
+
+    # Second pass: fill in the cells, which start out as NaN (no data)
+    cells = bytearray(CLIMATE_MONTH.pack(math.nan, math.nan, math.nan) * (12 * n_lat * n_lon))
+    for lat, lon, month, low_c, high_c, precip_mm in read_climate_csv(source):
+        if not 1 <= month <= 12:
+            raise click.ClickException(f'Bad month {month!r} at {lat}, {lon}.')
+        index = round((lat - lat0) / step) * n_lon + round((lon - lon0) / step)
+        CLIMATE_MONTH.pack_into(
+            cells, index * CLIMATE_CELL_SIZE + (month - 1) * CLIMATE_MONTH.size,
+            low_c, high_c, precip_mm
+        )
+
+    # Write beside the old grid and swap it in; running workers keep their old mapping
+    path = app.config['CLIMATE_NORMALS_PATH']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(CLIMATE_HEADER.pack(CLIMATE_MAGIC, lat0, lon0, step, step, n_lat, n_lon))
+        f.write(cells)
+    os.replace(temp_path, path)
+    print(f"Wrote a {n_lat} x {n_lon} climate grid to {path}.")
+
+
+# ------------------------------------------------------------------------------
+# Location Index
+# ------------------------------------------------------------------------------
+# An R*Tree shadowing the location table, so "what is in this map box" and
+# "what is nearest this trailhead" walk the tree instead of scanning every
+# location.  Points are stored as zero-size boxes, keyed by Location.id, and
+# kept in sync by triggers like the search index.  The R*Tree holds 32-bit
+# floats rounded outward, so box queries re-check the exact coordinates.
+location_rtree = table('location_rtree', column('id'), column('min_lat'), column('max_lat'),
+                       column('min_lon'), column('max_lon'))
+
+LOCATION_INDEX_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS location_rtree USING rtree(
+        id, min_lat, max_lat, min_lon, max_lon
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS location_rtree_ai AFTER INSERT ON location BEGIN
+        INSERT INTO location_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS location_rtree_au AFTER UPDATE OF lat, lon ON location BEGIN
+        UPDATE location_rtree
+        SET min_lat = new.lat, max_lat = new.lat, min_lon = new.lon, max_lon = new.lon
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS location_rtree_ad AFTER DELETE ON location BEGIN
+        DELETE FROM location_rtree WHERE id = old.id;
+        UPDATE pack_list SET location_id = NULL WHERE location_id = old.id;
+    END
+    """,
+]
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Elements of a GPX or KML file that hold one location each
+LOCATION_RECORDS = {'wpt', 'Placemark'}
+
+
+def init_location_index():
+    """Adds the location table, its R*Tree and sync triggers, and the packlist link."""
+    Location.__table__.create(db.session.connection(), checkfirst=True)
+    columns = [row[1] for row in db.session.execute(text("PRAGMA table_info(pack_list)"))]
+    if 'location_id' not in columns:
+        db.session.execute(text("ALTER TABLE pack_list ADD COLUMN location_id INTEGER REFERENCES location(id)"))
+    table_exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'location_rtree'")
+    ).first()
+    for statement in LOCATION_INDEX_SQL:
+        db.session.execute(text(statement))
+    if not table_exists:
+        db.session.execute(text(
+            "INSERT INTO location_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+            "SELECT id, lat, lat, lon, lon FROM location"
+        ))
+    # Version counter triggers for the new table
+    init_data_versions()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points, in km."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def box_around(lat, lon, radius_km):
+    """
+    The smallest (south, west, north, east) box holding every point within
+    radius_km of (lat, lon).  west > east when it crosses the date line; a
+    box reaching a pole spans every longitude.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    south = lat - math.degrees(angle)
+    north = lat + math.degrees(angle)
+    if south <= -90 or north >= 90 or angle >= math.pi / 2:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    spread = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    if spread >= 180:
+        return south, -180.0, north, 180.0
+    west = (lon - spread + 180) % 360 - 180
+    east = (lon + spread + 180) % 360 - 180
+    return south, west, north, east
+
+
+def locations_in_box(south, west, north, east, columns=(Location,)):
+    """
+    SELECT of the locations inside a box, answered from the R*Tree.  A box
+    crossing the date line (west > east) is looked up as its two halves.
+    """
+    halves = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+    in_tree = db.union_all(*[
+        db.select(location_rtree.c.id).where(
+            location_rtree.c.max_lat >= south, location_rtree.c.min_lat <= north,
+            location_rtree.c.max_lon >= low, location_rtree.c.min_lon <= high,
+        )
+        for low, high in halves
+    ])
+    exact_lon = or_(*[Location.lon.between(low, high) for low, high in halves])
+    return (
+        db.select(*columns)
+        .where(Location.id.in_(in_tree), Location.lat.between(south, north), exact_lon)
+    )
+
+
+def nearest_locations(lat, lon, k=10, max_km=None):
+    """
+    The k locations nearest a point, nearest first, as (Location, km) pairs.
+    An R*Tree only answers box queries, so this looks in a box around the
+    point and widens it until it holds k locations no farther than its
+    radius; anything outside the box is farther than those.
+    """
+    radius = app.config['LOCATION_SEARCH_RADIUS_KM']
+    if max_km is not None:
+        radius = min(radius, max_km)
+    while True:
+        candidates = db.session.execute(
+            locations_in_box(*box_around(lat, lon, radius),
+                             columns=(Location.id, Location.lat, Location.lon))
+        ).all()
+        ranked = sorted(
+            (haversine_km(lat, lon, row.lat, row.lon), row.id) for row in candidates
+        )
+        within = [(km, location_id) for km, location_id in ranked if km <= radius]
+        everywhere = radius >= math.pi * EARTH_RADIUS_KM
+        if len(within) >= k or everywhere or (max_km is not None and radius >= max_km):
+            break
+        radius = radius * 2 if max_km is None else min(radius * 2, max_km)
+    nearest = within[:k]
+    locations = {location.id: location for location in db.session.execute(
+        db.select(Location).where(Location.id.in_([location_id for _, location_id in nearest]))
+    ).scalars()}
+    return [(locations[location_id], km) for km, location_id in nearest]
+
+
+def local_name(tag):
+    """An XML tag without its namespace ('{http://...}wpt' -> 'wpt')."""
+    return tag.rpartition('}')[2]
+
+
+def read_location_records(source):
+    """
+    Streams the waypoints (GPX) or placemarks (KML) of a file as (number,
+    element) pairs.  Each element is complete when it is yielded and is
+    dropped from the tree afterwards, as is everything outside the records
+    (tracks, styles), so memory use doesn't grow with the file.
+    """
+    parents = []
+    open_records = 0
+    number = 0
+    for event_name, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event_name == 'start':
+            parents.append(elem)
+            if local_name(elem.tag) in LOCATION_RECORDS:
+                open_records += 1
+            continue
+        parents.pop()
+        if local_name(elem.tag) in LOCATION_RECORDS:
+            open_records -= 1
+            number += 1
+            yield number, elem
+        if parents and not open_records:
+            parents[-1].remove(elem)
+
+
+def location_values(elem):
+    """
+    Column values for a location from a GPX <wpt> or a KML <Placemark>.
+    Raises ValueError with a readable message if it has no usable point.
+    """
+    children = {local_name(child.tag): (child.text or '').strip() for child in elem}
+    elevation = None
+    if local_name(elem.tag) == 'wpt':
+        lat, lon = elem.get('lat'), elem.get('lon')
+        elevation = children.get('ele') or None
+        description = children.get('desc') or children.get('cmt')
+    else:
+        point = next((node for node in elem.iter() if local_name(node.tag) == 'Point'), None)
+        if point is None:
+            raise ValueError('has no <Point> (only points are imported)')
+        coordinates = next((node.text or '' for node in point.iter()
+                            if local_name(node.tag) == 'coordinates'), '').split()
+        if len(coordinates) != 1:
+            raise ValueError('has no valid coordinates')
+        lon, lat, *rest = coordinates[0].split(',') + [None]
+        elevation = rest[0] or None
+        description = children.get('description')
+    try:
+        lat, lon = float(lat), float(lon)
+        elevation = float(elevation) if elevation is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('has no valid coordinates')
+    if elevation is not None and not math.isfinite(elevation):
+        elevation = None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f'coordinates {lat}, {lon} are out of range')
+    return {
+        'name': children.get('name') or f'{lat:.5f}, {lon:.5f}',
+        'description': description or None,
+        'lat': lat,
+        'lon': lon,
+        'elevation_m': elevation,
+    }
+
+
+def open_location_file(file, filename):
+    """A readable stream of the GPX or KML in an upload; for KMZ, the KML inside the zip."""
+    if filename.lower().endswith('.kmz'):
+        archive = zipfile.ZipFile(file)
+        name = next((name for name in archive.namelist() if name.lower().endswith('.kml')), None)
+        if name is None:
+            raise ValueError('the KMZ file holds no KML document')
+        return archive.open(name)
+    return file
+
+
+def import_locations(source, batch_size=None, max_errors=None):
+    """
+    Streams a GPX or KML file of saved spots into the database, one batch
+    per INSERT and commit.  Spots already saved (same name and coordinates)
+    are skipped.  Returns a report dict with 'created', 'duplicates' and
+    'error_count', plus 'errors' as (record number, message) pairs, capped
+    at max_errors.  Raises ValueError if the file isn't well-formed XML;
+    the batches before the problem are kept.
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    max_errors = max_errors or app.config['IMPORT_MAX_ERRORS']
+    report = {'created': 0, 'duplicates': 0, 'error_count': 0, 'errors': []}
+
+    def flush(batch):
+        created = db.session.execute(
+            sqlite_insert(Location).values(batch).on_conflict_do_nothing()
+        ).rowcount
+        db.session.commit()
+        report['created'] += created
+        report['duplicates'] += len(batch) - created
+
+    batch = []
+    try:
+        for number, elem in read_location_records(source):
+            try:
+                batch.append(location_values(elem))
+            except ValueError as exc:
+                report['error_count'] += 1
+                if len(report['errors']) < max_errors:
+                    report['errors'].append((number, f'{local_name(elem.tag)} {exc}'))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    except ElementTree.ParseError as exc:
+        if batch:
+            flush(batch)
+        raise ValueError(f"not a valid GPX or KML file ({exc}); "
+                         f"{report['created']} locations before the problem were saved")
+    if batch:
+        flush(batch)
+    return report
+
+
+# ------------------------------------------------------------------------------
+# Helper Functions
+# ------------------------------------------------------------------------------
+def generate_item_number():
+    """Generates a unique item number."""
+    return str(uuid.uuid4())[:8]
+
+
+# Grams per unit for every spelling parse_weight() understands
+WEIGHT_UNITS = {
+    'mg': 0.001,
+    'g': 1.0, 'gr': 1.0, 'gram': 1.0, 'grams': 1.0,
+    'kg': 1000.0, 'kgs': 1000.0, 'kilo': 1000.0, 'kilos': 1000.0,
+    'kilogram': 1000.0, 'kilograms': 1000.0,
+    'oz': 28.349523125, 'ozs': 28.349523125, 'ounce': 28.349523125, 'ounces': 28.349523125,
+    'lb': 453.59237, 'lbs': 453.59237, 'pound': 453.59237, 'pounds': 453.59237,
+}
+
+# A number is "1,000.5" (comma thousands separators), "1.5" or "1,5" (decimal comma)
+WEIGHT_PART_RE = re.compile(r'(\d{1,3}(?:,\d{3})+(?![\d,])(?:\.\d+)?|\d+(?:[.,]\d+)?)\s*([a-z]*)\.?')
+WEIGHT_THOUSANDS_RE = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?')
+
+
+def parse_weight(value):
+    """
+    Converts a free-form weight like "10 oz", "1.5kg" or "2 lb 4 oz" to grams.
+    A bare number is read in DEFAULT_WEIGHT_UNIT.
+    Returns None if the text is empty or can't be understood.
+    """
+    if not value:
+        return None
+    text_value = value.strip().lower()
+    parts = WEIGHT_PART_RE.findall(text_value)
+    # Anything left over besides the number/unit pairs means we don't understand it
+    if not parts or WEIGHT_PART_RE.sub('', text_value).strip(' ,+'):
+        return None
+
+    grams = 0.0
+    for number, unit in parts:
+        unit = unit or app.config['DEFAULT_WEIGHT_UNIT']
+        if unit not in WEIGHT_UNITS:
+            return None
+        if WEIGHT_THOUSANDS_RE.fullmatch(number):
+            number = number.replace(',', '')
+        grams += float(number.replace(',', '.')) * WEIGHT_UNITS[unit]
+    return round(grams, 2)
+
+
+def format_weight(grams):
+    """Formats a weight in grams for display, e.g. "2 lb 6.2 oz (1083 g)"."""
+    if grams is None:
+        return ''
+    # Incrementally maintained sums pick up float noise (283.49999 for 283.5)
+    grams = round(grams, 3)
+    # Round before splitting so 15.96 oz shows as "1 lb 0.0 oz", not "16.0 oz"
+    pounds, ounces = divmod(round(grams / WEIGHT_UNITS['oz'], 1), 16)
+    if pounds:
+        imperial = f"{int(pounds)} lb {ounces:.1f} oz"
+    else:
+        imperial = f"{ounces:.1f} oz"
+    return f"{imperial} ({grams:.0f} g)"
+
+
+app.add_template_filter(format_weight)
+
+
+def ensure_weight_column():
+    """
+    Adds the weight_grams column and its indexes to databases created before
+    it existed, then backfills it from the free-form weight text.
+    """
+    columns = [row[1] for row in db.session.execute(text("PRAGMA table_info(item)"))]
+    if 'weight_grams' in columns:
+        return
+    db.session.execute(text("ALTER TABLE item ADD COLUMN weight_grams FLOAT"))
+    # The column is brand new, so none of the indexes over it can exist yet
+    for index in Item.__table__.indexes:
+        if index.name in ('ix_item_weight_grams', 'ix_item_weight_sort'):
+            index.create(db.session.connection())
+    db.session.commit()
+    backfill_weight_grams()
+
+
+def backfill_weight_grams(batch_size=1000):
+    """
+    Parses the weight text of every item into weight_grams.
+    Works through the table in id order, a batch at a time, so memory use
+    stays flat however many items there are. Returns the number of items updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Item.id, Item.weight)
+            .where(Item.id > last_id)
+            .order_by(Item.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        params = [
+            {'item_id': row.id, 'grams': parse_weight(row.weight)}
+            for row in rows
+        ]
+        db.session.execute(
+            text("UPDATE item SET weight_grams = :grams WHERE id = :item_id"),
+            params
+        )
+        db.session.commit()
+        updated += len(params)
+    return updated
+
+
+def ensure_packlist_item_unique():
+    """
+    Adds the (packlist_id, item_id) unique index to databases created before
+    it existed. Duplicate entries left over from older versions are removed
+    first, keeping the oldest row of each pair.
+    """
+    index_exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_pack_list_item_packlist_item'")
+    ).first()
+    if index_exists:
+        return
+    db.session.execute(text(
+        """
+        DELETE FROM pack_list_item
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM pack_list_item GROUP BY packlist_id, item_id
+        )
+        """
+    ))
+    create_indexes(PackListItem, {'uq_pack_list_item_packlist_item'})
+
+
+@app.cli.command('backfill-weights')
+def backfill_weights_command():
+    """Re-parse every item's weight text into grams."""
+    ensure_weight_column()
+    count = backfill_weight_grams()
+    print(f"Updated weight for {count} items.")
+
+
+def encode_cursor(sort_value, item_id):
+    """Packs a (sort value, item id) pair into an opaque, URL-safe cursor."""
+    raw = json.dumps([sort_value, item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Unpacks a cursor made by encode_cursor().
+    Returns None if the cursor is missing or has been tampered with.
+    """
+    if not cursor:
+        return None
+    try:
+        sort_value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        item_id = int(item_id)
+    except (ValueError, TypeError):
+        return None
+    # Sort keys are never NULL (see the coalesce() expressions), so anything
+    # other than a plain string or number can't have come from encode_cursor()
+    if isinstance(sort_value, bool) or not isinstance(sort_value, (str, int, float)):
+        return None
+    return sort_value, item_id
+
+
+def paginate_keyset(query, sort_key, sort_order, after=None, before=None, per_page=100):
+    """
+    Keyset (cursor) pagination over Item rows ordered by (sort_key, Item.id).
+
+    Instead of OFFSET, each page starts from the last row seen on the
+    previous one, so fetching page N costs the same as fetching page 1.
+    Returns (items, next_cursor, prev_cursor); a cursor is None when there
+    is no page in that direction.
+    """
+    descending = sort_order == 'desc'
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+
+    def past(cursor, forward):
+        # (sort_key, id) > cursor, or < when going backwards.  Spelled out
+        # rather than as a row-value comparison so SQLite can seek straight
+        # to the cursor through an (expression) index on sort_key.
+        value, item_id = cursor
+        if forward:
+            return and_(sort_key >= value, or_(sort_key > value, Item.id > item_id))
+        return and_(sort_key <= value, or_(sort_key < value, Item.id < item_id))
+
+    if before is not None:
+        # Walk backwards from the cursor, then flip the page back around
+        query = query.filter(past(before, forward=descending))
+        ordering = (sort_key.asc(), Item.id.asc()) if descending else (sort_key.desc(), Item.id.desc())
+    else:
+        if after is not None:
+            query = query.filter(past(after, forward=not descending))
+        ordering = (sort_key.desc(), Item.id.desc()) if descending else (sort_key.asc(), Item.id.asc())
+
+    # Fetch one extra row to find out whether another page exists.
+    # The sort key is selected alongside each item so the cursor can be built
+    # from it even when it isn't a plain column (e.g. a search rank).
+    rows = query.add_columns(sort_key).order_by(*ordering).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+
+    def cursor_for(row):
+        item, value = row
+        return encode_cursor(value, item.id)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if before is not None:
+            next_cursor = cursor_for(rows[-1])
+            prev_cursor = cursor_for(rows[0]) if has_more else None
+        else:
+            next_cursor = cursor_for(rows[-1]) if has_more else None
+            prev_cursor = cursor_for(rows[0]) if after is not None else None
+    return [item for item, _ in rows], next_cursor, prev_cursor
+
+
+# Columns the item list can be sorted by
+ITEM_SORT_KEYS = {
+    'id': Item.id,
+    'name': Item.name,
+    'weight': weight_sort_key,
+    'season': season_sort_key,
+    'category': category_sort_key,
+    'quantity': Item.quantity,
+}
+
+
+def item_listing_query(filter_text='', sort_col='', min_weight='', max_weight=''):
+    """
+    Builds the query behind the item list: full-text search, weight range and
+    sort column. Returns (query, sort_col, sort_key), where sort_col is the
+    validated column name. Without an explicit column, search results are
+    ranked by relevance and everything else is listed by id.
+    """
+    query = Item.query
+    sort_keys = dict(ITEM_SORT_KEYS)
+
+    # Apply the search, if any, using the full-text index
+    match_query = build_match_query(filter_text) if filter_text else None
+    if match_query:
+        query = query.join(item_fts, item_fts.c.rowid == Item.id).filter(
+            literal_column('item_fts').op('MATCH')(match_query)
+        )
+        # bm25() scores are negative; the lowest is the best match
+        sort_keys['relevance'] = func.bm25(literal_column('item_fts'))
+        if not sort_col:
+            sort_col = 'relevance'
+
+    min_grams = parse_weight(min_weight)
+    max_grams = parse_weight(max_weight)
+    if min_grams is not None:
+        query = query.filter(Item.weight_grams >= min_grams)
+    if max_grams is not None:
+        query = query.filter(Item.weight_grams <= max_grams)
+
+    if sort_col not in sort_keys:
+        sort_col = 'id'
+    return query, sort_col, sort_keys[sort_col]
+
+
+def packlists_with_totals():
+    """
+    Returns (PackList, entries, pieces, grams) for every packlist, ordered by
+    name, summed from the rollup table rather than from every PackListItem.
+    Lists that include templates are summed over their expanded contents.
+    """
+    totals = (
+        db.select(
+            PackListSummary.packlist_id,
+            func.sum(PackListSummary.item_count).label('item_count'),
+            func.sum(PackListSummary.quantity).label('quantity'),
+            func.sum(PackListSummary.weight_grams).label('weight_grams'),
+        )
+        .group_by(PackListSummary.packlist_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(
+            PackList,
+            func.coalesce(totals.c.item_count, 0),
+            func.coalesce(totals.c.quantity, 0),
+            func.coalesce(totals.c.weight_grams, 0),
+        )
+        .outerjoin(totals, totals.c.packlist_id == PackList.id)
+        .order_by(PackList.name.asc())
+    ).all()
+    template_users = set(db.session.execute(db.select(PackListInclude.packlist_id).distinct()).scalars())
+    if not template_users:
+        return rows
+    rollups = packlist_rollups(list(template_users))
+    results = []
+    for packlist, item_count, quantity, weight_grams in rows:
+        if packlist.id in template_users:
+            categories = rollups[packlist.id]
+            item_count = sum(row.item_count for row in categories)
+            quantity = sum(row.quantity for row in categories)
+            weight_grams = sum(row.weight_grams for row in categories)
+        results.append((packlist, item_count, quantity, weight_grams))
+    return results
+
+
+# ------------------------------------------------------------------------------
+# Instrumentation
+# ------------------------------------------------------------------------------
+# With INSTRUMENTATION on, every request gets a RequestStats on flask.g that
+# the hooks below fill in: SQL time and statements from SQLAlchemy engine
+# events, template time from Flask's render signals (minus the SQL run while
+# rendering), and file I/O from timed_io() blocks.  The rest is "app" time.
+# SQLite does much of a query's work as rows are fetched, after the engine's
+# execute events, so fetching large results shows up as app time.
+# Metrics and profiles are per process; scrape each worker separately.
+class RequestStats:
+    """Where one request's time went, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql = 0.0
+        self.sql_count = 0
+        self.selects = Counter()   # SELECT text -> times run, for N+1 detection
+        self.template = 0.0
+        self.io = 0.0
+        self.renders = []          # (start time, SQL time so far) of templates being rendered
+
+
+def request_stats():
+    """The current request's RequestStats, or None when not instrumenting (or outside a request)."""
+    return g.get('request_stats') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    if request_stats() is not None:
+        conn.info['statement_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    started = conn.info.pop('statement_started', None)
+    if stats is None or started is None:
+        return
+    stats.sql += time.perf_counter() - started
+    stats.sql_count += 1
+    if statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+        stats.selects[statement] += 1
+
+
+@before_render_template.connect_via(app)
+def _template_started(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is not None:
+        stats.renders.append((time.perf_counter(), stats.sql))
+
+
+@template_rendered.connect_via(app)
+def _template_finished(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is None or not stats.renders:
+        return
+    started, sql_before = stats.renders.pop()
+    if not stats.renders:   # a template rendered inside another is already counted
+        stats.template += time.perf_counter() - started - (stats.sql - sql_before)
+
+
+@contextlib.contextmanager
+def timed_io():
+    """Counts the time spent in the block as the current request's file I/O."""
+    stats = request_stats()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.io += time.perf_counter() - started
+
+
+class RequestMetrics:
+    """Request counts, a duration histogram and time per phase, by endpoint, in Prometheus format."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._requests = Counter()     # (endpoint, method, status) -> requests
+        self._durations = {}           # endpoint -> [count per bucket..., sum, count]
+        self._phases = Counter()       # (endpoint, phase) -> seconds
+        self._statements = Counter()   # endpoint -> SQL statements
+        self._n_plus_one = Counter()   # endpoint -> requests with a repeated SELECT
+
+    def observe(self, endpoint, method, status, duration, stats, n_plus_one):
+        with self._lock:
+            self._requests[endpoint, method, status] += 1
+            histogram = self._durations.setdefault(endpoint, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[index] += 1
+            histogram[-2] += duration
+            histogram[-1] += 1
+            self._phases[endpoint, 'sql'] += stats.sql
+            self._phases[endpoint, 'template'] += stats.template
+            self._phases[endpoint, 'io'] += stats.io
+            self._statements[endpoint] += stats.sql_count
+            self._n_plus_one[endpoint] += bool(n_plus_one)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{prometheus_label(str(val))}"' for key, val in labels)
+                lines.append(f'{name}{{{label_text}}} {value:g}' if label_text else f'{name} {value:g}')
+
+        with self._lock:
+            metric('camping_gear_requests_total', 'counter', 'Requests handled.', [
+                ((('endpoint', endpoint), ('method', method), ('status', status)), count)
+                for (endpoint, method, status), count in sorted(self._requests.items())
+            ])
+            name = 'camping_gear_request_duration_seconds'
+            lines.append(f'# HELP {name} Time to build a response.')
+            lines.append(f'# TYPE {name} histogram')
+            for endpoint, histogram in sorted(self._durations.items()):
+                label = f'endpoint="{prometheus_label(endpoint)}"'
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'{name}_bucket{{{label},le="{bound:g}"}} {count}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram[-1]}')
+                lines.append(f'{name}_sum{{{label}}} {histogram[-2]:g}')
+                lines.append(f'{name}_count{{{label}}} {histogram[-1]}')
+            metric('camping_gear_request_phase_seconds_total', 'counter',
+                   'Time spent in SQL, template rendering and file I/O.', [
+                       ((('endpoint', endpoint), ('phase', phase)), seconds)
+                       for (endpoint, phase), seconds in sorted(self._phases.items())
+                   ])
+            metric('camping_gear_sql_statements_total', 'counter', 'SQL statements run.', [
+                ((('endpoint', endpoint),), count) for endpoint, count in sorted(self._statements.items())
+            ])
+            metric('camping_gear_n_plus_one_total', 'counter',
+                   'Requests that ran one SELECT at least INSTRUMENTATION_N_PLUS_ONE times.', [
+                       ((('endpoint', endpoint),), count) for endpoint, count in sorted(self._n_plus_one.items())
+                   ])
+        return '\n'.join(lines) + '\n'
+
+
+def prometheus_label(value):
+    """Escapes a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_metrics = RequestMetrics(app.config['METRICS_BUCKETS'])
+
+
+class SamplingProfiler:
+    """
+    Samples the call stacks of the requests being profiled from one
+    background thread, every PROFILER_INTERVAL_MS, and keeps the stacks of
+    the PROFILER_KEEP slowest requests as folded-stack files
+    ("outer;inner;leaf count" per line).
+    """
+
+    def __init__(self):
+        self._stacks = {}   # request key -> (thread id, greenlet, Counter of folded stacks)
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self):
+        """Starts sampling the calling request; returns the key to stop() it with."""
+        key = object()
+        # Under ASGI the async requests share the event loop's thread, each in a greenlet of its own
+        task = current_greenlet() if current_greenlet is not None else None
+        with self._lock:
+            self._stacks[key] = (threading.get_ident(), task, Counter())
+            # Also restarted in a forked worker, where the thread didn't survive
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._sampler.start()
+        return key
+
+    def stop(self, key):
+        """Stops sampling a request; returns its Counter of stacks, or None."""
+        with self._lock:
+            _, _, stacks = self._stacks.pop(key, (None, None, None))
+            return stacks
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['PROFILER_INTERVAL_MS'] / 1000)
+            with self._lock:
+                if not self._stacks:
+                    # Nothing to sample; the next start() starts a new sampler
+                    self._sampler = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, task, stacks in self._stacks.values():
+                    # A suspended greenlet (an async request awaiting the
+                    # database) has its own frame; a running request is
+                    # whatever its thread is executing
+                    frame = task.gr_frame if task is not None else None
+                    if frame is None:
+                        frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[folded_stack(frame)] += 1
+
+    def keep(self, stacks, duration, endpoint):
+        """Writes a request's stacks if it is among the PROFILER_KEEP slowest so far."""
+        directory = app.config['PROFILER_DIR']
+        os.makedirs(directory, exist_ok=True)
+        # Files are named by duration, so the slowest survive restarts and are shared by workers
+        kept = sorted(name for name in os.listdir(directory) if name.endswith('.folded'))
+        millis = round(duration * 1000)
+        keep = app.config['PROFILER_KEEP']
+        if len(kept) >= keep and millis <= int(kept[0].split('ms-')[0]):
+            return None
+        path = os.path.join(directory, f"{millis:08d}ms-{endpoint}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        for name in kept[:max(len(kept) + 1 - keep, 0)]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+        return path
+
+
+def folded_stack(frame):
+    """A frame's call stack, outermost first, as 'function (file:line);...'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+profiler = SamplingProfiler()
+
+
+@app.before_request
+def start_request_stats():
+    if not app.config['INSTRUMENTATION']:
+        return
+    g.request_stats = RequestStats()
+    if app.config['PROFILER_ENABLED']:
+        g.profile_key = profiler.start()
+
+
+@app.after_request
+def finish_request_stats(response):
+    """Adds the Server-Timing header, records the metrics, and keeps a slow request's profile."""
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    duration = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'none'
+
+    repeated = [(statement, count) for statement, count in stats.selects.items()
+                if count >= app.config['INSTRUMENTATION_N_PLUS_ONE']]
+    for statement, count in repeated:
+        app.logger.warning("Possible N+1 queries in %s %s: %d x %s",
+                           request.method, request.path, count, ' '.join(statement.split())[:200])
+    request_metrics.observe(endpoint, request.method, response.status_code, duration, stats, repeated)
+
+    app_time = max(duration - stats.sql - stats.template - stats.io, 0)
+    response.headers['Server-Timing'] = ', '.join([
+        f'sql;dur={stats.sql * 1000:.1f};desc="{stats.sql_count} statements"',
+        f'tpl;dur={stats.template * 1000:.1f}',
+        f'io;dur={stats.io * 1000:.1f}',
+        f'app;dur={app_time * 1000:.1f}',
+        f'total;dur={duration * 1000:.1f}',
+    ])
+
+    stacks = profiler.stop(g.pop('profile_key', None))
+    if stacks:
+        profiler.keep(stacks, duration, endpoint)
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # after_request is skipped when a view raises; stop sampling the request anyway
+    profiler.stop(g.pop('profile_key', None))
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker process (404 unless INSTRUMENTATION is on)."""
+    if not app.config['INSTRUMENTATION']:
+        abort(404)
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/profiler', methods=['POST'])
+def toggle_profiler():
+    """
+    Turns the sampling profiler on (enabled=1) or off (enabled=0) in this
+    worker process.  Needs INSTRUMENTATION.
+    """
+    if not app.config['INSTRUMENTATION']:
+        abort(404)
+    app.config['PROFILER_ENABLED'] = request.values.get('enabled', '1') not in ('0', 'false', 'off')
+    return {'enabled': app.config['PROFILER_ENABLED'], 'directory': app.config['PROFILER_DIR']}
+
+
+# ------------------------------------------------------------------------------
+# Background Jobs
+# ------------------------------------------------------------------------------
+# Slow work (CSV imports and exports, thumbnails) runs as a job: a row in the
+# job table that a worker claims, runs with the handler registered for its
+# kind, and finishes with a JSON result or an error.  There is no broker;
+# workers poll the table, and a claim is one UPDATE, so any number of worker
+# processes (flask --app app run-jobs) and threads (JOB_WORKER_THREADS in a
+# web process) can share the queue.  Without either, the request that queued a
+# job runs it on its way out.
+#
+# Progress updates double as the worker's heartbeat.  A job that stops
+# updating for JOB_STALE_AFTER seconds (its worker crashed or was killed) goes
+# back on the queue, and the next run resumes from the last checkpoint the
+# handler saved.  Handlers must be safe to repeat from their checkpoint.
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Registers a function as the handler for jobs of one kind."""
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class JobLost(Exception):
+    """The job was given to another worker (or deleted) while this one ran it."""
+
+
+class JobRun:
+    """
+    One claimed run of a job, as its handler sees it: the payload, the
+    checkpoint and result saved by an earlier run (None on a first run), and
+    progress() to report back.
+    """
+
+    def __init__(self, job):
+        self.id = job.id
+        self.kind = job.kind
+        self.payload = json.loads(job.payload)
+        self.checkpoint = job.checkpoint
+        self.result = json.loads(job.result) if job.result else None
+        self.attempt = job.attempts
+
+    def progress(self, done, total=None, checkpoint=None, result=None):
+        """
+        Records how far the job got; with a checkpoint, also where a rerun
+        should resume and the result up to there.  Commits.  Raises JobLost
+        if the job has been put back on the queue in the meantime.
+        """
+        values = {'progress': done, 'heartbeat_at': int(time.time())}
+        if total is not None:
+            values['total'] = total
+        if checkpoint is not None:
+            values['checkpoint'] = checkpoint
+            values['result'] = json.dumps(result)
+        if not update_job_run(self, **values):
+            raise JobLost(f"job {self.id} was taken over by another worker")
+
+
+def update_job_run(run, **values):
+    """Updates a running job if this run still owns it. Commits; returns whether it did."""
+    updated = db.session.execute(
+        db.update(Job)
+        .where(Job.id == run.id, Job.status == 'running', Job.attempts == run.attempt)
+        .values(**values)
+    ).rowcount
+    db.session.commit()
+    return bool(updated)
+
+
+def enqueue_job(kind, payload=None):
+    """
+    Queues a job and returns its id.  The job is inserted on the caller's
+    session and only queued once the caller commits, together with whatever
+    it belongs to; a rollback discards it.
+    """
+    job_id = db.session.execute(
+        db.insert(Job)
+        .values(kind=kind, payload=json.dumps(payload or {}), created_at=int(time.time()))
+        .returning(Job.id)
+    ).scalar_one()
+    db.session.info['jobs_enqueued'] = True
+    if has_request_context() and jobs_run_inline():
+        g.setdefault('inline_jobs', []).append(job_id)
+    return job_id
+
+
+def jobs_run_inline():
+    """True when no worker serves the queue, so requests run the jobs they queue."""
+    return not app.config['JOB_WORKER_POOL'] and not app.config['JOB_WORKER_THREADS']
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def wake_job_workers(session):
+    """Tells this process's worker threads about newly committed jobs."""
+    if session.info.pop('jobs_enqueued', False):
+        job_workers.wake()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_enqueued_jobs(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+def claim_job(worker, job_id=None):
+    """
+    Takes the oldest queued job (or job_id, if it is still queued) for a
+    worker.  Commits; returns a JobRun, or None if there's nothing to do.
+    """
+    queued = db.select(Job.id).where(Job.status == 'queued')
+    queued = queued.where(Job.id == job_id) if job_id is not None else queued.order_by(Job.id).limit(1)
+    # Idle workers only read; the write lock is taken when there is work
+    if db.session.execute(queued).first() is None:
+        db.session.rollback()
+        return None
+    now = int(time.time())
+    # Re-checked inside the UPDATE, so of two workers racing for a job only one gets it
+    job = db.session.execute(
+        db.update(Job)
+        .where(Job.id == queued.scalar_subquery(), Job.status == 'queued')
+        .values(status='running', worker=worker, attempts=Job.attempts + 1,
+                started_at=now, heartbeat_at=now)
+        .returning(Job)
+    ).scalar_one_or_none()
+    run = JobRun(job) if job is not None else None
+    db.session.commit()
+    return run
+
+
+def finish_job(run, result=None, error=None):
+    """Marks a run's job done (with its result) or failed (with the error)."""
+    values = {'finished_at': int(time.time())}
+    if error is None:
+        values.update(status='done', result=json.dumps(result), progress=func.coalesce(Job.total, Job.progress))
+    else:
+        values.update(status='failed', error=error)
+    if not update_job_run(run, **values):
+        app.logger.warning("Job %d finished after it was given to another worker", run.id)
+
+
+def run_job(run):
+    """Runs a claimed job to the end and records how it went."""
+    handler = JOB_HANDLERS.get(run.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"unknown job kind '{run.kind}'")
+        result = handler(run)
+    except JobLost:
+        db.session.rollback()
+        app.logger.warning("Job %d was given to another worker; stopped this run", run.id)
+        return
+    except Exception as exc:   # a job's failure is reported on the job, not raised
+        db.session.rollback()
+        app.logger.exception("Job %d (%s) failed", run.id, run.kind)
+        finish_job(run, error=str(exc) or exc.__class__.__name__)
+        return
+    finish_job(run, result=result)
+
+
+def requeue_stale_jobs():
+    """
+    Puts running jobs whose worker stopped reporting back on the queue, or
+    fails them once they've had JOB_MAX_ATTEMPTS runs.  Returns how many.
+    """
+    now = int(time.time())
+    stale = and_(Job.status == 'running', Job.heartbeat_at < now - app.config['JOB_STALE_AFTER'])
+    if db.session.execute(db.select(Job.id).where(stale).limit(1)).first() is None:
+        db.session.rollback()
+        return 0
+    failed = db.session.execute(
+        db.update(Job).where(stale, Job.attempts >= app.config['JOB_MAX_ATTEMPTS'])
+        .values(status='failed', worker=None, finished_at=now,
+                error='The worker running this job stopped responding too many times.')
+    ).rowcount
+    requeued = db.session.execute(
+        db.update(Job).where(stale).values(status='queued', worker=None)
+    ).rowcount
+    db.session.commit()
+    if requeued:
+        app.logger.warning("Put %d stalled job(s) back on the queue", requeued)
+    return failed + requeued
+
+
+def job_file_path(name):
+    """Where a job's file (an uploaded import, a finished export) is kept."""
+    return os.path.join(app.config['JOB_FOLDER'], secure_filename(name))
+
+
+@timed_io()
+def save_job_upload(file, extension):
+    """Saves an uploaded file for a job to process; returns its name in JOB_FOLDER."""
+    os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+    name = f"upload-{uuid.uuid4().hex}{extension}"
+    file.save(job_file_path(name))
+    return name
+
+
+def prune_jobs():
+    """Deletes jobs that finished more than JOB_RETENTION_DAYS ago, and their files."""
+    cutoff = int(time.time()) - app.config['JOB_RETENTION_DAYS'] * 24 * 60 * 60
+    old = and_(Job.status.in_(('done', 'failed')), Job.finished_at < cutoff)
+    rows = db.session.execute(db.select(Job.payload, Job.result).where(old)).all()
+    if not rows:
+        db.session.rollback()
+        return 0
+    for payload, result in rows:
+        for data in (payload, result):
+            name = (json.loads(data) or {}).get('file') if data else None
+            if name:
+                try:
+                    os.remove(job_file_path(name))
+                except FileNotFoundError:
+                    pass
+    deleted = db.session.execute(db.delete(Job).where(old)).rowcount
+    db.session.commit()
+    return deleted
+
+
+def work_on_jobs(worker, wait=time.sleep, until_idle=False):
+    """
+    Runs queued jobs one after another, forever (or, with until_idle, until
+    the queue is empty).  wait(seconds) is called while idle.  Needs an app
+    context.
+    """
+    last_sweep = 0
+    while True:
+        try:
+            if time.monotonic() - last_sweep >= app.config['JOB_STALE_AFTER'] / 4:
+                requeue_stale_jobs()
+                prune_jobs()
+                last_sweep = time.monotonic()
+            run = claim_job(worker)
+        except SQLAlchemyError:
+            # Most likely a locked database; try again after a pause
+            db.session.rollback()
+            app.logger.exception("Job worker %s could not read the queue", worker)
+            run = None
+        if run is not None:
+            run_job(run)
+        elif until_idle:
+            return
+        else:
+            wait(app.config['JOB_POLL_INTERVAL'])
+
+
+def job_worker_name(role):
+    """Identifies a worker in Job.worker, e.g. "host/1234/thread-0"."""
+    return f"{socket.gethostname()}/{os.getpid()}/{role}"
+
+
+class JobWorkers:
+    """
+    This process's JOB_WORKER_THREADS worker threads, if any.  They start
+    with the first request, and again in a forked child, where they didn't survive.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or not app.config['JOB_WORKER_THREADS']:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for number in range(app.config['JOB_WORKER_THREADS']):
+                threading.Thread(target=self._run, args=(job_worker_name(f'thread-{number}'),),
+                                 name=f'job-worker-{number}', daemon=True).start()
+
+    def wake(self):
+        """Tells idle worker threads there is a new job, so they don't wait out their poll interval."""
+        self._wakeup.set()
+
+    def _wait(self, seconds):
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def _run(self, worker):
+        with app.app_context():
+            work_on_jobs(worker, wait=self._wait)
+
+
+job_workers = JobWorkers()
+
+
+@app.before_request
+def start_job_workers():
+    job_workers.ensure_started()
+
+
+@app.after_request
+def run_inline_jobs(response):
+    """
+    Without workers, runs the jobs this request queued before it answers.
+    A job whose insert was rolled back is no longer there to claim.
+    """
+    for job_id in g.pop('inline_jobs', ()):
+        run = claim_job(job_worker_name('inline'), job_id)
+        if run is not None:
+            run_job(run)
+    return response
+
+
+def job_worker_process(number, until_idle=False):
+    """Body of one `run-jobs` worker process."""
+    with app.app_context():
+        try:
+            work_on_jobs(job_worker_name(f'process-{number}'), until_idle=until_idle)
+        except KeyboardInterrupt:
+            pass   # a job cut short is put back on the queue after JOB_STALE_AFTER
+
+
+@app.cli.command('run-jobs')
+@click.option('--processes', default=2, show_default=True, help='Number of worker processes.')
+@click.option('--until-idle', is_flag=True, help='Exit once the queue is empty.')
+def run_jobs_command(processes, until_idle):
+    """Run background jobs in a pool of worker processes."""
+    pool = [
+        multiprocessing.Process(target=job_worker_process, args=(number, until_idle), name=f'job-worker-{number}')
+        for number in range(processes)
+    ]
+    for process in pool:
+        process.start()
+    print(f"Running jobs in {processes} worker processes{'' if until_idle else '; press Ctrl+C to stop'}.")
+    try:
+        for process in pool:
+            process.join()
+    except KeyboardInterrupt:
+        for process in pool:
+            process.join()
+
+
+# ------------------------------------------------------------------------------
+# Image Uploads and Thumbnails
+# ------------------------------------------------------------------------------
+# Thumbnails are made by background jobs; pages fall back to the original
+# image until the thumbnail exists.
+def upload_relpath(image_path):
+    """
+    Returns the location of an upload relative to UPLOAD_FOLDER from its stored
+    image_path, e.g. "3f/a2/3fa2....png" or, for older uploads, "tent.png".
+    Handles paths saved on Windows ("static\\uploads\\x.png") as well as POSIX ones.
+    """
+    path = image_path.replace('\\', '/')
+    prefix = app.config['UPLOAD_FOLDER'].replace('\\', '/').rstrip('/') + '/'
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return path.rsplit('/', 1)[-1]
+
+
+# Where save_upload() puts a file: two levels of hash prefix, then the SHA-256 and extension
+CONTENT_ADDRESSED_RE = re.compile(r'([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(\.\w+)?')
+
+
+def stored_upload_path(image_path):
+    """
+    image_path with forward slashes ("static/uploads/3f/a2/3fa2....png") if it
+    names a content-addressed file saved by save_upload(), otherwise None.
+    """
+    path = image_path.replace('\\', '/')
+    prefix = app.config['UPLOAD_FOLDER'].replace('\\', '/').rstrip('/') + '/'
+    if path.startswith(prefix) and CONTENT_ADDRESSED_RE.fullmatch(path[len(prefix):]):
+        return path
+    return None
+
+
+def upload_abspath(image_path):
+    """
+    Absolute path of an upload on disk, or None if image_path points outside
+    UPLOAD_FOLDER (image paths can come from imported CSV files).
+    """
+    folder = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    path = os.path.realpath(os.path.join(folder, upload_relpath(image_path)))
+    if os.path.commonpath([folder, path]) != folder:
+        return None
+    return path
+
+
+def thumbnail_format():
+    """WebP when this Pillow build supports it, JPEG otherwise."""
+    return 'WEBP' if pil_features.check('webp') else 'JPEG'
+
+
+def thumbnail_filename(image_path, size):
+    """Thumbnail location relative to THUMBNAIL_FOLDER, e.g. "3f/a2/3fa2....sm.webp"."""
+    stem = os.path.splitext(upload_relpath(image_path))[0]
+    extension = 'webp' if thumbnail_format() == 'WEBP' else 'jpg'
+    return f"{stem}.{size}.{extension}"
+
+
+def make_thumbnails(image_path):
+    """
+    Writes every configured thumbnail size for one uploaded image.
+    Runs in a "thumbnails" job; failures are logged, not raised.
+    """
+    source = upload_abspath(image_path)
+    if source is None:
+        return
+    try:
+        with PILImage.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            image_format = thumbnail_format()
+            if image_format == 'JPEG' or original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGB' if image_format == 'JPEG' else 'RGBA')
+            for size, edge in app.config['THUMBNAIL_SIZES'].items():
+                thumb = original.copy()
+                thumb.thumbnail((edge, edge))
+                target = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename(image_path, size))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Write to a unique temp file then rename, so a half-written
+                # thumbnail is never served
+                handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+                with os.fdopen(handle, 'wb') as temp_file:
+                    thumb.save(temp_file, image_format, quality=80)
+                os.replace(temp_path, target)
+    except (OSError, ValueError):
+        app.logger.exception("Could not create thumbnails for %s", image_path)
+        return
+
+    # Pages rendered before now point at the full-size original; let them refresh
+    bump_data_version('item')
+
+
+@job_handler('thumbnails')
+def thumbnails_job(job):
+    """Makes the thumbnails for payload['image_paths']; the checkpoint is how many are done."""
+    image_paths = job.payload['image_paths']
+    for number in range((job.checkpoint or 0) + 1, len(image_paths) + 1):
+        make_thumbnails(image_paths[number - 1])
+        job.progress(number, len(image_paths), checkpoint=number)
+    return {'images': len(image_paths)}
+
+
+def schedule_thumbnails(image_paths):
+    """Queues a job making thumbnails for uploads (see enqueue_job()). Returns the job id, or None without Pillow."""
+    if isinstance(image_paths, str):
+        image_paths = [image_paths]
+    image_paths = [image_path for image_path in image_paths if image_path]
+    if PILImage is None or not image_paths:
+        return None
+    return enqueue_job('thumbnails', {'image_paths': image_paths})
+
+
+def lock_uploads():
+    """
+    Starts the session's write transaction now, taking SQLite's write lock
+    until it commits or rolls back.  save_upload() holds it from deciding to
+    reuse a stored file until the item referring to it is committed, and
+    release_upload() from counting references until the file is gone, so a
+    file can't be deleted between another request reusing it and saving the item.
+    """
+    db.session.execute(text("UPDATE data_version SET version = version WHERE 0"))
+
+
+@timed_io()
+def save_upload(image):
+    """
+    Saves an uploaded image content-addressed: the file is named after the
+    SHA-256 of its bytes and sharded into two directory levels
+    (UPLOAD_FOLDER/3f/a2/3fa2....png). Identical photos are stored once, and a
+    stored file never changes, so it can be cached forever.
+
+    Queues the thumbnails and returns the path to store in Item.image_path,
+    or None if no file was uploaded.  Leaves the session holding the write
+    lock (see lock_uploads()); commit the item to release it.
+    """
+    if not image or image.filename == '':
+        return None
+    extension = os.path.splitext(secure_filename(image.filename))[1].lower()
+
+    # Hash while copying to a temp file in the upload folder, so the final
+    # move is an atomic rename on the same filesystem
+    digest = hashlib.sha256()
+    handle, temp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            for chunk in iter(lambda: image.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+        content_hash = digest.hexdigest()
+        relpath = os.path.join(content_hash[:2], content_hash[2:4], content_hash + extension)
+        target = os.path.join(app.config['UPLOAD_FOLDER'], relpath)
+        lock_uploads()
+        is_new = not os.path.exists(target)
+        if is_new:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+        else:
+            os.remove(temp_path)   # already stored (with its thumbnails); reuse it
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    image_path = os.path.join(app.config['UPLOAD_FOLDER'], relpath).replace('\\', '/')
+    if is_new:
+        schedule_thumbnails(image_path)
+    return image_path
+
+
+def release_upload(image_path):
+    """
+    Deletes an upload and its thumbnails once no item refers to it any more.
+    Call after the change that dropped the reference has been committed.
+    The items table is the reference count: one image_path per item, however
+    its slashes are written.  Only content-addressed uploads are ever deleted;
+    other paths (older uploads, paths from imported CSV files) are left alone.
+    """
+    if not image_path:
+        return
+    stored_path = stored_upload_path(image_path)
+    path = upload_abspath(image_path)
+    if stored_path is None or path is None:
+        return
+    # Count the references and delete under the write lock, so no other
+    # request can start reusing the file in between
+    lock_uploads()
+    try:
+        still_used = db.session.execute(
+            db.select(Item.id).where(func.replace(Item.image_path, '\\', '/') == stored_path).limit(1)
+        ).first()
+        if still_used:
+            return
+
+        doomed = [path]
+        for size in app.config['THUMBNAIL_SIZES']:
+            doomed.append(os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename(image_path, size)))
+        with timed_io():
+            for doomed_path in doomed:
+                try:
+                    os.remove(doomed_path)
+                except FileNotFoundError:
+                    pass
+    finally:
+        db.session.commit()
+
+
+@app.template_global()
+def upload_url(image_path):
+    """URL of the original uploaded image."""
+    return url_for('static', filename='uploads/' + upload_relpath(image_path))
+
+
+@app.template_global()
+def thumbnail_url(image_path, size='sm'):
+    """URL of a thumbnail of an upload, or of the original while it isn't ready yet."""
+    if PILImage is not None:
+        filename = thumbnail_filename(image_path, size)
+        if os.path.exists(os.path.join(app.config['THUMBNAIL_FOLDER'], filename)):
+            return url_for('static', filename='uploads/thumbs/' + filename)
+    return upload_url(image_path)
+
+
+@app.cli.command('make-thumbnails')
+def make_thumbnails_command():
+    """Create missing thumbnails for every item image."""
+    if PILImage is None:
+        print("Pillow is not installed; no thumbnails made.")
+        return
+    image_paths = db.session.execute(
+        db.select(Item.image_path).where(Item.image_path.isnot(None), Item.image_path != '').distinct()
+    ).scalars().all()
+    job_id = schedule_thumbnails(image_paths)
+    if job_id is None:
+        print("No item images.")
+        return
+    db.session.commit()
+    # Run it here unless a worker got to it first
+    run = claim_job(job_worker_name('cli'), job_id)
+    if run is None:
+        print(f"Thumbnails for {len(image_paths)} images are being made by job {job_id}.")
+        return
+    run_job(run)
+    print(f"Made thumbnails for {len(image_paths)} images.")
+
+
+# ------------------------------------------------------------------------------
+# HTTP Caching
+# ------------------------------------------------------------------------------
+# Which version counter each table's writes bump.  Packlist entries, template
+# includes and exclusions count as packlist changes.
+VERSIONED_TABLES = {
+    'item': 'item',
+    'pack_list': 'pack_list',
+    'pack_list_item': 'pack_list',
+    'pack_list_include': 'pack_list',
+    'pack_list_exclusion': 'pack_list',
+    'location': 'location',
+}
+
+
+def init_data_versions():
+    """Creates the version counter rows and the triggers that bump them."""
+    for counter in set(VERSIONED_TABLES.values()):
+        db.session.execute(
+            text("INSERT OR IGNORE INTO data_version (table_name, version, updated_at) "
+                 "VALUES (:name, 0, CAST(strftime('%s', 'now') AS INTEGER))"),
+            {'name': counter}
+        )
+    for table_name, counter in VERSIONED_TABLES.items():
+        for evt in ('INSERT', 'UPDATE', 'DELETE'):
+            db.session.execute(text(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table_name}_version_{evt.lower()}
+                AFTER {evt} ON {table_name} BEGIN
+                    UPDATE data_version
+                    SET version = version + 1,
+                        updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE table_name = '{counter}';
+                END
+                """
+            ))
+    db.session.commit()
+
+
+def bump_data_version(counter):
+    """Marks a counter as changed for things the triggers can't see (e.g. new thumbnails)."""
+    db.session.execute(
+        text("UPDATE data_version SET version = version + 1, "
+             "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE table_name = :name"),
+        {'name': counter}
+    )
+    db.session.commit()
+
+
+def data_versions():
+    """
+    Returns {counter: (version, updated_at)} for every version counter.
+    Read once per request and kept on flask.g.
+    """
+    if 'data_versions' not in g:
+        rows = db.session.execute(
+            db.select(DataVersion.table_name, DataVersion.version, DataVersion.updated_at)
+        ).all()
+        g.data_versions = {name: (version, updated_at) for name, version, updated_at in rows}
+    return g.data_versions
+
+
+def cached_page(*counters):
+    """
+    Decorator for GET views whose output only depends on the request URL and
+    the given version counters. The response gets a strong ETag and a
+    Last-Modified date; if the client already has this version, it gets a
+    304 without the view (or its queries and template) running at all.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages carrying a flash message are one-offs; never cache them
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+
+            versions = data_versions()
+            rows = [(name,) + versions.get(name, (0, 0)) for name in sorted(counters)]
+            fingerprint = ';'.join(f"{name}={version}" for name, version, _ in rows)
+            etag = hashlib.sha1(f"{fingerprint}|{request.full_path}".encode('utf-8')).hexdigest()
+            last_modified = datetime.fromtimestamp(
+                max((updated_at for _, _, updated_at in rows), default=0), tz=timezone.utc
+            )
+
+            not_modified = (
+                request.if_none_match.contains(etag) if request.if_none_match
+                else request.if_modified_since is not None and last_modified <= request.if_modified_since
+            )
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True   # always revalidate, but reuse on 304
+            return response
+        return wrapper
+    return decorator
+
+
+# Content-addressed uploads and their thumbnails: <sha256>.<ext>, <sha256>.<size>.<ext>
+IMMUTABLE_UPLOAD_RE = re.compile(r'^uploads/(thumbs/)?[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)*$')
+
+
+@app.after_request
+def cache_immutable_uploads(response):
+    """Lets browsers keep content-addressed images forever; their URL changes if they do."""
+    if (request.endpoint == 'static' and response.status_code == 200
+            and IMMUTABLE_UPLOAD_RE.match(request.view_args.get('filename', ''))):
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['IMMUTABLE_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+# ------------------------------------------------------------------------------
+# Fragment Cache
+# ------------------------------------------------------------------------------
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments, evicting by total size in bytes.
+    With a directory configured, entries are also written there as files,
+    which survive restarts and are shared by every worker process.
+    Keys should include a data version, so a stale entry is never hit;
+    clear() just frees the space early.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _file_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html')
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+        if self.directory:
+            try:
+                with timed_io(), open(self._file_path(key), encoding='utf-8') as cached_file:
+                    html = cached_file.read()
+            except FileNotFoundError:
+                return None
+            self._remember(key, html)
+        return html
+
+    def set(self, key, html):
+        self._remember(key, html)
+        if self.directory:
+            with timed_io():
+                handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(handle, 'w', encoding='utf-8') as temp_file:
+                    temp_file.write(html)
+                os.replace(temp_path, self._file_path(key))
+
+    def _remember(self, key, html):
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key).encode('utf-8'))
+            self._entries[key] = html
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.encode('utf-8'))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.directory:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.html'):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except FileNotFoundError:
+                        pass
+
+
+inventory_cache = FragmentCache(
+    app.config['FRAGMENT_CACHE_BYTES'],
+    directory=app.config['FRAGMENT_CACHE_DIR']
+)
+
+
+# ------------------------------------------------------------------------------
+# Routes for Items
+# ------------------------------------------------------------------------------
+@app.route('/')
+@cached_page('item', 'pack_list')
+def home():
+    """
+    Show the list of items with optional sorting and filtering, one page at a time.
+    Also display a dropdown of existing packlists to add items to.
+    """
+    # 1. Grab sort parameters from query string
+    sort_col = request.args.get('sort', '')   # default: relevance when searching, else 'id'
+    sort_order = request.args.get('order', 'asc')
+
+    # 2. Grab filter parameters; min/max weight take units, e.g. min_weight=8oz
+    filter_text = request.args.get('filter_text', '').strip()
+    min_weight = request.args.get('min_weight', '').strip()
+    max_weight = request.args.get('max_weight', '').strip()
+
+    # 3. Build the filtered query and validate the column requested for sorting
+    query, sort_col, sort_column = item_listing_query(filter_text, sort_col, min_weight, max_weight)
+    if sort_col == 'relevance':
+        sort_order = 'asc'
+
+    per_page = request.args.get('per_page', app.config['ITEMS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, 1000))
+
+    # 4. Serve the item table from the fragment cache if this exact view
+    #    of this version of the inventory has been rendered before
+    item_version = data_versions().get('item', (0, 0))[0]
+    cache_key = f"{item_version}|{request.full_path}"
+    inventory_table = inventory_cache.get(cache_key)
+
+    if inventory_table is None:
+        # 5. Apply sorting and fetch one page, resuming from the cursor if given
+        items, next_cursor, prev_cursor = paginate_keyset(
+            query,
+            sort_column,
+            sort_order,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page
+        )
+        inventory_table = render_template(
+            'inventory_table.html',
+            items=items,
+            filter_text=filter_text,
+            min_weight=min_weight,
+            max_weight=max_weight,
+            sort_col=sort_col,
+            sort_order=sort_order,
+            per_page=per_page,
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor
+        )
+        inventory_cache.set(cache_key, inventory_table)
+
+    # 6. Retrieve existing PackLists for the dropdown
+    packlists = PackList.query.order_by(PackList.name.asc()).all()
+
+    # 7. Render template, passing sorting/filter info for the UI
+    return render_template(
+        'index.html',
+        inventory_table=Markup(inventory_table),
+        packlists=packlists,
+        filter_text=filter_text,
+        min_weight=min_weight,
+        max_weight=max_weight,
+        sort_col=sort_col,
+        sort_order=sort_order
+    )
+
+
+@app.route('/add', methods=['GET', 'POST'])
+def add_item():
+    """
+    Add a new item to the database.
+    """
+    if request.method == 'POST':
+        name = request.form.get('name')
+        description = request.form.get('description')
+        weight = request.form.get('weight')
+        season = request.form.get('season')
+        keywords = request.form.get('keywords')
+        category = request.form.get('category')
+        url = request.form.get('url')
+        quantity = request.form.get('quantity', 1, type=int)
+
+        # Handle image upload (thumbnails are made in the background)
+        image_path = save_upload(request.files.get('image'))
+
+        # Generate unique item number
+        item_number = generate_item_number()
+
+        new_item = Item(
+            item_number=item_number,
+            name=name,
+            description=description,
+            weight=weight,
+            season=season,
+            keywords=keywords,
+            category=category,
+            image_path=image_path,
+            url=url,
+            quantity=quantity
+        )
+        db.session.add(new_item)
+        db.session.commit()
+        inventory_cache.clear()
+        flash('Item added successfully!', 'success')
+        return redirect(url_for('home'))
+
+    return render_template('add_item.html')
+
+
+@app.route('/edit/<int:item_id>', methods=['GET', 'POST'])
+def edit_item(item_id):
+    """
+    Edit an existing item.
+    """
+    item = Item.query.get_or_404(item_id)
+    if request.method == 'POST':
+        item.name = request.form.get('name')
+        item.description = request.form.get('description')
+        item.weight = request.form.get('weight')
+        item.season = request.form.get('season')
+        item.keywords = request.form.get('keywords')
+        item.category = request.form.get('category')
+        item.url = request.form.get('url')
+        item.quantity = request.form.get('quantity', 1, type=int)
+
+        old_image_path = item.image_path
+        image_path = save_upload(request.files.get('image'))
+        if image_path:
+            item.image_path = image_path
+
+        db.session.commit()
+        inventory_cache.clear()
+        if image_path and old_image_path != image_path:
+            release_upload(old_image_path)
+        flash('Item updated successfully!', 'success')
+        return redirect(url_for('home'))
+
+    return render_template('edit_item.html', item=item)
+
+
+def delete_items(item_ids):
+    """
+    Deletes items along with their packlist entries and exclusions, without
+    committing.  Returns their image paths, to release_upload() after the commit.
+    """
+    image_paths = set(db.session.execute(
+        db.select(Item.image_path).where(Item.id.in_(item_ids), Item.image_path.isnot(None))
+    ).scalars())
+    db.session.execute(db.delete(PackListItem).where(PackListItem.item_id.in_(item_ids)))
+    db.session.execute(db.delete(PackListExclusion).where(PackListExclusion.item_id.in_(item_ids)))
+    db.session.execute(db.delete(Item).where(Item.id.in_(item_ids)))
+    return image_paths
+
+
+@app.route('/delete/<int:item_id>', methods=['POST'])
+def delete_item(item_id):
+    """
+    Delete an item.
+    """
+    item = Item.query.get_or_404(item_id)
+    released_images = delete_items([item.id])
+    db.session.commit()
+    inventory_cache.clear()
+    for image_path in released_images:
+        release_upload(image_path)
+    flash('Item deleted successfully!', 'success')
+    return redirect(url_for('home'))
+
+
+# ------------------------------------------------------------------------------
+# CSV Import/Export
+# ------------------------------------------------------------------------------
+# Both directions stream: exports read the items in EXPORT_BATCH_SIZE batches
+# (gzipped on the fly when the client accepts it), and imports upsert
+# IMPORT_BATCH_SIZE rows per commit with a per-row error report.  Uploads and
+# background exports run as jobs; see "Background Jobs".
+# Item columns read from (and written to) CSV files, in file order
+CSV_COLUMNS = [
+    'item_number', 'name', 'description', 'weight',
+    'season', 'keywords', 'category', 'image_path',
+    'url', 'quantity'
+]
+
+
+def generate_items_csv(batch_size=None):
+    """
+    Yields the whole inventory as CSV text, a chunk at a time.
+    Rows are pulled from the database in batches of plain tuples (no ORM
+    objects), so memory use stays flat however large the inventory is.
+    """
+    batch_size = batch_size or app.config['EXPORT_BATCH_SIZE']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+
+    rows = db.session.execute(
+        db.select(*[getattr(Item, column_name) for column_name in CSV_COLUMNS])
+        .order_by(Item.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in rows.partitions():
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzips a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route('/export_csv', methods=['GET', 'POST'])
+def export_csv():
+    """
+    Stream the inventory to the client as a CSV download, gzipped on the fly
+    when the client supports it. Nothing is written to disk.
+    A POST writes the file in a background job instead, for large inventories.
+    """
+    if request.method == 'POST':
+        job_id = enqueue_job('export_csv')
+        db.session.commit()
+        flash('Exporting in the background; download the file here when it is ready.', 'info')
+        return redirect(url_for('show_job', job_id=job_id))
+
+    csv_filename = 'camping_items.csv'
+    chunks = stream_with_context(generate_items_csv())
+    headers = {'Content-Disposition': f'attachment; filename={csv_filename}'}
+
+    if app.config['EXPORT_GZIP'] and request.accept_encodings['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        chunks = gzip_chunks(chunks)
+    else:
+        chunks = (chunk.encode('utf-8') for chunk in chunks)
+
+    return Response(chunks, mimetype='text/csv', headers=headers)
+
+
+@job_handler('export_csv')
+def export_csv_job(job):
+    """Writes the inventory to a CSV file in JOB_FOLDER. A rerun starts over."""
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    total = db.session.execute(db.select(func.count(Item.id))).scalar()
+    name = f'export-{job.id}.csv'
+    path = job_file_path(name)
+    os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8', newline='') as export_file:
+        for number, chunk in enumerate(generate_items_csv(batch_size), 1):
+            export_file.write(chunk)
+            job.progress(min(number * batch_size, total), total)
+    os.replace(path + '.tmp', path)
+    return {'file': name, 'filename': 'camping_items.csv', 'rows': total}
+
+
+def csv_row_to_item(row):
+    """
+    Validates one CSV row and converts it into column values for the item table.
+    Raises ValueError with a readable message if the row can't be imported.
+    """
+    item_number = (row.get('item_number') or '').strip()
+    if not item_number:
+        raise ValueError('item_number is missing')
+    name = row.get('name')
+    if not name:
+        raise ValueError('name is missing')
+
+    quantity = (row.get('quantity') or '').strip()
+    try:
+        quantity = int(quantity) if quantity else 1
+    except ValueError:
+        raise ValueError(f"quantity '{quantity}' is not a whole number")
+
+    values = {column_name: row.get(column_name) for column_name in CSV_COLUMNS}
+    values.update(
+        item_number=item_number,
+        quantity=quantity,
+        weight_grams=parse_weight(values['weight'])
+    )
+    return values
+
+
+def upsert_items(rows):
+    """
+    Inserts or updates a batch of item column dicts (keyed on item_number)
+    with a single INSERT ... ON CONFLICT DO UPDATE statement.
+    """
+    statement = sqlite_insert(Item).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=['item_number'],
+        set_={
+            column_name: statement.excluded[column_name]
+            for column_name in rows[0]
+            if column_name != 'item_number'
+        }
+    )
+    db.session.execute(statement)
+
+
+def import_items_csv(stream, batch_size=None, max_errors=None, resume_after=0, report=None, on_batch=None):
+    """
+    Streams a CSV file of items into the database.
+
+    Rows are read, validated and upserted one batch at a time, and each
+    batch is committed on its own, so memory use doesn't grow with the file
+    and a bad row only costs that row. Returns a report dict with 'created',
+    'updated' and 'error_count', plus 'errors' as a list of
+    (line number, message) pairs, capped at max_errors.
+
+    After each batch is committed, on_batch(line, report) is called with the
+    file's last line so far.  Passing that line and report back as
+    resume_after and report continues an interrupted import from there.
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    max_errors = max_errors or app.config['IMPORT_MAX_ERRORS']
+    report = report or {'created': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+
+    def record_error(line, message):
+        report['error_count'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append((line, message))
+
+    def flush(batch):
+        # Later rows win if an item_number repeats within the batch
+        rows = {}
+        for line, values in batch:
+            rows[values['item_number']] = (line, values)
+        existing = set(db.session.execute(
+            db.select(Item.item_number).where(Item.item_number.in_(list(rows)))
+        ).scalars())
+        failed = set()
+        try:
+            upsert_items([values for _, values in rows.values()])
+            db.session.commit()
+        except SQLAlchemyError:
+            # Something in the batch was rejected; retry row by row so the
+            # good rows still go in and the bad ones are reported
+            db.session.rollback()
+            for line, values in rows.values():
+                try:
+                    upsert_items([values])
+                    db.session.commit()
+                except SQLAlchemyError as exc:
+                    db.session.rollback()
+                    failed.add(values['item_number'])
+                    record_error(line, str(getattr(exc, 'orig', None) or exc))
+        imported = set(rows) - failed
+        report['updated'] += len(imported & existing)
+        report['created'] += len(imported - existing)
+
+    reader = csv.DictReader(stream)
+    missing = [name for name in ('item_number', 'name') if name not in (reader.fieldnames or [])]
+    if missing:
+        record_error(1, f"missing column(s): {', '.join(missing)}")
+        return report
+
+    batch = []
+    for row in reader:
+        if reader.line_num <= resume_after:
+            continue
+        try:
+            batch.append((reader.line_num, csv_row_to_item(row)))
+        except ValueError as exc:
+            record_error(reader.line_num, str(exc))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+            if on_batch:
+                on_batch(reader.line_num, report)
+    if batch:
+        flush(batch)
+    return report
+
+
+@job_handler('import_csv')
+def import_csv_job(job):
+    """
+    Imports the uploaded CSV file payload['file'].  Progress is in bytes
+    read; the checkpoint is the last line of the last committed batch.
+    Returns the import report.
+    """
+    path = job_file_path(job.payload['file'])
+    total = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+        def checkpoint(line, report):
+            job.progress(raw.tell(), total, checkpoint=line, result=report)
+
+        try:
+            report = import_items_csv(stream, resume_after=job.checkpoint or 0,
+                                      report=job.result, on_batch=checkpoint)
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise ValueError(f'Could not read the CSV file: {exc}')
+        finally:
+            inventory_cache.clear()
+    os.remove(path)
+    return report
+
+
+@app.route('/import_csv', methods=['GET', 'POST'])
+def import_csv():
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            flash('No file selected!', 'danger')
+            return redirect(url_for('import_csv'))
+
+        # Imported by a background job, so a large file doesn't hold up this request
+        job_id = enqueue_job('import_csv', {
+            'file': save_job_upload(file, '.csv'),
+            'filename': secure_filename(file.filename),
+        })
+        db.session.commit()
+        return redirect(url_for('show_job', job_id=job_id))
+
+    return render_template('import_csv.html')
+
+
+# ------------------------------------------------------------------------------
+# Routes for PackLists
+# ------------------------------------------------------------------------------
+def wants_fragment():
+    """
+    True for background (AJAX) requests, which get a small JSON answer the
+    page swaps in instead of a redirect and a full re-render.
+    """
+    return (request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            or request.accept_mimetypes.best == 'application/json')
+
+
+def render_entries(packlist, entries):
+    """The packlist cards for some PackEntry rows, as one HTML string."""
+    return ''.join(render_template('packlist_card.html', packlist=packlist, entry=entry)
+                   for entry in entries)
+
+
+def packlist_fragment(packlist_id, message, category='success', status=200, **changes):
+    """
+    JSON reply to an AJAX packlist edit: the message to show, what changed,
+    and the new counts, total weight and category table for the page header.
+    """
+    categories = packlist_rollups([packlist_id])[packlist_id]
+    total_grams = sum(row.weight_grams for row in categories)
+    return jsonify(
+        message=message,
+        category=category,
+        packlist_id=packlist_id,
+        item_count=sum(row.item_count for row in categories),
+        quantity=sum(row.quantity for row in categories),
+        total_weight=format_weight(total_grams) if total_grams else '',
+        categories_html=render_template('packlist_categories.html', categories=categories),
+        **changes,
+    ), status
+
+
+@app.route('/packlists')
+@cached_page('item', 'pack_list')
+def view_packlists():
+    """
+    Show a list of all packlists, with their item counts and total weights.
+    """
+    return render_template('packlists.html', packlists=packlists_with_totals())
+
+
+@app.route('/packlist/create', methods=['GET', 'POST'])
+def create_packlist():
+    """
+    Create a new, named packlist.
+    """
+    if request.method == 'POST':
+        name = request.form.get('name')
+        if not name:
+            flash('Packlist name is required.', 'danger')
+            return redirect(url_for('create_packlist'))
+        
+        packlist = PackList(name=name, is_template=bool(request.form.get('is_template')))
+        db.session.add(packlist)
+        db.session.commit()
+        flash('Packlist created!', 'success')
+        return redirect(url_for('view_packlists'))
+    
+    return render_template('create_packlist.html')
+
+
+@app.route('/packlist/generate', methods=['GET', 'POST'])
+def generate_packlist_page():
+    """
+    Generate a packlist from trip details (season, styles, length) using the
+    items' keywords and seasons.
+    """
+    # A saved campsite (from the locations page) supplies the coordinates
+    location_id = request.values.get('location_id', type=int)
+    location = Location.query.get_or_404(location_id) if location_id else None
+
+    if request.method == 'POST':
+        days = request.form.get('days', 1, type=int)
+        lat = request.form.get('lat', type=float)
+        lon = request.form.get('lon', type=float)
+        error = coordinate_error(lat, lon)
+        if error:
+            flash(f'Invalid location: {error}.', 'danger')
+            return redirect(url_for('generate_packlist_page', location_id=location_id))
+        if location and (lat is None or lon is None):
+            lat, lon = location.lat, location.lon
+        # With a location, the season and weather keywords come from the climate normals
+        season, styles, conditions = plan_trip(
+            request.form.get('season') or None,
+            request.form.getlist('styles'),
+            lat=lat,
+            lon=lon,
+            start=request.form.get('start', type=date.fromisoformat),
+            days=days,
+        )
+        try:
+            packlist, item_count = generate_packlist(
+                request.form.get('name', ''), season=season, styles=styles, days=days
+            )
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('generate_packlist_page', location_id=location_id))
+        packlist.location = location
+        db.session.commit()
+        flash(f'Generated {packlist.name} with {item_count} items.', 'success')
+        if conditions:
+            flash(f'Packed for {season}: expect lows around {conditions.low_c:.0f}°C, highs around '
+                  f'{conditions.high_c:.0f}°C and up to {conditions.precip_mm:.0f} mm of '
+                  f'precipitation a month.', 'info')
+        return redirect(url_for('show_packlist', packlist_id=packlist.id))
+
+    return render_template('generate_packlist.html',
+                           seasons=tags_with_counts('season'),
+                           styles=tags_with_counts('keyword'),
+                           has_climate=climate_grid() is not None,
+                           location=location)
+
+
+@app.route('/packlist/<int:packlist_id>')
+@cached_page('item', 'pack_list', 'location')
+def show_packlist(packlist_id):
+    """
+    Show a 2-column layout of the items in this packlist.  
     The template itself will handle the 2-column display.
     """
-    packlist = PackList.query.get_or_404(packlist_id)
-    return render_template('show_packlist.html', packlist=packlist)
+    packlist = PackList.query.get_or_404(packlist_id)
+    # Its own entries plus everything its templates bring, in one query
+    entries = effective_entries(packlist.id)
+    # Totals and the per-category breakdown come from the rollup table
+    categories = packlist_rollups([packlist.id])[packlist.id]
+    # Templates it could include (not itself)
+    available_templates = (
+        PackList.query
+        .filter(PackList.is_template.is_(True), PackList.id != packlist.id)
+        .order_by(PackList.name)
+        .all()
+    )
+    return render_template('show_packlist.html', packlist=packlist, entries=entries,
+                           categories=categories, available_templates=available_templates,
+                           total_grams=sum(row.weight_grams for row in categories))
+
+
+@app.route('/packlist/<int:packlist_id>/editor')
+@cached_page('item', 'pack_list')
+def packlist_editor(packlist_id):
+    """
+    The inventory next to a packlist.  Only the packlist is rendered here; the
+    inventory pane fetches small ranked pages from /api/v1/items as the user
+    types and scrolls, so it stays quick however large the inventory is.
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    return render_template('packlist_editor.html', packlist=packlist,
+                           entries=effective_entries(packlist.id),
+                           total_grams=packlist_totals(packlist.id)[2])
+
+
+@app.route('/packlist/<int:packlist_id>/delete', methods=['POST'])
+def delete_packlist(packlist_id):
+    """
+    Delete a packlist (and its associated items).
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    db.session.delete(packlist)
+    db.session.commit()
+    flash('Packlist deleted.', 'success')
+    return redirect(url_for('view_packlists'))
+
+
+@app.route('/packlist/<int:packlist_id>/clear', methods=['POST'])
+def clear_packlist(packlist_id):
+    """
+    Remove all items from an existing packlist (but keep the packlist itself).
+    Items from included templates stay, and any left out come back.
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    # This deletes all PackListItem rows for this packlist
+    PackListItem.query.filter_by(packlist_id=packlist.id).delete()
+    PackListExclusion.query.filter_by(packlist_id=packlist.id).delete()
+    db.session.commit()
+    if wants_fragment():
+        # Whatever the templates still supply replaces the cleared cards
+        return packlist_fragment(
+            packlist.id, 'All items removed from the packlist.', cleared=True,
+            html=render_entries(packlist, effective_entries(packlist.id)),
+        )
+    flash('All items removed from the packlist.', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist.id))
+
+
+@app.route('/add_to_packlist', methods=['POST'])
+def add_to_packlist():
+    """
+    From the main page, user can select items and pick a packlist (existing or new).
+    This route handles that form submission and adds the items to the chosen packlist.
+    """
+    # The 'packlist_id' is passed as a hidden form field or from a dropdown.
+    packlist_id = request.form.get('packlist_id', type=int)
+    if not packlist_id:
+        if wants_fragment():
+            return jsonify(message='No packlist selected!', category='danger'), 400
+        flash('No packlist selected!', 'danger')
+        return redirect(url_for('home'))
+
+    # The checkboxes (selected_items) are item IDs from the home page
+    selected_items = set(request.form.getlist('selected_items', type=int))
+    
+    # If none selected, just redirect
+    if not selected_items:
+        if wants_fragment():
+            return jsonify(message='No items selected!', category='warning'), 400
+        flash('No items selected!', 'warning')
+        return redirect(url_for('home'))
+
+    packlist = PackList.query.get_or_404(packlist_id)
+
+    # Find what's already on the list in one query and only insert the rest
+    existing = set(db.session.execute(
+        db.select(PackListItem.item_id).where(PackListItem.packlist_id == packlist.id)
+    ).scalars())
+    # Items a template supplies just need any exclusion lifted, not a copy
+    was_excluded = set(db.session.execute(
+        db.select(PackListExclusion.item_id)
+        .where(PackListExclusion.packlist_id == packlist.id,
+               PackListExclusion.item_id.in_(selected_items))
+    ).scalars())
+    inherited = restore_items(packlist.id, selected_items)
+    new_item_ids = sorted(selected_items - existing - inherited)
+    added = sorted(set(new_item_ids) | (was_excluded & inherited))
+
+    if new_item_ids:
+        # One multi-row INSERT; the unique index plus ON CONFLICT DO NOTHING
+        # keeps a concurrent double-submit from creating duplicates
+        db.session.execute(
+            sqlite_insert(PackListItem)
+            .values([
+                {'packlist_id': packlist.id, 'item_id': item_id, 'item_quantity': 1}
+                for item_id in new_item_ids
+            ])
+            .on_conflict_do_nothing(index_elements=['packlist_id', 'item_id'])
+        )
+    db.session.commit()
+    if wants_fragment():
+        # Cards for just the added items, for pages that show the packlist
+        return packlist_fragment(
+            packlist.id,
+            f'{len(added)} item(s) added to {packlist.name}.',
+            added=added,
+            html=render_entries(packlist, effective_entries(packlist.id, added)) if added else '',
+        )
+    flash('Items added to packlist!', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist_id))
+
+
+@app.route('/packlist/<int:packlist_id>/remove_item/<int:packlist_item_id>', methods=['POST'])
+def remove_item_from_packlist(packlist_id, packlist_item_id):
+    """
+    Remove a single item from a packlist.
+    """
+    packlist_item = PackListItem.query.get_or_404(packlist_item_id)
+    if packlist_item.packlist_id != packlist_id:
+        if wants_fragment():
+            return jsonify(message="Item doesn't belong to this packlist.", category='danger'), 400
+        flash("Item doesn't belong to this packlist.", 'danger')
+        return redirect(url_for('show_packlist', packlist_id=packlist_id))
+    return leave_out_item(packlist_id, packlist_item.item_id)
+
+
+@app.route('/packlist/<int:packlist_id>/leave_out/<int:item_id>', methods=['POST'])
+def leave_out_item(packlist_id, item_id):
+    """
+    Remove an item from a packlist, whether it is the list's own entry or
+    comes from one of its templates (then the list records an exclusion).
+    """
+    PackList.query.get_or_404(packlist_id)
+    leave_out_items(packlist_id, [item_id])
+    db.session.commit()
+    if wants_fragment():
+        return packlist_fragment(packlist_id, 'Item removed from packlist.', removed=item_id)
+    flash('Item removed from packlist.', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist_id))
+
+
+@app.route('/packlist/<int:packlist_id>/templates', methods=['POST'])
+def add_template_to_packlist(packlist_id):
+    """
+    Include a pack template in a packlist.  Its items are shared by reference,
+    not copied, so later changes to the template show up here too.
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    try:
+        include_template(packlist.id, request.form.get('template_id', type=int))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('show_packlist', packlist_id=packlist.id))
+    db.session.commit()
+    flash('Template included.', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist.id))
+
+
+@app.route('/packlist/<int:packlist_id>/templates/<int:template_id>/remove', methods=['POST'])
+def remove_template_from_packlist(packlist_id, template_id):
+    """
+    Stop including a pack template.  The list's own entries are kept.
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    remove_template(packlist.id, template_id)
+    db.session.commit()
+    flash('Template removed.', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist.id))
+
+
+@app.route('/packlist/<int:packlist_id>/location', methods=['POST'])
+def set_packlist_location(packlist_id):
+    """
+    Set the campsite a packlist is for; an empty location_id clears it.
+    """
+    packlist = PackList.query.get_or_404(packlist_id)
+    location_id = request.form.get('location_id', type=int)
+    if location_id is not None:
+        packlist.location = Location.query.get_or_404(location_id)
+    else:
+        packlist.location = None
+    db.session.commit()
+    flash('Campsite updated.', 'success')
+    return redirect(url_for('show_packlist', packlist_id=packlist.id))
+
+
+# ------------------------------------------------------------------------------
+# Routes for Locations
+# ------------------------------------------------------------------------------
+@app.route('/locations')
+@cached_page('location', 'pack_list')
+def view_locations():
+    """
+    Search saved locations by distance from a point (lat, lon), nearest first.
+    With ?packlist_id=, each result can be picked as that packlist's campsite.
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    k = min(max(request.args.get('k', 20, type=int), 1), 100)
+    results = None
+    if lat is not None and lon is not None and coordinate_error(lat, lon) is None:
+        results = nearest_locations(lat, lon, k)
+    packlist_id = request.args.get('packlist_id', type=int)
+    packlist = db.session.get(PackList, packlist_id) if packlist_id else None
+    return render_template('locations.html', results=results, lat=lat, lon=lon, k=k,
+                           packlist=packlist,
+                           location_count=db.session.execute(db.select(func.count(Location.id))).scalar())
 
 
-@app.route('/packlist/<int:packlist_id>/delete', methods=['POST'])
-def delete_packlist(packlist_id):
+@app.route('/locations/import', methods=['POST'])
+def import_locations_page():
+    """Import saved spots from a GPX, KML or KMZ bookmarks file."""
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash('No file selected!', 'danger')
+        return redirect(url_for('view_locations'))
+    try:
+        report = import_locations(open_location_file(file.stream, file.filename))
+    except (ValueError, zipfile.BadZipFile) as exc:
+        flash(f'Could not read the file: {exc}', 'danger')
+        return redirect(url_for('view_locations'))
+
+    summary = f"{report['created']} locations added, {report['duplicates']} already saved"
+    if report['error_count']:
+        flash(f"{summary}, {report['error_count']} skipped.", 'warning')
+        return render_template('locations.html', report=report, results=None, k=20,
+                               location_count=db.session.execute(db.select(func.count(Location.id))).scalar())
+    flash(f'Locations imported successfully! ({summary})', 'success')
+    return redirect(url_for('view_locations'))
+
+
+@app.route('/locations/<int:location_id>/delete', methods=['POST'])
+def delete_location(location_id):
+    """Delete a saved location; packlists using it no longer have a campsite."""
+    location = Location.query.get_or_404(location_id)
+    db.session.delete(location)
+    db.session.commit()
+    flash(f'{location.name} deleted.', 'success')
+    return redirect(url_for('view_locations'))
+
+
+# ------------------------------------------------------------------------------
+# Routes for Jobs
+# ------------------------------------------------------------------------------
+# Not cached: a running job's progress doesn't bump any version counter.
+JOB_LABELS = {'import_csv': 'CSV import', 'export_csv': 'CSV export', 'thumbnails': 'Thumbnails'}
+
+
+def job_to_dict(job):
     """
-    Delete a packlist (and its associated items).
+    A job for the job pages and the API.  While a job runs, result holds
+    what its last checkpoint saved (e.g. an import's report so far).
     """
-    packlist = PackList.query.get_or_404(packlist_id)
-    db.session.delete(packlist)
+    result = json.loads(job.result) if job.result else None
+    if job.kind == 'import_csv' and result:
+        result = {**result, 'errors': [{'line': line, 'error': message} for line, message in result['errors']]}
+    done = job.status == 'done'
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'percent': 100 if done else (min(100 * job.progress // job.total, 100) if job.total else None),
+        'attempts': job.attempts,
+        'result': result,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'download_url': (url_for('download_job_file', job_id=job.id)
+                         if done and result and result.get('file') else None),
+    }
+
+
+@app.template_filter()
+def unix_time(value):
+    """Formats a unix time as local date and time."""
+    return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+@app.route('/jobs')
+def view_jobs():
+    """The most recent background jobs, newest first."""
+    jobs = db.session.execute(db.select(Job).order_by(Job.id.desc()).limit(100)).scalars()
+    return render_template('jobs.html', jobs=[job_to_dict(job) for job in jobs], labels=JOB_LABELS)
+
+
+@app.route('/jobs/<int:job_id>')
+def show_job(job_id):
+    """One job's progress, updated live while it runs, and its result."""
+    job = Job.query.get_or_404(job_id)
+    return render_template('job.html', job=job_to_dict(job), labels=JOB_LABELS)
+
+
+@app.route('/jobs/<int:job_id>/download')
+def download_job_file(job_id):
+    """The file a finished job made (a CSV export)."""
+    job = Job.query.get_or_404(job_id)
+    result = json.loads(job.result) if job.status == 'done' and job.result else {}
+    path = job_file_path(result['file']) if result.get('file') else None
+    if path is None or not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=result.get('filename', result['file']))
+
+
+# ------------------------------------------------------------------------------
+# JSON API (v1)
+# ------------------------------------------------------------------------------
+# Everything the HTML pages can do, for scripts: listing with cursors and
+# field projection, and batch create/update/delete in a single request and
+# transaction.  GETs carry ETags and answer If-None-Match with 304.
+API_ITEM_FIELDS = [
+    'id', 'item_number', 'name', 'description', 'weight', 'weight_grams',
+    'season', 'keywords', 'category', 'image_path', 'url', 'quantity'
+]
+API_ITEM_WRITABLE = set(CSV_COLUMNS)
+
+
+class ApiError(Exception):
+    """An error answered as JSON: {"error": message, "details": [...]}."""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(error):
+    body = {'error': error.message}
+    if error.details:
+        body['details'] = error.details
+    return jsonify(body), error.status
+
+
+def api_fields(allowed):
+    """The fields requested with ?fields=a,b (all of them by default); id is always included."""
+    requested = request.args.get('fields', '').strip()
+    if not requested:
+        return list(allowed)
+    fields = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ApiError(f"unknown field(s): {', '.join(unknown)}")
+    return ['id'] + [name for name in fields if name != 'id']
+
+
+def api_batch_body(*operations):
+    """Reads a batch request body, e.g. {"create": [...], "delete": [...]}."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('request body must be a JSON object')
+    unknown = set(body) - set(operations)
+    if unknown:
+        raise ApiError(f"unknown operation(s): {', '.join(sorted(unknown))}")
+    for operation in operations:
+        if not isinstance(body.get(operation, []), list):
+            raise ApiError(f"'{operation}' must be a list")
+    if sum(len(body.get(operation, [])) for operation in operations) > app.config['API_MAX_BATCH']:
+        raise ApiError(f"at most {app.config['API_MAX_BATCH']} entries per request", 413)
+    return body
+
+
+def item_to_dict(item, fields):
+    return {name: getattr(item, name) for name in fields}
+
+
+def rollup_to_dict(row):
+    return {
+        'category': row.category,
+        'item_count': row.item_count,
+        'quantity': row.quantity,
+        'weight_grams': round(row.weight_grams, 3),
+    }
+
+
+def api_item_values(data, creating):
+    """
+    Validates the writable fields of one item from a request and returns
+    column values. Raises ValueError with a readable message.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('must be an object')
+    unknown = set(data) - API_ITEM_WRITABLE - {'id'}
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    values = {name: data[name] for name in API_ITEM_WRITABLE if name in data}
+    for name, value in values.items():
+        if name == 'quantity':
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ValueError('quantity must be a whole number >= 0')
+        elif value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+    if creating or 'name' in values:
+        if not values.get('name'):
+            raise ValueError('name is required')
+    if creating:
+        values.setdefault('item_number', generate_item_number())
+        values.setdefault('quantity', 1)
+    elif 'item_number' in values and not values['item_number']:
+        raise ValueError('item_number cannot be empty')
+    if 'weight' in values:
+        values['weight_grams'] = parse_weight(values['weight'])
+    return values
+
+
+def api_ids(entries, operation, errors):
+    """Integer ids from a list of ids (or {"id": ...} objects), recording bad entries."""
+    ids = []
+    for index, entry in enumerate(entries):
+        entry_id = entry.get('id') if isinstance(entry, dict) else entry
+        if not isinstance(entry_id, int) or isinstance(entry_id, bool):
+            errors.append({'op': operation, 'index': index, 'error': 'id must be an integer'})
+        else:
+            ids.append(entry_id)
+    return ids
+
+
+def api_missing(model, ids, operation, errors):
+    """Records an error for every id that has no row in the model's table."""
+    if not ids:
+        return
+    found = set(db.session.execute(db.select(model.id).where(model.id.in_(ids))).scalars())
+    for entry_id in ids:
+        if entry_id not in found:
+            errors.append({'op': operation, 'id': entry_id, 'error': 'not found'})
+
+
+@app.route('/api/v1/items')
+@cached_page('item')
+def api_list_items():
+    """
+    List items a page at a time.
+    Query: q, sort, order, min_weight, max_weight, fields, limit, after, before.
+    """
+    fields = api_fields(API_ITEM_FIELDS)
+    query, sort_col, sort_key = item_listing_query(
+        request.args.get('q', '').strip(),
+        request.args.get('sort', ''),
+        request.args.get('min_weight', '').strip(),
+        request.args.get('max_weight', '').strip()
+    )
+    # Only load the requested columns
+    query = query.options(db.load_only(*[getattr(Item, name) for name in fields]))
+    sort_order = 'asc' if sort_col == 'relevance' else request.args.get('order', 'asc')
+    limit = max(1, min(request.args.get('limit', app.config['ITEMS_PER_PAGE'], type=int), 1000))
+
+    items, next_cursor, prev_cursor = paginate_keyset(
+        query,
+        sort_key,
+        sort_order,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=limit
+    )
+    return {
+        'items': [item_to_dict(item, fields) for item in items],
+        'sort': sort_col,
+        'order': sort_order,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+    }
+
+
+@app.route('/api/v1/items/<int:item_id>')
+@cached_page('item')
+def api_get_item(item_id):
+    fields = api_fields(API_ITEM_FIELDS)
+    item = db.session.get(Item, item_id)
+    if item is None:
+        raise ApiError('item not found', 404)
+    return item_to_dict(item, fields)
+
+
+@app.route('/api/v1/items/batch', methods=['POST'])
+def api_batch_items():
+    """
+    Create, update and delete items in one transaction:
+    {"create": [{...}], "update": [{"id": 1, ...}], "delete": [1, 2]}.
+    Nothing is written unless every entry is valid.
+    """
+    body = api_batch_body('create', 'update', 'delete')
+    errors = []
+
+    creates = []
+    for index, data in enumerate(body.get('create', [])):
+        try:
+            creates.append(api_item_values(data, creating=True))
+        except ValueError as exc:
+            errors.append({'op': 'create', 'index': index, 'error': str(exc)})
+
+    updates = []
+    update_ids = api_ids(body.get('update', []), 'update', errors)
+    for index, data in enumerate(body.get('update', [])):
+        try:
+            values = api_item_values(data, creating=False)
+        except ValueError as exc:
+            errors.append({'op': 'update', 'index': index, 'error': str(exc)})
+            continue
+        if isinstance(data.get('id'), int):
+            values['id'] = data['id']
+            updates.append(values)
+    api_missing(Item, update_ids, 'update', errors)
+
+    delete_ids = api_ids(body.get('delete', []), 'delete', errors)
+    api_missing(Item, delete_ids, 'delete', errors)
+
+    if errors:
+        raise ApiError('batch rejected; nothing was changed', 400, errors)
+
+    released_images = set()
+    try:
+        created = []
+        if creates:
+            # Give every row the same columns so they go in as one executemany
+            columns = API_ITEM_WRITABLE | {'weight_grams'}
+            rows = [{name: row.get(name) for name in columns} for row in creates]
+            created = db.session.execute(
+                db.insert(Item).returning(Item.id, Item.item_number, sort_by_parameter_order=True),
+                rows
+            ).all()
+        if updates:
+            # Images replaced by an update are released like those of deleted items
+            replaced_ids = [row['id'] for row in updates if 'image_path' in row]
+            if replaced_ids:
+                released_images.update(db.session.execute(
+                    db.select(Item.image_path).where(Item.id.in_(replaced_ids), Item.image_path.isnot(None))
+                ).scalars())
+            db.session.execute(db.update(Item), updates)
+        if delete_ids:
+            released_images.update(delete_items(delete_ids))
+        db.session.commit()
+    except SQLAlchemyError as exc:
+        db.session.rollback()
+        raise ApiError('batch rejected; nothing was changed', 409, [str(getattr(exc, 'orig', None) or exc)])
+
+    inventory_cache.clear()
+    for image_path in released_images:
+        release_upload(image_path)
+    return {
+        'created': [{'id': item_id, 'item_number': item_number} for item_id, item_number in created],
+        'updated': len(updates),
+        'deleted': len(delete_ids),
+    }
+
+
+@app.route('/api/v1/packlists')
+@cached_page('item', 'pack_list')
+def api_list_packlists():
+    return {
+        'packlists': [
+            {
+                'id': packlist.id,
+                'name': packlist.name,
+                'is_template': packlist.is_template,
+                'item_count': item_count,
+                'quantity': quantity,
+                'weight_grams': round(weight_grams, 3),
+            }
+            for packlist, item_count, quantity, weight_grams in packlists_with_totals()
+        ]
+    }
+
+
+@app.route('/api/v1/packlists/rollups')
+@cached_page('item', 'pack_list')
+def api_packlist_rollups():
+    """
+    Per-category entry counts, pieces and weight for many packlists at once.
+    Query: ids (comma separated; default all packlists).
+    """
+    ids_arg = request.args.get('ids', '').strip()
+    if ids_arg:
+        try:
+            packlist_ids = [int(value) for value in ids_arg.split(',') if value.strip()]
+        except ValueError:
+            raise ApiError('ids must be comma-separated integers')
+    else:
+        packlist_ids = list(db.session.execute(db.select(PackList.id)).scalars())
+    rollups = packlist_rollups(packlist_ids)
+    return {
+        'packlists': [
+            {'id': packlist_id, 'categories': [rollup_to_dict(row) for row in rows]}
+            for packlist_id, rows in rollups.items()
+        ]
+    }
+
+
+@app.route('/api/v1/tags')
+@cached_page('item')
+def api_list_tags():
+    """Keywords and seasons in use, with how many items have each."""
+    return {
+        kind + 's': [{'label': tag.label, 'item_count': item_count}
+                     for tag, item_count in tags_with_counts(kind)]
+        for kind in TAG_COLUMNS
+    }
+
+
+@app.route('/api/v1/packlists/generate', methods=['POST'])
+def api_generate_packlist():
+    """
+    Generate a packlist from trip details:
+    {"name": ..., "season": "Summer", "styles": ["Backpacking"], "days": 3}.
+    With "location_id" the packlist is for that saved campsite, whose
+    coordinates stand in for lat/lon.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('request body must be a JSON object')
+    unknown = set(body) - {'name', 'season', 'styles', 'days', 'lat', 'lon', 'start', 'location_id'}
+    if unknown:
+        raise ApiError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    styles = body.get('styles', [])
+    if not isinstance(styles, list) or not all(isinstance(style, str) for style in styles):
+        raise ApiError('styles must be a list of strings')
+    season = body.get('season')
+    if season is not None and not isinstance(season, str):
+        raise ApiError('season must be a string')
+    days = body.get('days', 1)
+    if not isinstance(days, int) or isinstance(days, bool) or days < 1:
+        raise ApiError('days must be a whole number >= 1')
+    lat, lon, start = api_trip_location(body)
+    location = None
+    if body.get('location_id') is not None:
+        location = db.session.get(Location, body['location_id']) if isinstance(body['location_id'], int) else None
+        if location is None:
+            raise ApiError('location_id is not a saved location')
+        if lat is None or lon is None:
+            lat, lon = location.lat, location.lon
+    season, styles, conditions = plan_trip(season, styles, lat, lon, start, days)
+    name = body.get('name')
+    try:
+        packlist, item_count = generate_packlist(
+            name if isinstance(name, str) else '', season=season, styles=styles, days=days
+        )
+    except ValueError as e:
+        raise ApiError(str(e))
+    packlist.location = location
     db.session.commit()
-    flash('Packlist deleted.', 'success')
-    return redirect(url_for('view_packlists'))
+    return {
+        'id': packlist.id,
+        'name': packlist.name,
+        'item_count': item_count,
+        'season': season,
+        'styles': styles,
+        'conditions': conditions._asdict() if conditions else None,
+    }
 
 
-@app.route('/packlist/<int:packlist_id>/clear', methods=['POST'])
-def clear_packlist(packlist_id):
+def api_trip_location(values):
+    """(lat, lon, start date) from a request body or query string; all optional."""
+    try:
+        lat = float(values['lat']) if values.get('lat') is not None else None
+        lon = float(values['lon']) if values.get('lon') is not None else None
+        start = date.fromisoformat(values['start']) if values.get('start') else None
+    except (TypeError, ValueError):
+        raise ApiError('lat and lon must be numbers and start a YYYY-MM-DD date')
+    error = coordinate_error(lat, lon)
+    if error:
+        raise ApiError(error)
+    return lat, lon, start
+
+
+@app.route('/api/v1/climate')
+def api_climate():
     """
-    Remove all items from an existing packlist (but keep the packlist itself).
+    Predicted conditions for a trip from the offline climate normals.
+    Query: lat, lon, start (YYYY-MM-DD, default today), days.
     """
-    packlist = PackList.query.get_or_404(packlist_id)
-    # This deletes all PackListItem rows for this packlist
-    PackListItem.query.filter_by(packlist_id=packlist.id).delete()
+    lat, lon, start = api_trip_location(request.args)
+    if lat is None or lon is None:
+        raise ApiError('lat and lon are required')
+    if climate_grid() is None:
+        raise ApiError('no climate normals are installed', 404)
+    start = start or date.today()
+    days = max(1, request.args.get('days', 1, type=int))
+    conditions = trip_conditions(lat, lon, start, days)
+    if conditions is None:
+        return {'conditions': None, 'season': None, 'keywords': []}
+    return {
+        'conditions': conditions._asdict(),
+        'season': climate_season(conditions, lat, start.month),
+        'keywords': climate_keywords(conditions),
+    }
+
+
+API_LOCATION_FIELDS = ['id', 'name', 'description', 'lat', 'lon', 'elevation_m']
+
+
+def api_location_values(data):
+    """
+    Validates one location from a request and returns column values.
+    Raises ValueError with a readable message.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('each location must be an object')
+    unknown = set(data) - set(API_LOCATION_FIELDS) - {'id'}
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    if not isinstance(data.get('name'), str) or not data['name'].strip():
+        raise ValueError('name is required')
+    for name in ('lat', 'lon', 'elevation_m'):
+        value = data.get(name)
+        if (value is None and name != 'elevation_m') or (
+                value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                       or not math.isfinite(value))):
+            raise ValueError(f'{name} must be a number')
+    if not (-90 <= data['lat'] <= 90 and -180 <= data['lon'] <= 180):
+        raise ValueError('lat must be between -90 and 90 and lon between -180 and 180')
+    description = data.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('description must be a string')
+    return {
+        'name': data['name'].strip(),
+        'description': description,
+        'lat': float(data['lat']),
+        'lon': float(data['lon']),
+        'elevation_m': data.get('elevation_m'),
+    }
+
+
+@app.route('/api/v1/locations')
+@cached_page('location')
+def api_list_locations():
+    """
+    Locations inside a map box, from the R*Tree index.
+    Query: bbox=west,south,east,north (default the whole world; west > east
+    crosses the date line), limit, fields.
+    """
+    fields = api_fields(API_LOCATION_FIELDS)
+    bbox = request.args.get('bbox', '').strip()
+    try:
+        west, south, east, north = [float(value) for value in bbox.split(',')] if bbox else (-180, -90, 180, 90)
+    except ValueError:
+        raise ApiError('bbox must be four numbers: west,south,east,north')
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ApiError('bbox is out of range')
+    max_results = app.config['LOCATION_MAX_RESULTS']
+    limit = min(max(request.args.get('limit', max_results, type=int), 1), max_results)
+    # One extra row tells whether the box holds more than the limit
+    locations = db.session.execute(
+        locations_in_box(south, west, north, east).order_by(Location.id).limit(limit + 1)
+    ).scalars().all()
+    return {
+        'locations': [item_to_dict(location, fields) for location in locations[:limit]],
+        'truncated': len(locations) > limit,
+    }
+
+
+@app.route('/api/v1/locations/nearest')
+@cached_page('location')
+def api_nearest_locations():
+    """
+    The saved locations nearest a point, nearest first, with their distance.
+    Query: lat, lon, k (default 10, at most 100), max_km, fields.
+    """
+    fields = api_fields(API_LOCATION_FIELDS)
+    lat, lon, _ = api_trip_location(request.args)
+    if lat is None or lon is None:
+        raise ApiError('lat and lon are required')
+    k = request.args.get('k', 10, type=int)
+    max_km = request.args.get('max_km', type=float)
+    if not 1 <= k <= 100:
+        raise ApiError('k must be between 1 and 100')
+    if max_km is not None and not max_km > 0:   # also rejects nan
+        raise ApiError('max_km must be positive')
+    return {
+        'locations': [
+            {**item_to_dict(location, fields), 'distance_km': round(km, 3)}
+            for location, km in nearest_locations(lat, lon, k, max_km)
+        ]
+    }
+
+
+@app.route('/api/v1/locations/<int:location_id>')
+@cached_page('location')
+def api_get_location(location_id):
+    fields = api_fields(API_LOCATION_FIELDS)
+    location = db.session.get(Location, location_id)
+    if location is None:
+        raise ApiError('location not found', 404)
+    return item_to_dict(location, fields)
+
+
+@app.route('/api/v1/locations/import', methods=['POST'])
+def api_import_locations():
+    """Bulk import from a GPX, KML or KMZ file uploaded as multipart field "file"."""
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        raise ApiError('no file uploaded')
+    try:
+        report = import_locations(open_location_file(file.stream, file.filename))
+    except (ValueError, zipfile.BadZipFile) as exc:
+        raise ApiError(str(exc))
+    return {
+        'created': report['created'],
+        'duplicates': report['duplicates'],
+        'error_count': report['error_count'],
+        'errors': [{'record': number, 'error': message} for number, message in report['errors']],
+    }
+
+
+@app.route('/api/v1/locations/batch', methods=['POST'])
+def api_batch_locations():
+    """
+    Create and delete locations in one transaction:
+    {"create": [{"name": ..., "lat": 44.4, "lon": -110.6}], "delete": [1]}.
+    """
+    body = api_batch_body('create', 'delete')
+    errors = []
+    creates = []
+    for index, data in enumerate(body.get('create', [])):
+        try:
+            creates.append(api_location_values(data))
+        except ValueError as exc:
+            errors.append({'op': 'create', 'index': index, 'error': str(exc)})
+    delete_ids = api_ids(body.get('delete', []), 'delete', errors)
+    api_missing(Location, delete_ids, 'delete', errors)
+
+    if errors:
+        raise ApiError('batch rejected; nothing was changed', 400, errors)
+
+    created = []
+    try:
+        if creates:
+            created = db.session.execute(
+                db.insert(Location).returning(Location.id, sort_by_parameter_order=True),
+                creates
+            ).scalars().all()
+        if delete_ids:
+            db.session.execute(db.delete(Location).where(Location.id.in_(delete_ids)))
+        db.session.commit()
+    except SQLAlchemyError as exc:
+        db.session.rollback()
+        raise ApiError('batch rejected; nothing was changed', 409, [str(getattr(exc, 'orig', None) or exc)])
+    return {'created': [{'id': location_id} for location_id in created], 'deleted': len(delete_ids)}
+
+
+@app.route('/api/v1/packlists/<int:packlist_id>')
+@cached_page('item', 'pack_list')
+def api_get_packlist(packlist_id):
+    """
+    A packlist with its own entries, the templates it includes, and its
+    effective items (own plus inherited); ?fields= projects the nested items.
+    """
+    fields = api_fields(API_ITEM_FIELDS)
+    packlist = (
+        PackList.query
+        .options(db.joinedload(PackList.items).joinedload(PackListItem.item))
+        .filter_by(id=packlist_id)
+        .first()
+    )
+    if packlist is None:
+        raise ApiError('packlist not found', 404)
+    return {
+        'id': packlist.id,
+        'name': packlist.name,
+        'is_template': packlist.is_template,
+        'location_id': packlist.location_id,
+        'templates': [template.id for template in packlist.templates],
+        'categories': [rollup_to_dict(row) for row in packlist_rollups([packlist.id])[packlist.id]],
+        'items': [
+            {
+                'packlist_item_id': pli.id,
+                'item_quantity': pli.item_quantity,
+                'item': item_to_dict(pli.item, fields) if pli.item else None,
+            }
+            for pli in packlist.items
+        ],
+        'effective_items': [
+            {
+                'packlist_item_id': entry.entry_id,
+                'template_id': entry.template.id if entry.template else None,
+                'item_quantity': entry.item_quantity,
+                'item': item_to_dict(entry.item, fields),
+            }
+            for entry in effective_entries(packlist.id)
+        ],
+    }
+
+
+@app.route('/api/v1/packlists/batch', methods=['POST'])
+def api_batch_packlists():
+    """
+    Create, rename and delete packlists in one transaction:
+    {"create": [{"name": ..., "is_template": false, "location_id": 3}],
+     "update": [{"id": 1, "name": ...}], "delete": [1]}.
+    """
+    body = api_batch_body('create', 'update', 'delete')
+    errors = []
+
+    def values_of(data, operation, index):
+        if not isinstance(data, dict) or not isinstance(data.get('name'), str) or not data['name'].strip():
+            errors.append({'op': operation, 'index': index, 'error': 'name is required'})
+            return {}
+        values = {'name': data['name'].strip()}
+        if 'is_template' in data:
+            if not isinstance(data['is_template'], bool):
+                errors.append({'op': operation, 'index': index, 'error': 'is_template must be true or false'})
+            values['is_template'] = data['is_template']
+        if 'location_id' in data:
+            location_id = data['location_id']
+            if location_id is not None and (not isinstance(location_id, int) or isinstance(location_id, bool)
+                                            or db.session.get(Location, location_id) is None):
+                errors.append({'op': operation, 'index': index, 'error': 'location_id is not a saved location'})
+            values['location_id'] = location_id
+        return values
+
+    creates = [values_of(data, 'create', index) for index, data in enumerate(body.get('create', []))]
+    update_ids = api_ids(body.get('update', []), 'update', errors)
+    updates = [
+        {'id': data['id'], **values_of(data, 'update', index)}
+        for index, data in enumerate(body.get('update', []))
+        if isinstance(data, dict) and isinstance(data.get('id'), int)
+    ]
+    api_missing(PackList, update_ids, 'update', errors)
+    delete_ids = api_ids(body.get('delete', []), 'delete', errors)
+    api_missing(PackList, delete_ids, 'delete', errors)
+
+    if errors:
+        raise ApiError('batch rejected; nothing was changed', 400, errors)
+
+    created = []
+    if creates:
+        created = db.session.execute(
+            db.insert(PackList).returning(PackList.id, sort_by_parameter_order=True),
+            [{'is_template': False, 'location_id': None, **values} for values in creates]
+        ).scalars().all()
+    if updates:
+        db.session.execute(db.update(PackList), updates)
+    if delete_ids:
+        db.session.execute(db.delete(PackListItem).where(PackListItem.packlist_id.in_(delete_ids)))
+        db.session.execute(db.delete(PackList).where(PackList.id.in_(delete_ids)))
     db.session.commit()
-    flash('All items removed from the packlist.', 'success')
-    return redirect(url_for('show_packlist', packlist_id=packlist.id))
+    return {'created': [{'id': packlist_id} for packlist_id in created],
+            'updated': len(updates), 'deleted': len(delete_ids)}
 
 
-@app.route('/add_to_packlist', methods=['POST'])
-def add_to_packlist():
+@app.route('/api/v1/packlists/<int:packlist_id>/items', methods=['POST'])
+def api_packlist_items(packlist_id):
     """
-    From the main page, user can select items and pick a packlist (existing or new).
-    This route handles that form submission and adds the items to the chosen packlist.
+    Add and remove packlist entries in one transaction:
+    {"add": [12, {"item_id": 13, "item_quantity": 2}], "remove": [14]}.
+    Adding an item that is already on the list sets its quantity (for an item
+    from a template, that gives the list its own entry).  Removing an item
+    from a template leaves it out of this list only.
     """
-    # The 'packlist_id' is passed as a hidden form field or from a dropdown.
-    packlist_id = request.form.get('packlist_id', type=int)
-    if not packlist_id:
-        flash('No packlist selected!', 'danger')
-        return redirect(url_for('home'))
+    if db.session.get(PackList, packlist_id) is None:
+        raise ApiError('packlist not found', 404)
+    body = api_batch_body('add', 'remove')
+    errors = []
 
-    # The checkboxes (selected_items) are item IDs from the home page
-    selected_items = request.form.getlist('selected_items')
-    
-    # If none selected, just redirect
-    if not selected_items:
-        flash('No items selected!', 'warning')
-        return redirect(url_for('home'))
+    adds = {}   # item_id -> row; the last entry for an item wins
+    for index, entry in enumerate(body.get('add', [])):
+        if isinstance(entry, int) and not isinstance(entry, bool):
+            entry = {'item_id': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('item_id'), int):
+            errors.append({'op': 'add', 'index': index, 'error': 'item_id must be an integer'})
+            continue
+        quantity = entry.get('item_quantity', 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            errors.append({'op': 'add', 'index': index, 'error': 'item_quantity must be a whole number >= 1'})
+            continue
+        adds[entry['item_id']] = {'packlist_id': packlist_id, 'item_id': entry['item_id'], 'item_quantity': quantity}
+    api_missing(Item, list(adds), 'add', errors)
+    remove_ids = api_ids(body.get('remove', []), 'remove', errors)
 
-    packlist = PackList.query.get_or_404(packlist_id)
-    # For each item ID, if it's not already in the packlist, add it
-    for item_id_str in selected_items:
-        item_id = int(item_id_str)
-        existing_rel = PackListItem.query.filter_by(packlist_id=packlist_id, item_id=item_id).first()
-        if not existing_rel:
-            # Create the association
-            new_packlist_item = PackListItem(packlist_id=packlist_id, item_id=item_id)
-            db.session.add(new_packlist_item)
+    if errors:
+        raise ApiError('batch rejected; nothing was changed', 400, errors)
 
+    if adds:
+        restore_items(packlist_id, list(adds))
+        statement = sqlite_insert(PackListItem).values(list(adds.values()))
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['packlist_id', 'item_id'],
+            set_={'item_quantity': statement.excluded.item_quantity}
+        ))
+    if remove_ids:
+        leave_out_items(packlist_id, remove_ids)
     db.session.commit()
-    flash('Items added to packlist!', 'success')
-    return redirect(url_for('show_packlist', packlist_id=packlist_id))
+    return {'added': len(adds), 'removed': len(set(remove_ids))}
 
 
-@app.route('/packlist/<int:packlist_id>/remove_item/<int:packlist_item_id>', methods=['POST'])
-def remove_item_from_packlist(packlist_id, packlist_item_id):
+@app.route('/api/v1/packlists/<int:packlist_id>/templates', methods=['POST'])
+def api_packlist_templates(packlist_id):
     """
-    Remove a single item from a packlist.
+    Include and stop including pack templates in one transaction:
+    {"add": [3], "remove": [4]}.
     """
-    packlist_item = PackListItem.query.get_or_404(packlist_item_id)
-    if packlist_item.packlist_id != packlist_id:
-        flash("Item doesn't belong to this packlist.", 'danger')
-        return redirect(url_for('show_packlist', packlist_id=packlist_id))
-    db.session.delete(packlist_item)
+    if db.session.get(PackList, packlist_id) is None:
+        raise ApiError('packlist not found', 404)
+    body = api_batch_body('add', 'remove')
+    errors = []
+    add_ids = api_ids(body.get('add', []), 'add', errors)
+    remove_ids = api_ids(body.get('remove', []), 'remove', errors)
+    for template_id in add_ids:
+        try:
+            include_template(packlist_id, template_id)
+        except ValueError as e:
+            errors.append({'op': 'add', 'id': template_id, 'error': str(e)})
+
+    if errors:
+        db.session.rollback()
+        raise ApiError('batch rejected; nothing was changed', 400, errors)
+
+    for template_id in remove_ids:
+        remove_template(packlist_id, template_id)
     db.session.commit()
-    flash('Item removed from packlist.', 'success')
-    return redirect(url_for('show_packlist', packlist_id=packlist_id))
+    return {'added': len(add_ids), 'removed': len(remove_ids)}
+
+
+@app.route('/api/v1/items/import', methods=['POST'])
+def api_import_items():
+    """
+    Queue an import of a CSV file uploaded as multipart field "file".
+    Answers 202 with the job; follow it at /api/v1/jobs/<id>.
+    """
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        raise ApiError('no file uploaded')
+    job_id = enqueue_job('import_csv', {
+        'file': save_job_upload(file, '.csv'),
+        'filename': secure_filename(file.filename),
+    })
+    db.session.commit()
+    return api_job_accepted(job_id)
+
+
+@app.route('/api/v1/items/export', methods=['POST'])
+def api_export_items():
+    """Queue a CSV export; the finished job has a download_url."""
+    job_id = enqueue_job('export_csv')
+    db.session.commit()
+    return api_job_accepted(job_id)
+
+
+def api_job_accepted(job_id):
+    response = jsonify(job_to_dict(db.session.get(Job, job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_get_job', job_id=job_id)
+    return response
+
+
+@app.route('/api/v1/jobs')
+def api_list_jobs():
+    """Recent jobs, newest first; ?status=queued|running|done|failed and ?limit= narrow it down."""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
+    query = db.select(Job).order_by(Job.id.desc()).limit(limit)
+    status = request.args.get('status')
+    if status:
+        query = query.where(Job.status == status)
+    return {'jobs': [job_to_dict(job) for job in db.session.execute(query).scalars()]}
+
+
+@app.route('/api/v1/jobs/<int:job_id>')
+def api_get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        raise ApiError('job not found', 404)
+    return job_to_dict(job)
+
+
+# ------------------------------------------------------------------------------
+# Schema Migrations
+# ------------------------------------------------------------------------------
+# The schema version lives in SQLite's PRAGMA user_version.  Each migration
+# brings the database up to its version number and is written to be safe on a
+# database that already has some of its changes (older versions of the app
+# set these up ad hoc at startup).  Add new migrations to the end of the list.
+def create_tables():
+    """Creates any missing tables, with every index a fresh database should have."""
+    db.create_all()
+
+
+def create_indexes(model, names):
+    """Creates the named indexes of a model if they don't exist yet."""
+    for index in model.__table__.indexes:
+        if index.name in names:
+            db.session.execute(CreateIndex(index, if_not_exists=True))
+    db.session.commit()
+
+
+def add_listing_indexes():
+    """
+    Indexes for the sortable inventory columns and the packlist joins.
+    Keywords are searched through the FTS5 index, so they don't get a B-tree.
+    """
+    create_indexes(Item, {
+        'ix_item_name', 'ix_item_quantity',
+        'ix_item_season_sort', 'ix_item_category_sort',
+    })
+    create_indexes(PackListItem, {'ix_pack_list_item_item_id'})
+    # Give the query planner statistics for the new indexes
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def init_jobs():
+    """Adds the background job table."""
+    Job.__table__.create(db.session.connection(), checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, create_tables),
+    (2, ensure_weight_column),
+    (3, ensure_packlist_item_unique),
+    (4, init_search_index),
+    (5, init_data_versions),
+    (6, add_listing_indexes),
+    (7, init_packlist_rollups),
+    (8, init_pack_templates),
+    (9, init_tag_index),
+    (10, init_location_index),
+    (11, init_jobs),
+]
+
+
+def schema_version():
+    """The schema version of the database (0 for one never migrated)."""
+    return db.session.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate_database():
+    """
+    Upgrades the database in place to the latest schema version.
+    Returns the list of migration versions that were applied.
+    """
+    applied = []
+    current = schema_version()
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        app.logger.info("Applying schema migration %d: %s", version, migration.__name__)
+        migration()
+        # PRAGMA can't take bound parameters; version is always an int from MIGRATIONS
+        db.session.execute(text(f"PRAGMA user_version = {int(version)}"))
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Upgrade the database schema to the latest version."""
+    applied = migrate_database()
+    if applied:
+        print(f"Applied migrations {', '.join(map(str, applied))}; schema is at version {schema_version()}.")
+    else:
+        print(f"Schema is up to date (version {schema_version()}).")
+
+
+# ------------------------------------------------------------------------------
+# Async Serving (ASGI)
+# ------------------------------------------------------------------------------
+# `uvicorn app:asgi_app` serves the app over ASGI.  A GET for one of
+# ASYNC_ENDPOINTS runs the ordinary Flask view on the event loop, inside the
+# greenlet SQLAlchemy's asyncio support runs sync code in, with the session
+# bound to an aiosqlite connection: each query awaits the driver, and the loop
+# serves other requests meanwhile.  So many clients polling their packlists
+# need neither a thread each nor async copies of the views.  Everything else
+# (writes, uploads, streamed exports) is plain WSGI on ASGI_THREADS threads.
+class AsgiApp:
+    """ASGI front end for a WSGI app; see "Async Serving (ASGI)"."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.executor = None
+        self.engine = None
+
+    def start(self):
+        """Creates the thread pool and aiosqlite engine (once per worker process)."""
+        if self.executor is None:
+            self.engine = async_read_engine()
+            self.executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+
+    async def stop(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = self.engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            self.start()
+            environ = await wsgi_environ(scope, receive)
+            if self.engine is not None and scope['method'] in ('GET', 'HEAD') and runs_async(environ):
+                async with self.engine.connect() as connection:
+                    start, body = await connection.run_sync(self._call_bound, environ)
+                await send(start)
+                await send({'type': 'http.response.body', 'body': body})
+            else:
+                await self.call_threaded(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _call_bound(self, connection, environ):
+        # Runs in SQLAlchemy's greenlet; queries on `connection` await aiosqlite
+        token = async_read_connection.set(connection)
+        try:
+            return call_wsgi(self.wsgi_app, environ)
+        finally:
+            async_read_connection.reset(token)
+
+    async def call_threaded(self, environ, send):
+        """Runs the WSGI app on the thread pool, sending its response as it is produced."""
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue(maxsize=16)
+        gone = threading.Event()
+        done = loop.run_in_executor(self.executor, self._stream_wsgi, environ, loop, messages, gone)
+        started = False
+        try:
+            while (message := await messages.get()) is not None:
+                started = True
+                await send(message)
+        except BaseException:
+            # Let the thread wind down before giving up on the response
+            gone.set()
+            while await messages.get() is not None:
+                pass
+            raise
+        await done
+        if started:
+            await send({'type': 'http.response.body', 'body': b''})
+
+    def _stream_wsgi(self, environ, loop, messages, gone):
+        def put(message):
+            asyncio.run_coroutine_threadsafe(messages.put(message), loop).result()
+
+        start = []
+
+        def start_response(status, headers, exc_info=None):
+            start[:] = [asgi_response_start(status, headers)]
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if gone.is_set():
+                        break
+                    if chunk:
+                        if start:
+                            put(start.pop())
+                        put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if start:
+                    put(start.pop())
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            put(None)
+
+
+def async_read_engine():
+    """
+    The aiosqlite engine (read-only) for ASYNC_ENDPOINTS, or None without
+    aiosqlite or for an in-memory database.
+    """
+    if aiosqlite is None:
+        return None
+    with app.app_context():
+        # The resolved URL: Flask-SQLAlchemy puts relative SQLite paths in the instance folder
+        uri = sqlite_read_only_uri(db.engine.url.render_as_string(hide_password=False))
+    if uri is None:
+        return None
+    # The dialect doesn't pool file databases by default; reusing connections keeps their page cache warm
+    return create_async_engine(make_url(uri).set(drivername='sqlite+aiosqlite'), poolclass=AsyncAdaptedQueuePool,
+                               pool_size=app.config['ASYNC_DB_POOL_SIZE'], max_overflow=0)
+
+
+def runs_async(environ):
+    """Whether a request is for one of ASYNC_ENDPOINTS."""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return False
+    return endpoint in app.config['ASYNC_ENDPOINTS']
+
+
+async def wsgi_environ(scope, receive):
+    """The WSGI environ for an ASGI HTTP request.  The body is read first, into a temp file if large."""
+    body = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    body.seek(0)
+
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI paths are bytes decoded as Latin-1
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def asgi_response_start(status, headers):
+    """The ASGI response start message for a WSGI status line and headers."""
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+def call_wsgi(wsgi_app, environ):
+    """Calls a WSGI app and collects its whole response: (ASGI start message, body)."""
+    start = []
+
+    def start_response(status, headers, exc_info=None):
+        start[:] = [asgi_response_start(status, headers)]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return start[0], body
+
+
+asgi_app = AsgiApp(app)
 
 
 # ------------------------------------------------------------------------------
@@ -446,5 +4938,8 @@ def remove_item_from_packlist(packlist_id, packlist_item_id):
 # ------------------------------------------------------------------------------
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        migrate_database()
+    # The development server runs background jobs itself, in worker threads
+    # started with its first request
+    app.config['JOB_WORKER_THREADS'] = app.config['JOB_WORKER_THREADS'] or 2
     app.run(debug=True)
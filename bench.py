@@ -0,0 +1,635 @@
+"""
+Benchmarks for every route in app.py.
+
+Builds a synthetic inventory (items, packlists of several sizes, a pack
+template, saved locations and a climate grid), then drives each route
+through the Flask test client and reports latency percentiles, SQL
+statements per request and peak RSS.  Results can be saved as a baseline
+and later runs compared against it:
+
+    python bench.py --size 100k --save-baseline
+    python bench.py --size 100k            # exits with status 1 on a regression
+
+Synthetic databases are kept in instance/bench/ and reused between runs
+(--rebuild makes a fresh one); the 1m inventory takes a few minutes to build.
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import random
+import resource
+import sys
+import time
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORKDIR = os.path.join(ROOT, 'instance', 'bench')
+
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+# Entries in the benchmark packlists (capped at the inventory size)
+PACKLIST_SIZES = [10, 100, 1000]
+TEMPLATE_SIZE = 50
+# Rows in the files posted to the import routes
+IMPORT_ROWS = 1000
+# Everything the write benchmarks create is named like this and removed afterwards
+SCRATCH = 'bench scratch'
+
+CATEGORIES = ['Shelter', 'Sleep', 'Kitchen', 'Water', 'Clothing', 'Electronics',
+              'First Aid', 'Navigation', 'Tools', 'Hygiene', 'Food', '']
+SEASONS = ['Summer', 'Winter', 'Spring', 'Fall', 'Summer, Fall', '']
+KEYWORDS = ['Backpacking', 'Car Camping', 'Base Gear', 'Food', 'Per Day', 'Rain',
+            'Freezing', 'Hot', 'Ultralight', 'Group', 'Kids', 'Fishing']
+NOUNS = ['Tent', 'Tarp', 'Quilt', 'Pad', 'Stove', 'Pot', 'Filter', 'Jacket',
+         'Headlamp', 'Knife', 'Map', 'Compass', 'Bivy', 'Pillow', 'Mug', 'Gloves']
+ADJECTIVES = ['Alpine', 'Trail', 'Summit', 'Canyon', 'River', 'Ridge', 'Forest', 'Desert']
+
+
+# ------------------------------------------------------------------------------
+# Loading the app against a benchmark database
+# ------------------------------------------------------------------------------
+def load_app(workdir, size, instrumented=False):
+    """
+    Imports app.py configured for the benchmark database of a size, with
+    uploads and the climate grid under workdir.  Must run before anything
+    else imports app.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.environ['FLASK_INSTRUMENTATION'] = 'true' if instrumented else 'false'
+    os.environ['FLASK_PROFILER_DIR'] = os.path.join(workdir, 'profiles')
+    os.environ['FLASK_JOB_FOLDER'] = os.path.join(workdir, 'jobs')
+    # No workers: a request runs the jobs it queued before it answers, so the
+    # job scenarios time the import or export itself, not just queueing it
+    os.environ['FLASK_JOB_WORKER_POOL'] = 'false'
+    os.environ['FLASK_JOB_WORKER_THREADS'] = '0'
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, f'inventory-{size}.db')
+    os.environ['FLASK_UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['FLASK_THUMBNAIL_FOLDER'] = os.path.join(workdir, 'uploads', 'thumbs')
+    os.environ['FLASK_CLIMATE_NORMALS_PATH'] = os.path.join(workdir, 'climate_normals.bin')
+    sys.path.insert(0, ROOT)
+    import app as gear
+    return gear
+
+
+class QueryCounter:
+    """Counts SQL statements sent to any engine (read-only and read-write)."""
+
+    def __init__(self, gear):
+        self.count = 0
+        gear.event.listen(gear.Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def reset_peak_rss():
+    """Resets the kernel's peak RSS mark for this process, where Linux allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (since the last reset, on Linux)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS, and can't be reset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# ------------------------------------------------------------------------------
+# Synthetic data
+# ------------------------------------------------------------------------------
+def synthetic_item(rng, number):
+    """Column values for one random but plausible item."""
+    keywords = rng.sample(KEYWORDS, rng.randint(0, 3))
+    return {
+        'item_number': f'BENCH-{number:07d}',
+        'name': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {number}',
+        'description': f'Synthetic item {number} for benchmarks.',
+        'weight': f'{rng.uniform(0.5, 80):.1f} oz',
+        'season': rng.choice(SEASONS) or None,
+        'keywords': ', '.join(keywords) or None,
+        'category': rng.choice(CATEGORIES) or None,
+        'quantity': rng.randint(1, 4),
+    }
+
+
+def build_database(gear, item_count, seed=1, batch_size=10_000):
+    """Fills an empty, migrated database with the synthetic inventory."""
+    db = gear.db
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for first in range(0, item_count, batch_size):
+        rows = [synthetic_item(rng, number) for number in range(first, min(first + batch_size, item_count))]
+        for row in rows:
+            row['weight_grams'] = gear.parse_weight(row['weight'])
+        db.session.execute(db.insert(gear.Item), rows)
+        db.session.commit()
+        print(f'  {first + len(rows)} items ({time.perf_counter() - started:.0f}s)', end='\r', flush=True)
+    print()
+
+    def add_packlist(name, size, is_template=False):
+        packlist = gear.PackList(name=name, is_template=is_template)
+        db.session.add(packlist)
+        db.session.flush()
+        item_ids = rng.sample(range(1, item_count + 1), min(size, item_count))
+        db.session.execute(db.insert(gear.PackListItem), [
+            {'packlist_id': packlist.id, 'item_id': item_id, 'item_quantity': rng.randint(1, 3)}
+            for item_id in item_ids
+        ])
+        return packlist
+
+    template = add_packlist('Bench Template', TEMPLATE_SIZE, is_template=True)
+    for size in PACKLIST_SIZES:
+        packlist = add_packlist(f'Bench {size}', size)
+        if size == 100:
+            gear.include_template(packlist.id, template.id)
+    db.session.commit()
+
+    locations = [
+        {'name': f'Bench Spot {number}', 'lat': round(rng.uniform(-60, 70), 5),
+         'lon': round(rng.uniform(-180, 180), 5), 'elevation_m': rng.randint(0, 3000)}
+        for number in range(max(1000, item_count // 100))
+    ]
+    db.session.execute(db.insert(gear.Location), locations)
+    db.session.commit()
+    db.session.execute(gear.text('ANALYZE'))
+    db.session.commit()
+
+
+def build_climate_grid(gear, path, step=1.0):
+    """A global climate grid with made-up, latitude-dependent normals."""
+    n_lat, n_lon = int(180 / step), int(360 / step)
+    with open(path, 'wb') as f:
+        f.write(gear.CLIMATE_HEADER.pack(gear.CLIMATE_MAGIC, -90 + step / 2, -180 + step / 2,
+                                         step, step, n_lat, n_lon))
+        for row in range(n_lat):
+            lat = -90 + (row + 0.5) * step
+            cell = b''
+            for month in range(12):
+                # Colder toward the poles, warmest in July up north and January down south
+                seasonal = 8 * math.sin((month - 3) / 6 * math.pi) * (1 if lat >= 0 else -1)
+                low = 20 - abs(lat) * 0.6 + seasonal
+                cell += gear.CLIMATE_MONTH.pack(low, low + 12, 40 + 30 * math.cos(month))
+            f.write(cell * n_lon)
+
+
+def import_files(gear, item_ids):
+    """
+    The CSV and GPX bodies posted by the import benchmarks.  The CSV holds
+    existing items exactly as they are, so importing it leaves them unchanged.
+    """
+    rng = random.Random(2)
+    stream = io.StringIO()
+    writer = csv.writer(stream)
+    writer.writerow(gear.CSV_COLUMNS)
+    items = gear.db.session.execute(gear.db.select(gear.Item).where(gear.Item.id.in_(item_ids))).scalars()
+    for item in items:
+        writer.writerow([getattr(item, name) for name in gear.CSV_COLUMNS])
+    gpx = ['<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">']
+    for number in range(IMPORT_ROWS):
+        gpx.append(f'<wpt lat="{rng.uniform(-60, 70):.5f}" lon="{rng.uniform(-180, 180):.5f}">'
+                   f'<name>{SCRATCH} {number}</name></wpt>')
+    gpx.append('</gpx>')
+    return stream.getvalue().encode(), ''.join(gpx).encode()
+
+
+# ------------------------------------------------------------------------------
+# Scenarios
+# ------------------------------------------------------------------------------
+# One benchmarked request.  `request(ctx)` returns keyword arguments for the
+# test client (path, method, data, ...); `setup(ctx)`, if given, runs untimed
+# before every request (e.g. to create the row a delete route removes) and can
+# return values for `request`.  Heavy scenarios run --heavy-iterations times.
+Scenario = namedtuple('Scenario', 'name endpoint request setup heavy', defaults=(None, False))
+
+
+class Context:
+    """Ids and files the scenarios need, plus helpers for untimed setup."""
+
+    def __init__(self, gear, item_count):
+        self.gear = gear
+        self.db = gear.db
+        self.item_count = item_count
+        PackList = gear.PackList
+        self.packlists = {
+            size: self.db.session.execute(
+                self.db.select(PackList.id).where(PackList.name == f'Bench {size}')
+            ).scalar_one()
+            for size in PACKLIST_SIZES
+        }
+        self.template_id = self.db.session.execute(
+            self.db.select(PackList.id).where(PackList.name == 'Bench Template')
+        ).scalar_one()
+        self.location_id = self.db.session.execute(self.db.select(self.db.func.min(gear.Location.id))).scalar()
+        self.item_id = 1
+        self.rng = random.Random(3)
+        self.serial = 0
+        self.csv, self.gpx = import_files(gear, self.item_ids(IMPORT_ROWS))
+        # A finished export for the job pages and the download
+        self.export_job = gear.enqueue_job('export_csv')
+        self.db.session.commit()
+        gear.run_job(gear.claim_job('bench', self.export_job))
+        # Written to by the benchmarks instead of the synthetic inventory
+        self.scratch_list = self.new_packlist()
+        self.scratch_item = self.new_row(gear.Item, item_number='SCRATCH-EDIT', name=SCRATCH,
+                                         weight='12 oz', quantity=1)
+        self.batch_items = [
+            {'id': item.id, 'quantity': item.quantity}
+            for item in self.db.session.execute(
+                self.db.select(gear.Item).where(gear.Item.id.in_(self.item_ids(100)))
+            ).scalars()
+        ]
+
+    def item_ids(self, count):
+        return self.rng.sample(range(1, self.item_count + 1), min(count, self.item_count))
+
+    def new_packlist(self, item_count=0):
+        packlist = self.gear.PackList(name=SCRATCH)
+        self.db.session.add(packlist)
+        self.db.session.flush()
+        if item_count:
+            self.db.session.execute(self.db.insert(self.gear.PackListItem), [
+                {'packlist_id': packlist.id, 'item_id': item_id, 'item_quantity': 1}
+                for item_id in self.item_ids(item_count)
+            ])
+        self.db.session.commit()
+        return packlist.id
+
+    def clear_scratch_list(self):
+        self.db.session.execute(self.db.delete(self.gear.PackListItem)
+                                .where(self.gear.PackListItem.packlist_id == self.scratch_list))
+        self.db.session.execute(self.db.delete(self.gear.PackListInclude)
+                                .where(self.gear.PackListInclude.packlist_id == self.scratch_list))
+        self.db.session.commit()
+
+    def scratch_entry(self):
+        """A fresh entry on the scratch list; returns (PackListItem id, item id)."""
+        self.clear_scratch_list()
+        item_id = self.item_ids(1)[0]
+        entry = self.gear.PackListItem(packlist_id=self.scratch_list, item_id=item_id, item_quantity=1)
+        self.db.session.add(entry)
+        self.db.session.commit()
+        return entry.id, item_id
+
+    def include_scratch_template(self):
+        self.gear.include_template(self.scratch_list, self.template_id)
+        self.db.session.commit()
+
+    def new_row(self, model, **values):
+        row = model(**values)
+        self.db.session.add(row)
+        self.db.session.commit()
+        return row.id
+
+    def next_serial(self):
+        self.serial += 1
+        return self.serial
+
+
+def remove_scratch(gear):
+    """Deletes everything the write benchmarks created."""
+    db = gear.db
+    packlist_ids = db.select(gear.PackList.id).where(gear.PackList.name.like(SCRATCH + '%'))
+    db.session.execute(db.delete(gear.PackListItem).where(gear.PackListItem.packlist_id.in_(packlist_ids)))
+    db.session.execute(db.delete(gear.PackList).where(gear.PackList.name.like(SCRATCH + '%')))
+    item_ids = db.select(gear.Item.id).where(gear.Item.name.like(SCRATCH + '%'))
+    db.session.execute(db.delete(gear.PackListItem).where(gear.PackListItem.item_id.in_(item_ids)))
+    db.session.execute(db.delete(gear.Item).where(gear.Item.name.like(SCRATCH + '%')))
+    db.session.execute(db.delete(gear.Location).where(gear.Location.name.like(SCRATCH + '%')))
+    # Every job in a benchmark database was queued by a benchmark
+    db.session.execute(db.delete(gear.Job))
+    db.session.commit()
+    folder = gear.app.config['JOB_FOLDER']
+    for name in os.listdir(folder) if os.path.isdir(folder) else ():
+        os.remove(os.path.join(folder, name))
+
+
+# Routes that answer 404 unless the app runs with INSTRUMENTATION
+INSTRUMENTATION_ENDPOINTS = {'metrics', 'toggle_profiler'}
+
+
+def scenarios():
+    """Every benchmarked request, named after the route (and variant) it exercises."""
+    def get(path):
+        return lambda ctx, *_: {'path': path(ctx) if callable(path) else path}
+
+    def post(path, **kwargs):
+        def request(ctx, prepared=None):
+            body = {name: value(ctx, prepared) if callable(value) else value for name, value in kwargs.items()}
+            return {'path': path(ctx, prepared) if callable(path) else path, 'method': 'POST', **body}
+        return request
+
+    def files(name, attribute):
+        return lambda ctx, _: {'file': (io.BytesIO(getattr(ctx, attribute)), name)}
+
+    ajax = {'X-Requested-With': 'XMLHttpRequest'}
+    small, medium, large = PACKLIST_SIZES
+    return [
+        # Inventory pages
+        Scenario('home', 'home', get('/')),
+        Scenario('home uncached', 'home', get('/'),
+                 setup=lambda ctx: ctx.gear.inventory_cache.clear()),
+        Scenario('home search', 'home', get('/?filter_text=alpine+tent&sort=weight')),
+        Scenario('add_item form', 'add_item', get('/add')),
+        Scenario('add_item', 'add_item', post('/add', data=lambda ctx, _: {
+            'name': f'{SCRATCH} {ctx.next_serial()}', 'weight': '12 oz', 'quantity': '1'})),
+        Scenario('edit_item form', 'edit_item', get(lambda ctx: f'/edit/{ctx.item_id}')),
+        Scenario('edit_item', 'edit_item', post(lambda ctx, _: f'/edit/{ctx.scratch_item}', data={
+            'name': SCRATCH, 'weight': '12 oz', 'quantity': '1'})),
+        Scenario('delete_item', 'delete_item', post(lambda ctx, item_id: f'/delete/{item_id}'),
+                 setup=lambda ctx: ctx.new_row(ctx.gear.Item, item_number=f'SCRATCH-{ctx.next_serial()}',
+                                               name=SCRATCH)),
+        Scenario('export_csv', 'export_csv', get('/export_csv'), heavy=True),
+        Scenario('import_csv form', 'import_csv', get('/import_csv')),
+        Scenario('import_csv', 'import_csv', post('/import_csv', data=files('items.csv', 'csv')), heavy=True),
+        Scenario('export_csv job', 'export_csv', post('/export_csv'), heavy=True),
+
+        # Packlist pages
+        Scenario('view_packlists', 'view_packlists', get('/packlists')),
+        Scenario('create_packlist form', 'create_packlist', get('/packlist/create')),
+        Scenario('create_packlist', 'create_packlist', post('/packlist/create', data={'name': SCRATCH})),
+        Scenario('generate_packlist form', 'generate_packlist_page', get('/packlist/generate')),
+        Scenario('generate_packlist', 'generate_packlist_page', post('/packlist/generate', data={
+            'name': SCRATCH, 'season': 'Summer', 'styles': ['Backpacking', 'Food'], 'days': '3',
+            'lat': '44.4', 'lon': '-110.6', 'start': '2025-07-01'})),
+        *[Scenario(f'show_packlist {size}', 'show_packlist',
+                   get(lambda ctx, size=size: f'/packlist/{ctx.packlists[size]}'))
+          for size in PACKLIST_SIZES],
+        Scenario(f'packlist_editor {large}', 'packlist_editor',
+                 get(lambda ctx: f'/packlist/{ctx.packlists[large]}/editor')),
+        Scenario('delete_packlist', 'delete_packlist',
+                 post(lambda ctx, packlist_id: f'/packlist/{packlist_id}/delete'),
+                 setup=lambda ctx: ctx.new_packlist(small)),
+        Scenario(f'clear_packlist {medium}', 'clear_packlist',
+                 post(lambda ctx, packlist_id: f'/packlist/{packlist_id}/clear', headers=ajax),
+                 setup=lambda ctx: ctx.new_packlist(medium)),
+        Scenario(f'add_to_packlist {medium}', 'add_to_packlist', post('/add_to_packlist', headers=ajax, data=lambda ctx, _: {
+            'packlist_id': ctx.scratch_list, 'selected_items': ctx.item_ids(medium)}),
+                 setup=lambda ctx: ctx.clear_scratch_list()),
+        Scenario('remove_item_from_packlist', 'remove_item_from_packlist',
+                 post(lambda ctx, entry: f'/packlist/{ctx.scratch_list}/remove_item/{entry[0]}', headers=ajax),
+                 setup=lambda ctx: ctx.scratch_entry()),
+        Scenario('leave_out_item', 'leave_out_item',
+                 post(lambda ctx, entry: f'/packlist/{ctx.scratch_list}/leave_out/{entry[1]}', headers=ajax),
+                 setup=lambda ctx: ctx.scratch_entry()),
+        Scenario('add_template_to_packlist', 'add_template_to_packlist',
+                 post(lambda ctx, _: f'/packlist/{ctx.scratch_list}/templates',
+                      data=lambda ctx, _: {'template_id': ctx.template_id}),
+                 setup=lambda ctx: ctx.clear_scratch_list()),
+        Scenario('remove_template_from_packlist', 'remove_template_from_packlist',
+                 post(lambda ctx, _: f'/packlist/{ctx.scratch_list}/templates/{ctx.template_id}/remove'),
+                 setup=lambda ctx: ctx.include_scratch_template()),
+        Scenario('set_packlist_location', 'set_packlist_location',
+                 post(lambda ctx, _: f'/packlist/{ctx.scratch_list}/location',
+                      data=lambda ctx, _: {'location_id': ctx.location_id})),
+
+        # Locations
+        Scenario('view_locations', 'view_locations', get('/locations?lat=44.4&lon=-110.6&k=20')),
+        Scenario('import_locations', 'import_locations_page',
+                 post('/locations/import', data=files('spots.gpx', 'gpx')), heavy=True),
+        Scenario('delete_location', 'delete_location',
+                 post(lambda ctx, location_id: f'/locations/{location_id}/delete'),
+                 setup=lambda ctx: ctx.new_row(ctx.gear.Location, name=f'{SCRATCH} {ctx.next_serial()}',
+                                               lat=1.0, lon=1.0)),
+
+        # JSON API
+        Scenario('api items', 'api_list_items', get('/api/v1/items?limit=100')),
+        Scenario('api items search', 'api_list_items', get('/api/v1/items?q=ridge&fields=name,weight_grams')),
+        Scenario('api item', 'api_get_item', get(lambda ctx: f'/api/v1/items/{ctx.item_id}')),
+        Scenario('api items batch', 'api_batch_items', post('/api/v1/items/batch', json=lambda ctx, _: {
+            'update': ctx.batch_items})),
+        Scenario('api packlists', 'api_list_packlists', get('/api/v1/packlists')),
+        Scenario('api rollups', 'api_packlist_rollups', get('/api/v1/packlists/rollups')),
+        Scenario('api tags', 'api_list_tags', get('/api/v1/tags')),
+        Scenario('api generate', 'api_generate_packlist', post('/api/v1/packlists/generate', json={
+            'name': SCRATCH, 'styles': ['Car Camping'], 'days': 2, 'lat': 60.1, 'lon': 10.7,
+            'start': '2025-01-10'})),
+        Scenario('api climate', 'api_climate', get('/api/v1/climate?lat=44.4&lon=-110.6&start=2025-07-01&days=5')),
+        Scenario('api locations bbox', 'api_list_locations', get('/api/v1/locations?bbox=-125,30,-100,50')),
+        Scenario('api locations nearest', 'api_nearest_locations',
+                 get('/api/v1/locations/nearest?lat=44.4&lon=-110.6&k=10')),
+        Scenario('api location', 'api_get_location', get(lambda ctx: f'/api/v1/locations/{ctx.location_id}')),
+        Scenario('api locations import', 'api_import_locations',
+                 post('/api/v1/locations/import', data=files('spots.gpx', 'gpx')), heavy=True),
+        Scenario('api locations batch', 'api_batch_locations', post('/api/v1/locations/batch', json=lambda ctx, _: {
+            'create': [{'name': f'{SCRATCH} {ctx.next_serial()}', 'lat': 2.0, 'lon': 2.0}]})),
+        Scenario(f'api packlist {large}', 'api_get_packlist',
+                 get(lambda ctx: f'/api/v1/packlists/{ctx.packlists[large]}')),
+        Scenario('api packlists batch', 'api_batch_packlists', post('/api/v1/packlists/batch', json={
+            'create': [{'name': SCRATCH}] * 10})),
+        Scenario(f'api packlist items {medium}', 'api_packlist_items',
+                 post(lambda ctx, _: f'/api/v1/packlists/{ctx.scratch_list}/items',
+                      json=lambda ctx, _: {'add': ctx.item_ids(medium)}),
+                 setup=lambda ctx: ctx.clear_scratch_list()),
+        Scenario('api packlist templates', 'api_packlist_templates',
+                 post(lambda ctx, _: f'/api/v1/packlists/{ctx.scratch_list}/templates',
+                      json=lambda ctx, _: {'add': [ctx.template_id]}),
+                 setup=lambda ctx: ctx.clear_scratch_list()),
+
+        # Background jobs (run inline by the request that queues them)
+        Scenario('view_jobs', 'view_jobs', get('/jobs')),
+        Scenario('show_job', 'show_job', get(lambda ctx: f'/jobs/{ctx.export_job}')),
+        Scenario('download_job_file', 'download_job_file', get(lambda ctx: f'/jobs/{ctx.export_job}/download'),
+                 heavy=True),
+        Scenario('api items import', 'api_import_items', post('/api/v1/items/import', data=files('items.csv', 'csv')),
+                 heavy=True),
+        Scenario('api items export', 'api_export_items', post('/api/v1/items/export'), heavy=True),
+        Scenario('api jobs', 'api_list_jobs', get('/api/v1/jobs')),
+        Scenario('api job', 'api_get_job', get(lambda ctx: f'/api/v1/jobs/{ctx.export_job}')),
+
+        # Instrumentation (only with --instrumented)
+        Scenario('metrics', 'metrics', get('/metrics')),
+        Scenario('toggle_profiler', 'toggle_profiler', post('/metrics/profiler', data={'enabled': '0'})),
+    ]
+
+
+# ------------------------------------------------------------------------------
+# Running and reporting
+# ------------------------------------------------------------------------------
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(app, ctx, counter, scenario, iterations, warmup):
+    """
+    Times one scenario; returns its stats dict.  Each scenario gets its own
+    client, so flash messages left by a POST don't end up on the next page.
+    """
+    client = app.test_client()
+    latencies = []
+    queries = []
+    reset_peak_rss()
+    for iteration in range(warmup + iterations):
+        prepared = scenario.setup(ctx) if scenario.setup else None
+        ctx.db.session.remove()
+        kwargs = scenario.request(ctx, prepared)
+        before = counter.count
+        started = time.perf_counter()
+        response = client.open(**kwargs)
+        response.get_data()   # drain streamed responses (CSV export)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{scenario.name}: {kwargs["path"]} answered {response.status_code}')
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(counter.count - before)
+        response.close()
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p90_ms': round(percentile(latencies, 0.90), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'queries': max(queries),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Scenarios slower, chattier or hungrier than the baseline: median latency
+    up by more than `tolerance` (and at least 1 ms), more SQL statements, or
+    peak RSS up by more than `tolerance` (and at least 5 MB).  The tail
+    percentiles are reported but too noisy to judge on.
+    """
+    found = {}
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        problems = []
+        if stats['p50_ms'] > base['p50_ms'] * (1 + tolerance) and stats['p50_ms'] - base['p50_ms'] >= 1:
+            problems.append(f"p50_ms {base['p50_ms']} -> {stats['p50_ms']}")
+        if stats['queries'] > base['queries']:
+            problems.append(f"queries {base['queries']} -> {stats['queries']}")
+        if (stats['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance)
+                and stats['peak_rss_mb'] - base['peak_rss_mb'] >= 5):
+            problems.append(f"peak_rss_mb {base['peak_rss_mb']} -> {stats['peak_rss_mb']}")
+        if problems:
+            found[name] = problems
+    return found
+
+
+def print_table(results, baseline):
+    columns = ('p50_ms', 'p90_ms', 'p99_ms', 'mean_ms', 'queries', 'peak_rss_mb')
+    width = max(len(name) for name in results)
+    print(f"{'scenario':<{width}}  " + '  '.join(f'{column:>11}' for column in columns) + '  vs baseline p50')
+    for name, stats in results.items():
+        line = f'{name:<{width}}  ' + '  '.join(f'{stats[column]:>11}' for column in columns)
+        base = baseline.get(name)
+        if base and base['p50_ms']:
+            line += f"  {(stats['p50_ms'] / base['p50_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route of the camping gear app.')
+    parser.add_argument('--size', choices=sorted(SIZES, key=SIZES.get), default='1k',
+                        help='synthetic inventory size (default: 1k)')
+    parser.add_argument('--iterations', type=int, default=50, help='timed requests per scenario')
+    parser.add_argument('--heavy-iterations', type=int, default=5,
+                        help='timed requests for heavy scenarios (imports, exports)')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests before each scenario')
+    parser.add_argument('--only', metavar='TEXT', help='run only scenarios whose name contains TEXT')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='where benchmark databases are kept')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the synthetic database first')
+    parser.add_argument('--baseline', help='baseline file (default: WORKDIR/baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown before a regression is reported (default: 0.2 = 20%%)')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE')
+    parser.add_argument('--instrumented', action='store_true',
+                        help='run with INSTRUMENTATION on, to measure its overhead (kept as a separate baseline)')
+    args = parser.parse_args(argv)
+
+    database = os.path.join(args.workdir, f'inventory-{args.size}.db')
+    if args.rebuild:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+    fresh = not os.path.exists(database)
+    gear = load_app(args.workdir, args.size, args.instrumented)
+    app = gear.app
+
+    with app.app_context():
+        gear.migrate_database()
+        if fresh:
+            print(f'Building the {args.size} synthetic inventory in {database} ...')
+            build_database(gear, SIZES[args.size])
+        if not os.path.exists(app.config['CLIMATE_NORMALS_PATH']):
+            build_climate_grid(gear, app.config['CLIMATE_NORMALS_PATH'])
+        remove_scratch(gear)
+        item_count = gear.db.session.execute(gear.db.select(gear.db.func.max(gear.Item.id))).scalar()
+        ctx = Context(gear, item_count)
+
+    skipped = set() if args.instrumented else INSTRUMENTATION_ENDPOINTS
+    selected = [s for s in scenarios()
+                if s.endpoint not in skipped and (not args.only or args.only in s.name)]
+    missing = ({rule.endpoint for rule in app.url_map.iter_rules()} - {'static'}
+               - {s.endpoint for s in scenarios()})
+    if missing:
+        print(f"Warning: no benchmark for route(s): {', '.join(sorted(missing))}")
+
+    counter = QueryCounter(gear)
+    results = {}
+    with app.app_context():
+        try:
+            for scenario in selected:
+                iterations = args.heavy_iterations if scenario.heavy else args.iterations
+                results[scenario.name] = run_scenario(app, ctx, counter, scenario, iterations, args.warmup)
+                print(f'  {scenario.name}: p50 {results[scenario.name]["p50_ms"]} ms', flush=True)
+        finally:
+            gear.db.session.remove()
+            remove_scratch(gear)
+
+    baseline_path = args.baseline or os.path.join(args.workdir, 'baseline.json')
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+    # Instrumented runs are slower by design, so they get a baseline of their own
+    key = args.size + ('-instrumented' if args.instrumented else '')
+    baseline = baselines.get(key, {})
+
+    print()
+    print_table(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': args.size, 'instrumented': args.instrumented, 'results': results}, f, indent=2)
+
+    if args.save_baseline:
+        baselines[key] = {**baseline, **results}
+        with open(baseline_path, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'\nSaved the {key} baseline to {baseline_path}.')
+        return 0
+    if not baseline:
+        print(f'\nNo {key} baseline in {baseline_path} yet; run with --save-baseline to store one.')
+        return 0
+    found = regressions(results, baseline, args.tolerance)
+    if not found:
+        print(f'\nNo regressions against the baseline (tolerance {args.tolerance:.0%}).')
+        return 0
+    print(f'\n{len(found)} regression(s) against the baseline:')
+    for name, problems in found.items():
+        print(f"  {name}: {'; '.join(problems)}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Shared fixtures.  app.py reads its settings from FLASK_* environment
+variables when it is imported, so they are pointed at a scratch directory
+here, before any test module imports it.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='camping-gear-tests-')
+
+os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(WORKDIR, 'test.db')
+os.environ['FLASK_UPLOAD_FOLDER'] = os.path.join(WORKDIR, 'uploads')
+os.environ['FLASK_THUMBNAIL_FOLDER'] = os.path.join(WORKDIR, 'uploads', 'thumbs')
+os.environ['FLASK_JOB_FOLDER'] = os.path.join(WORKDIR, 'jobs')
+os.environ['FLASK_JOB_WORKER_THREADS'] = '0'
+os.environ['FLASK_CLIMATE_NORMALS_PATH'] = os.path.join(WORKDIR, 'climate_normals.bin')
+sys.path.insert(0, ROOT)
+
+import app as gear  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    gear.app.config['TESTING'] = True
+    with gear.app.app_context():
+        gear.migrate_database()
+    return gear.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,71 @@
+"""ClimateGrid.cell(): points snap to the nearest cell, up to half a step off the grid's edges."""
+import math
+
+import pytest
+
+import app as gear
+
+
+def write_grid(path, lat0, lon0, step, n_lat, n_lon):
+    """A grid file with the given extent; every cell holds the same normals."""
+    with open(path, 'wb') as f:
+        f.write(gear.CLIMATE_HEADER.pack(gear.CLIMATE_MAGIC, lat0, lon0, step, step, n_lat, n_lon))
+        f.write(gear.CLIMATE_MONTH.pack(-5.0, 10.0, 50.0) * (12 * n_lat * n_lon))
+    return gear.ClimateGrid(str(path))
+
+
+@pytest.fixture
+def regional_grid(tmp_path):
+    # 40..42 N, 10..12 W in half-degree steps: 5 x 5 cells, not wrapping
+    return write_grid(tmp_path / 'regional.bin', 40.0, -12.0, 0.5, 5, 5)
+
+
+def test_cell_inside_grid(regional_grid):
+    assert regional_grid.cell(40.0, -12.0) == (0, 0)
+    assert regional_grid.cell(41.1, -10.9) == (2, 2)
+    assert regional_grid.cell(42.0, -10.0) == (4, 4)
+
+
+def test_cell_half_a_step_west_of_lon0(regional_grid):
+    assert regional_grid.cell(41.0, -12.0 - 0.5 / 2) == (2, 0)
+    assert regional_grid.cell(41.0, -12.1) == (2, 0)
+
+
+def test_cell_half_a_step_east_of_last_column(regional_grid):
+    assert regional_grid.cell(41.0, -10.0 + 0.2) == (2, 4)
+
+
+@pytest.mark.parametrize('lat, lon', [
+    (41.0, -12.3),    # more than half a step west
+    (41.0, -9.7),     # more than half a step east
+    (39.7, -11.0),    # more than half a step south
+    (42.3, -11.0),    # more than half a step north
+    (41.0, 170.0),    # the other side of the world
+])
+def test_cell_off_grid(regional_grid, lat, lon):
+    assert regional_grid.cell(lat, lon) is None
+
+
+def test_cell_wraps_around_for_a_global_grid(tmp_path):
+    grid = write_grid(tmp_path / 'global.bin', -90.0, -180.0, 1.0, 181, 360)
+    assert grid.wraps
+    assert grid.cell(0.0, 179.8) == (90, 0)     # nearest column is across the date line
+    assert grid.cell(0.0, -180.4) == (90, 0)
+    assert grid.cell(0.0, 180.0) == (90, 0)
+    assert not math.isnan(grid.normals(90, 0, 1).low_c)
+
+
+@pytest.mark.parametrize('lat, lon, error', [
+    (41.0, -11.0, None),
+    (None, None, None),
+    (float('nan'), -11.0, 'lat and lon must be finite numbers'),
+    (41.0, float('inf'), 'lat and lon must be finite numbers'),
+    (91.0, -11.0, 'lat must be between -90 and 90'),
+])
+def test_coordinate_error(lat, lon, error):
+    assert gear.coordinate_error(lat, lon) == error
+
+
+def test_climate_api_rejects_nan(client):
+    response = client.get('/api/v1/climate?lat=nan&lon=-11')
+    assert response.status_code == 400
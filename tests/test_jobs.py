@@ -0,0 +1,33 @@
+"""Jobs queued by a request run before it answers unless workers serve the queue."""
+import io
+
+import pytest
+
+import app as gear
+
+CSV = b'item_number,name,weight,quantity\nJOB-1,Inline Stove,12 oz,1\n'
+
+
+def import_csv(client):
+    response = client.post('/api/v1/items/import', data={'file': (io.BytesIO(CSV), 'items.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    return client.get(response.headers['Location']).get_json()
+
+
+@pytest.fixture
+def worker_pool(app):
+    app.config['JOB_WORKER_POOL'] = True
+    yield
+    app.config['JOB_WORKER_POOL'] = False
+
+
+def test_import_runs_inline_without_workers(app, client):
+    job = import_csv(client)
+    assert job['status'] == 'done'
+    with app.app_context():
+        assert gear.Item.query.filter_by(item_number='JOB-1').one().name == 'Inline Stove'
+
+
+def test_import_waits_for_the_worker_pool(app, client, worker_pool):
+    assert import_csv(client)['status'] == 'queued'
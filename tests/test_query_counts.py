@@ -0,0 +1,75 @@
+"""
+The packlist pages must load in a fixed number of queries, however many
+entries a packlist has (no per-entry lazy loads creeping back in).
+"""
+import contextlib
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import app as gear
+
+
+@contextlib.contextmanager
+def count_statements():
+    """Counts SQL statements sent to any engine (read-only and read-write)."""
+    counter = {'count': 0}
+
+    def on_execute(*args):
+        counter['count'] += 1
+
+    event.listen(Engine, 'before_cursor_execute', on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, 'before_cursor_execute', on_execute)
+
+
+def make_packlist(app, name, entries):
+    """
+    A packlist holding `entries` new items, each in its own category.  Uses
+    its own app context, so the requests under test don't share flask.g with it.
+    """
+    with app.app_context():
+        return _make_packlist(gear.db.session, name, entries)
+
+
+def _make_packlist(session, name, entries):
+    items = [
+        gear.Item(item_number=f'{name}-{i}', name=f'{name} item {i}', weight=f'{i + 1} oz',
+                  category=f'{name} category {i}', quantity=1)
+        for i in range(entries)
+    ]
+    packlist = gear.PackList(name=name)
+    session.add_all(items + [packlist])
+    session.flush()
+    session.add_all(gear.PackListItem(packlist_id=packlist.id, item_id=item.id, item_quantity=2)
+                    for item in items)
+    session.commit()
+    return packlist.id
+
+
+def statements_for(client, path):
+    with count_statements() as counter:
+        response = client.get(path)
+    assert response.status_code == 200
+    return counter['count']
+
+
+@pytest.mark.parametrize('entries', [10, 50])
+def test_show_packlist_query_count_is_constant(app, client, entries):
+    small = make_packlist(app, f'small-{entries}', 1)
+    large = make_packlist(app, f'large-{entries}', entries)
+
+    assert statements_for(client, f'/packlist/{small}') == statements_for(client, f'/packlist/{large}')
+
+
+def test_view_packlists_query_count_is_constant(app, client):
+    make_packlist(app, 'overview-small', 1)
+    one_entry = statements_for(client, '/packlists')
+
+    make_packlist(app, 'overview-large', 40)
+    many_entries = statements_for(client, '/packlists')
+
+    assert one_entry == many_entries
@@ -0,0 +1,67 @@
+"""release_upload(): an upload is deleted only when no item refers to it, however the path is spelled."""
+import io
+import os
+
+import pytest
+
+import app as gear
+
+
+def add_item(client, name, image=None):
+    data = {'name': name, 'quantity': '1'}
+    if image is not None:
+        data['image'] = (io.BytesIO(image), 'photo.png')
+    response = client.post('/add', data=data, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def item_with(app, name, **values):
+    with app.app_context():
+        item = gear.Item.query.filter_by(name=name).one()
+        for key, value in values.items():
+            setattr(item, key, value)
+        gear.db.session.commit()
+        return item.id, item.image_path
+
+
+def delete_item(client, item_id):
+    assert client.post(f'/delete/{item_id}').status_code == 302
+
+
+@pytest.fixture
+def upload(app, client, request):
+    """An item holding a fresh upload: (item id, image_path, file on disk)."""
+    add_item(client, request.node.name, image=request.node.name.encode())
+    item_id, image_path = item_with(app, request.node.name)
+    with app.app_context():
+        path = gear.upload_abspath(image_path)
+    assert gear.CONTENT_ADDRESSED_RE.search(image_path.replace('\\', '/')) and os.path.exists(path)
+    return item_id, image_path, path
+
+
+def test_last_reference_deletes_the_file(client, upload):
+    item_id, _, path = upload
+    delete_item(client, item_id)
+    assert not os.path.exists(path)
+
+
+def test_reference_with_backslashes_keeps_the_file(app, client, upload):
+    item_id, image_path, path = upload
+    add_item(client, 'windows-import')
+    other_id, _ = item_with(app, 'windows-import', image_path=image_path.replace('/', '\\'))
+
+    delete_item(client, item_id)
+    assert os.path.exists(path)
+    delete_item(client, other_id)
+    assert not os.path.exists(path)
+
+
+def test_paths_that_are_not_content_addressed_are_left_alone(app, client):
+    loose = os.path.join(app.config['UPLOAD_FOLDER'], 'tent.png')
+    with open(loose, 'wb') as f:
+        f.write(b'not ours')
+    add_item(client, 'csv-import')
+    item_id, _ = item_with(app, 'csv-import', image_path='C:\\photos\\tent.png')
+
+    delete_item(client, item_id)
+    assert os.path.exists(loose)
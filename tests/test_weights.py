@@ -0,0 +1,30 @@
+"""parse_weight(): free-form weight text to grams."""
+import pytest
+
+import app as gear
+
+
+@pytest.fixture(autouse=True)
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+@pytest.mark.parametrize('text, grams', [
+    ('10 oz', 283.5),
+    ('1.5kg', 1500.0),
+    ('1,5 kg', 1500.0),              # decimal comma
+    ('2 lb 4 oz', 1020.58),
+    ('2 lb, 4 oz', 1020.58),
+    ('1,000 g', 1000.0),             # thousands separator
+    ('1,234,567 g', 1234567.0),
+    ('1,000.5 g', 1000.5),
+    ('1,0000 g', 1.0),               # not a thousands group: a decimal comma
+])
+def test_parse_weight(text, grams):
+    assert gear.parse_weight(text) == grams
+
+
+@pytest.mark.parametrize('text', ['', None, 'heavy', '3 stone'])
+def test_parse_weight_rejects_what_it_cannot_read(text):
+    assert gear.parse_weight(text) is None